@@ -17,6 +17,11 @@ class Proxy:
         return self._refobj.__class__
 
     def _replace(self, refobj):
+        # Only the selected implementation keeps its arrays in the state block
+        if isinstance(self._refobj, TrafficArrays):
+            self._refobj.attachblock(False)
+        if isinstance(refobj, TrafficArrays):
+            refobj.attachblock()
         # Replace our reference object
         self.__dict__['_refobj'] = refobj
         # First clear all proxied functions/methods
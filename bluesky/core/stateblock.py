@@ -0,0 +1,245 @@
+''' Columnar storage of the numpy traffic arrays of all TrafficArrays objects. '''
+import sys
+import numpy as np
+
+
+# Minimum number of aircraft for which the block is allocated
+MINCAPACITY = 16
+# Alignment of the column groups in the buffer [bytes]
+ALIGNMENT = 64
+# Maximum number of deleted aircraft for which the remaining elements are
+# moved per segment, instead of with a boolean mask
+MAXSEGMENTS = 8
+
+
+def checkrefcounts():
+    ''' True when sys.getrefcount counts the references to a buffer and its
+        views as the in-place modification of traffic array buffers expects.
+        This is an implementation detail of CPython: other interpreters may
+        not have getrefcount, or count (deferred) references differently. '''
+    getrefcount = getattr(sys, 'getrefcount', None)
+    if getrefcount is None:
+        return False
+    store = dict(buffer=np.zeros(MINCAPACITY))
+    store['view'] = store['buffer'][:1]
+    # References: the dict, the view (only for the buffer) and the argument
+    if getrefcount(store['buffer']) != 3 or getrefcount(store['view']) != 2:
+        return False
+    # Another reference to the view, and a view on the view
+    ref = store['view']
+    sub = ref[1:]
+    return getrefcount(store['view']) == 3 and getrefcount(store['buffer']) == 4
+
+
+# Buffers are only modified in place when reference counts can be relied on
+REFCOUNTS = checkrefcounts()
+
+
+def groupview(buffer, offset, key, shape):
+    ''' Return the group of columns of type and element shape key, with
+        shape (ncolumns, capacity), at offset in buffer. '''
+    dtype, elshape = key
+    size = shape[0] * shape[1] * int(np.prod(elshape))
+    return buffer[offset:].view(dtype)[:size].reshape(shape + elshape)
+
+
+class StateBlock:
+    ''' Columnar store for the per-aircraft numpy arrays of a tree of
+        TrafficArrays objects.
+
+        Columns with the same type and element shape are the rows of one
+        [ncolumns x capacity x element shape] array, and these groups are
+        consecutive parts of one contiguous buffer. Each traffic array
+        attribute is a contiguous view of length ntraf on its column, so
+        creating and deleting aircraft, and copying the state, are a few
+        operations on the groups instead of one per array.
+
+        Attributes that are replaced by assignment are copied back into
+        their column at the next create, delete or snapshot. As with the
+        separate traffic arrays, the attributes are only valid until the
+        next create, delete or reset, and a copy should be stored to keep
+        their values (snapshot returns one). As a safeguard, the buffer is
+        reallocated instead of modified in place when other references to
+        it exist, or always when reference counts can't be relied on. '''
+
+    def __init__(self, root):
+        self.root = root
+        self.ntraf = 0
+        self.capacity = 0
+        self.buffer = np.zeros(0, dtype=np.uint8)
+        # Columns as (object, attribute name), in order of registration
+        self.columns = []
+        # Group key (dtype, element shape) and row of each column
+        self.rows = dict()
+        # Group arrays and their offset in the buffer by key, and the
+        # current view of each column
+        self.groups = dict()
+        self.offsets = dict()
+        self.views = dict()
+
+    @staticmethod
+    def accepts(arr):
+        ''' True when arr can be stored in a state block. '''
+        return arr.dtype.kind in 'biufcSU'
+
+    @staticmethod
+    def groupkey(arr):
+        ''' Columns are grouped by type and element shape. '''
+        return arr.dtype, arr.shape[1:]
+
+    def add(self, obj, names):
+        ''' Add the arrays names of TrafficArrays object obj as columns. '''
+        self.columns.extend((obj, name) for name in names)
+        self.allocate(max(self.capacity, MINCAPACITY))
+
+    def remove(self, obj):
+        ''' Remove the columns of TrafficArrays object obj. Its attributes
+            become separate arrays with their current values. Returns the
+            names of the removed columns. '''
+        names = [name for o, name in self.columns if o is obj]
+        if names:
+            self.columns = [col for col in self.columns if col[0] is not obj]
+            for name in names:
+                obj.__dict__[name] = obj.__dict__[name].copy()
+            self.allocate(max(self.capacity, MINCAPACITY))
+        return names
+
+    def allocate(self, capacity):
+        ''' Allocate a new buffer for capacity aircraft, and copy the
+            current contents of all arrays into it. The layout follows the
+            current type and element shape of the attributes. '''
+        layout = dict()
+        for col in self.columns:
+            layout.setdefault(self.groupkey(col[0].__dict__[col[1]]), []).append(col)
+
+        offsets = dict()
+        nbytes = 0
+        for (dtype, shape), cols in layout.items():
+            offsets[(dtype, shape)] = nbytes
+            size = len(cols) * capacity * int(np.prod(shape)) * dtype.itemsize
+            nbytes += -(-size // ALIGNMENT) * ALIGNMENT
+
+        buffer = np.zeros(nbytes, dtype=np.uint8)
+        groups = dict()
+        rows = dict()
+        for key, cols in layout.items():
+            groups[key] = groupview(buffer, offsets[key], key, (len(cols), capacity))
+            for row, col in enumerate(cols):
+                rows[col] = (key, row)
+                arr = col[0].__dict__[col[1]]
+                nkeep = min(len(arr), self.ntraf)
+                groups[key][row, :nkeep] = arr[:nkeep]
+
+        self.buffer, self.groups, self.offsets = buffer, groups, offsets
+        self.rows, self.capacity = rows, capacity
+        self.setviews()
+
+    def setviews(self):
+        ''' Make all attributes views of length ntraf on their column. '''
+        views = dict()
+        for col in self.columns:
+            key, row = self.rows[col]
+            views[col] = col[0].__dict__[col[1]] = self.groups[key][row, :self.ntraf]
+        self.views = views
+
+    def isunshared(self):
+        ''' True when the buffer is only referenced by this block, its
+            groups, and the column views held by the block and (when they
+            were not replaced) the attributes. Always False when reference
+            counts can't be relied on, so that the buffer is reallocated. '''
+        if not REFCOUNTS:
+            return False
+        # getrefcount counts its own argument as well
+        if sys.getrefcount(self.buffer) != 2 + len(self.groups) + len(self.views):
+            return False
+        for obj, name in self.views:
+            # References: the views dict, the attribute and the argument
+            if sys.getrefcount(self.views[obj, name]) != \
+                    2 + (obj.__dict__[name] is self.views[obj, name]):
+                return False
+        return True
+
+    def sync(self, capacity):
+        ''' Make sure that the buffer has room for capacity aircraft, and
+            contains the current values of all attributes, also when they
+            were replaced by assignment. Reallocates when needed. '''
+        replaced = [col for col in self.columns if col[0].__dict__[col[1]] is not self.views[col]]
+        if capacity > self.capacity or not self.isunshared() or \
+                any(self.groupkey(col[0].__dict__[col[1]]) != self.rows[col][0] or
+                    len(col[0].__dict__[col[1]]) != self.ntraf for col in replaced):
+            self.allocate(max(2 * capacity, MINCAPACITY) if capacity > self.capacity
+                          else self.capacity)
+            return
+        for col in replaced:
+            self.views[col][:] = col[0].__dict__[col[1]]
+            col[0].__dict__[col[1]] = self.views[col]
+
+    def create(self, n=1):
+        ''' Append n aircraft with default values to all columns. '''
+        nold = self.ntraf
+        self.sync(nold + n)
+        for group in self.groups.values():
+            # Defaults are zero for all types in a block, also empty strings
+            group[:, nold:nold + n] = np.zeros((), dtype=group.dtype)
+        self.ntraf += n
+        self.setviews()
+
+    def delete(self, idx):
+        ''' Delete aircraft idx from all columns. '''
+        self.sync(self.ntraf)
+        keep = np.ones(self.ntraf, dtype=bool)
+        keep[idx] = False
+        delidx = np.flatnonzero(~keep)
+        for group in self.groups.values():
+            if len(delidx) <= MAXSEGMENTS:
+                for i, start in enumerate(delidx):
+                    stop = delidx[i + 1] if i + 1 < len(delidx) else self.ntraf
+                    group[:, start - i:stop - i - 1] = group[:, start + 1:stop]
+            else:
+                group[:, :self.ntraf - len(delidx)] = group[:, :self.ntraf][:, keep]
+        self.ntraf -= len(delidx)
+        self.setviews()
+
+    def reset(self):
+        ''' Delete all aircraft, and release the buffer. '''
+        self.ntraf = 0
+        self.allocate(MINCAPACITY)
+
+    def paths(self):
+        ''' Return the attribute path from the root of each column, for
+            example 'lat' or 'cd.rpz'. '''
+        prefix = {id(self.root): ''}
+        todo = [self.root]
+        while todo:
+            obj = todo.pop()
+            for name, value in vars(obj).items():
+                # Replaceable children are reached through their proxy
+                child = getattr(value, '__dict__', {}).get('_refobj', value)
+                if any(child is c for c in obj._children) and id(child) not in prefix:
+                    prefix[id(child)] = prefix[id(obj)] + name + '.'
+                    todo.append(child)
+        return [prefix.get(id(obj), type(obj).__name__ + '.') + name
+                for obj, name in self.columns]
+
+    def snapshot(self):
+        ''' Return a copy of the state of all columns, as a dict of arrays
+            by attribute path. The data is copied as one buffer. '''
+        self.sync(self.ntraf)
+        buffer = self.buffer.copy()
+        state = dict()
+        groups = {key: groupview(buffer, self.offsets[key], key, group.shape[:2])
+                  for key, group in self.groups.items()}
+        for path, col in zip(self.paths(), self.columns):
+            key, row = self.rows[col]
+            state[path] = groups[key][row, :self.ntraf]
+        return state
+
+    def restore(self, state):
+        ''' Restore a snapshot of the same aircraft. '''
+        if any(len(arr) != self.ntraf for arr in state.values()):
+            raise ValueError('State block snapshot has a different number of aircraft')
+        self.sync(self.ntraf)
+        for path, col in zip(self.paths(), self.columns):
+            if path in state:
+                key, row = self.rows[col]
+                self.groups[key][row, :self.ntraf] = state[path]
@@ -1,15 +1,34 @@
 """ Classes that derive from TrafficArrays (like Traffic) get automated create,
     delete, and reset functionality for all registered child arrays."""
 # -*- coding: utf-8 -*-
-try:
-    from collections.abc import Collection
-except ImportError:
-    # In python <3.3 collections.abc doesn't exist
-    from collections import Collection
+import sys
 import numpy as np
+from bluesky import settings
+from bluesky.core.stateblock import StateBlock, REFCOUNTS
+
+# Register settings defaults
+settings.set_variable_defaults(traf_stateblock=False)
 
 defaults = {"float": 0.0, "int": 0, "uint":0, "bool": False, "S": "", "str": ""}
 
+# Minimum number of aircraft for which traffic array buffers are allocated
+MINCAPACITY = 16
+# Maximum number of deleted aircraft for which the remaining elements are
+# moved per segment, instead of with a boolean mask
+MAXSEGMENTS = 8
+# Default values of new array elements, by dtype
+dtypedefaults = dict()
+
+
+def getdefault(dtype):
+    ''' Return the default value of new elements of arrays of type dtype. '''
+    default = dtypedefaults.get(dtype)
+    if default is None:
+        # Get type without byte length
+        vartype = ''.join(c for c in str(dtype) if c.isalpha())
+        default = dtypedefaults[dtype] = defaults.get(vartype, 0)
+    return default
+
 
 class RegisterElementParameters:
     """ Class to use in 'with'-syntax. This class automatically
@@ -30,7 +49,22 @@ class RegisterElementParameters:
 class TrafficArrays:
     """ Parent class to use separate arrays and lists to allow
         vectorizing but still maintain and object like benefits
-        for creation and deletion of an element for all parameters"""
+        for creation and deletion of an element for all parameters
+
+        Numpy traffic arrays are views of length ntraf on a buffer with
+        spare capacity, which is doubled when it is full, so that creating
+        aircraft does not copy all arrays. Deleting aircraft moves the
+        remaining elements forward within the buffer. A traffic array is
+        therefore only valid until the next create, delete or reset; code
+        that needs its values after that should store a copy. As a
+        safeguard, a buffer that is still referenced elsewhere is
+        reallocated instead of modified in place. This relies on reference
+        counts, so when the interpreter does not count them as expected
+        (see stateblock.checkrefcounts), buffers are always reallocated.
+
+        Optionally (setting traf_stateblock), the numeric arrays of all
+        objects in the tree are instead stored as columns of one
+        StateBlock of the root, which is created and deleted as a whole."""
 
     # The TrafficArrays class keeps track of all of the constructed
     # TrafficArray objects
@@ -38,10 +72,15 @@ class TrafficArrays:
     ntraf = 0
 
     @staticmethod
-    def setroot(obj):
+    def setroot(obj, stateblock=None):
         ''' This function is used to set the root of the tree of TrafficArray
-            objects (which is the traffic object.)'''
+            objects (which is the traffic object.) When stateblock is True
+            (by default the traf_stateblock setting), numeric traffic arrays
+            are stored in a StateBlock of the root. '''
         TrafficArrays.root = obj
+        if stateblock is None:
+            stateblock = settings.traf_stateblock
+        obj._block = StateBlock(obj) if stateblock else None
 
     def __init__(self):
         super().__init__()
@@ -51,6 +90,11 @@ class TrafficArrays:
         self._children = []
         self._ArrVars  = []
         self._LstVars  = []
+        self._BlkVars  = []
+        self._buffers  = dict()
+        self._views    = dict()
+        # Only the root can have a state block
+        self._block    = None
 
     def reparent(self, newparent):
         ''' Give TrafficArrays object a new parent. '''
@@ -59,19 +103,56 @@ class TrafficArrays:
         newparent._children.append(self)
         self._parent = newparent
 
+    def attachblock(self, attach=True):
+        ''' Move the numeric traffic arrays of this object and its children
+            into (attach=True) or out of the state block of the root. Used
+            to keep only the selected implementation of replaceable entities
+            in the block. '''
+        # Entities that do not initialise TrafficArrays have no traffic arrays
+        if '_BlkVars' not in self.__dict__:
+            return
+        for child in self._children:
+            child.attachblock(attach)
+        block = TrafficArrays.root and TrafficArrays.root._block
+        if block is None or self is TrafficArrays.root:
+            return
+        if not attach:
+            names = block.remove(self)
+            self._BlkVars = [v for v in self._BlkVars if v not in names]
+            self._ArrVars.extend(names)
+            return
+        blkvars = [v for v in self._ArrVars if block.accepts(self.__dict__[v])]
+        if blkvars:
+            self._ArrVars = [v for v in self._ArrVars if v not in blkvars]
+            for v in blkvars:
+                self._buffers.pop(v, None)
+                self._views.pop(v, None)
+            self._BlkVars.extend(blkvars)
+            block.add(self, blkvars)
+
     def settrafarrays(self):
         ''' Convenience function for with-style traffic array registration. '''
         return RegisterElementParameters(self)
 
     def _init_trafarrays(self, keys):
+        block = TrafficArrays.root._block
+        blkvars = []
         for key in keys:
             if isinstance(self.__dict__[key], list):
                 self._LstVars.append(key)
             elif isinstance(self.__dict__[key], np.ndarray):
-                self._ArrVars.append(key)
+                if block is not None and block.accepts(self.__dict__[key]):
+                    blkvars.append(key)
+                else:
+                    self._ArrVars.append(key)
             elif isinstance(self.__dict__[key], TrafficArrays):
                 self.__dict__[key].reparent(self)
 
+        # Columns in the state block are sized to the current number of aircraft
+        if blkvars:
+            self._BlkVars.extend(blkvars)
+            block.add(self, blkvars)
+
         # In plugins and replaceable classes it could be that their instance
         # is created when the simulation is already running, and traffic is
         # present. Size traffic arrays accordingly here
@@ -80,6 +161,8 @@ class TrafficArrays:
 
     def create(self, n=1):
         ''' Append n elements (aircraft) to all lists and arrays. '''
+        if self._block is not None:
+            self._block.create(n)
 
         for v in self._LstVars:  # Lists (mostly used for strings)
             lst = self.__dict__.get(v)
@@ -87,13 +170,48 @@ class TrafficArrays:
             lst.extend([defaults.get(vartype)] * n)
 
         for v in self._ArrVars:  # Numpy array
-            # Get type without byte length
-            vartype = ''.join(c for c in str(self.__dict__[v].dtype) if c.isalpha())
-            self.__dict__[v] = np.append(self.__dict__[v], [defaults.get(vartype, 0)] * n)
+            # No reference to the array is kept here, as that would make its
+            # buffer look shared. Multi-dimensional arrays have the aircraft
+            # along the first axis
+            nold = len(self.__dict__[v])
+            self._resize(v, nold + n)[nold:] = getdefault(self.__dict__[v].dtype)
+
+    def _isunshared(self, v):
+        ''' True when the buffer of traffic array v is only referenced by
+            this object, through its view and (when it was not replaced)
+            the attribute itself. Always False when reference counts can't
+            be relied on, so that the buffer is reallocated. '''
+        if not REFCOUNTS or v not in self._views:
+            return False
+        # getrefcount counts its own argument as well
+        nviewrefs = 2 + (self.__dict__[v] is self._views[v])
+        return sys.getrefcount(self._views[v]) == nviewrefs and \
+            sys.getrefcount(self._buffers[v]) == 3
+
+    def _resize(self, v, n):
+        ''' Make traffic array v a view of length n on its buffer, keeping
+            its first elements, and return it. A new buffer is allocated
+            when the current one is too small, has another shape or type
+            than the array, or is referenced elsewhere. '''
+        unshared = self._isunshared(v)
+        arr = self.__dict__[v]
+        nkeep = min(len(arr), n)
+        buf = self._buffers.get(v)
+        if not unshared or len(buf) < n or buf.dtype != arr.dtype or \
+                buf.shape[1:] != arr.shape[1:]:
+            buf = np.empty((max(2 * n, MINCAPACITY),) + arr.shape[1:], dtype=arr.dtype)
+            buf[:nkeep] = arr[:nkeep]
+            self._buffers[v] = buf
+        elif arr is not self._views[v]:
+            # The attribute was replaced by a new array: copy it into the buffer
+            buf[:nkeep] = arr[:nkeep]
+        view = buf[:n]
+        self.__dict__[v] = self._views[v] = view
+        return view
 
     def istrafarray(self, name):
         ''' Returns true if parameter 'name' is a traffic array. '''
-        return name in self._LstVars or name in self._ArrVars
+        return name in self._LstVars or name in self._ArrVars or name in self._BlkVars
 
     def create_children(self, n=1):
         ''' Call create (aircraft create) on all children. '''
@@ -107,17 +225,40 @@ class TrafficArrays:
         for child in self._children:
             child.delete(idx)
 
+        if self._ArrVars or self._LstVars:
+            ntraf = len(self.__dict__[(self._ArrVars or self._LstVars)[0]])
+            keep = np.ones(ntraf, dtype=bool)
+            keep[idx] = False
+            delidx = np.flatnonzero(~keep)
+            nkeep = ntraf - len(delidx)
+
         for v in self._ArrVars:
-            self.__dict__[v] = np.delete(self.__dict__[v], idx)
+            if self._isunshared(v) and self.__dict__[v] is self._views[v]:
+                # Move the remaining elements forward within the buffer
+                arr = self.__dict__[v]
+                if len(delidx) <= MAXSEGMENTS:
+                    for i, start in enumerate(delidx):
+                        stop = delidx[i + 1] if i + 1 < len(delidx) else ntraf
+                        arr[start - i:stop - i - 1] = arr[start + 1:stop]
+                else:
+                    arr[:nkeep] = arr[keep]
+                self.__dict__[v] = self._views[v] = self._buffers[v][:nkeep]
+            else:
+                # The array is copied into a buffer again at the next create
+                self.__dict__[v] = self.__dict__[v][keep]
+
+        # The state block is deleted from last, after all children
+        if self._block is not None:
+            self._block.delete(idx)
 
-        if self._LstVars:
-            if isinstance(idx, Collection):
-                for i in reversed(idx):
-                    for v in self._LstVars:
-                        del self.__dict__[v][i]
+        for v in self._LstVars:
+            lst = self.__dict__[v]
+            if len(delidx) <= MAXSEGMENTS:
+                for i in reversed(delidx):
+                    del lst[i]
             else:
-                for v in self._LstVars:
-                    del self.__dict__[v][idx]
+                # Compact the list once, in place
+                lst[:] = [el for el, k in zip(lst, keep) if k]
 
     def reset(self):
         ''' Delete all elements from arrays and start at 0 aircraft. '''
@@ -125,7 +266,13 @@ class TrafficArrays:
             child.reset()
 
         for v in self._ArrVars:
-            self.__dict__[v] = np.array([], dtype=self.__dict__[v].dtype)
+            arr = self.__dict__[v]
+            self.__dict__[v] = np.zeros((0,) + arr.shape[1:], dtype=arr.dtype)
+            self._buffers.pop(v, None)
+            self._views.pop(v, None)
 
         for v in self._LstVars:
             self.__dict__[v] = []
+
+        if self._block is not None:
+            self._block.reset()
@@ -218,7 +218,7 @@ class Area(Entity):
 
             # delete all aicraft in self.delidx
             if len(delidx) > 0:
-                traf.delete(delidx)
+                traf.deferdelete(delidx)
 
 
 
@@ -228,7 +228,7 @@ class Area(Entity):
                                  * (traf.alt < self.swtaxialt))[0]
             self.oldalt = traf.alt
             if len(delidxalt) > 0:
-                traf.delete(list(delidxalt))
+                traf.deferdelete(delidxalt)
 
     def set_area(self, *args, exparea=False):
         ''' Set Experiment Area. Aircraft leaving the experiment area are deleted.
@@ -1,4 +1,7 @@
 ''' Conflict resolution based on the SSD algorithm. '''
+from concurrent.futures import ProcessPoolExecutor
+import bluesky as bs
+from bluesky import stack
 from bluesky.traffic.asas import ConflictResolution
 from bluesky.tools import geo
 from bluesky.tools.aero import nm
@@ -12,6 +15,16 @@ except ImportError:
 
 # TODO: not completely migrated yet to class-based implementation
 
+bs.settings.set_variable_defaults(asas_ssdworkers=0, asas_ssdtolerance=0.0)
+
+# Number of points on the velocity circles (discretization)
+N_ANGLE = 180
+# Points of the unit-circle in a (180x2)-array (CW)
+_angles = np.arange(0, 2 * np.pi, 2 * np.pi / N_ANGLE)
+XYC = np.transpose(np.reshape(np.concatenate((np.sin(_angles), np.cos(_angles))), (2, N_ANGLE)))
+# Scale factor used by pyclipper.scale_to_clipper
+CLIPPERSCALE = 2 ** 31
+
 
 def init_plugin():
 
@@ -29,7 +42,249 @@ def init_plugin():
     return config
 
 
+def ssdpolygons(task):
+    """ Construct the FRV and ARV of a single aircraft with pyclipper.
+
+        task is a tuple (priocode, vmin, vmax, hdg, gs_ap, own, ap, VO, nvert, rota),
+        with own and ap the current and autopilot velocity (east, north), VO the
+        (n x 4 x 2) array of scaled vertices of the velocity obstacles of the
+        intruders in range, nvert the number of vertices of each VO, and rota
+        whether the VO is kept for the rules of the air (RS6).
+
+        Returns (FRV, ARV, ARV_calc, FRV_area, ARV_area, inconf2, ap_free).
+        This is a module-level function so it can run in a worker process. """
+    priocode, vmin, vmax, hdg, gs_ap, own, ap, VOs, nvert, rota = task
+    inconf2 = False
+    ap_free = True
+
+    # Map them into the format pyclipper wants. Outercircle CCW, innercircle CW
+    circle_tup = (tuple(map(tuple, np.flipud(XYC * vmax))), tuple(map(tuple, XYC * vmin)))
+    circle_lst = [list(map(list, np.flipud(XYC * vmax))), list(map(list, XYC * vmin))]
+
+    if len(VOs) == 0:
+        # No aircraft in the vicinity
+        return [], circle_lst, circle_lst, 0., np.pi * (vmax ** 2 - vmin ** 2), inconf2, ap_free
+
+    # Make a clipper object
+    pc = pyclipper.Pyclipper()
+    # Add circles (ring-shape) to clipper as subject
+    pc.AddPaths(pyclipper.scale_to_clipper(circle_tup), pyclipper.PT_SUBJECT, True)
+
+    # Extra stuff needed for RotA
+    if priocode == "RS6":
+        # Make another clipper object for RotA
+        pc_rota = pyclipper.Pyclipper()
+        pc_rota.AddPaths(pyclipper.scale_to_clipper(circle_tup), pyclipper.PT_SUBJECT, True)
+
+    # Add each other other aircraft to clipper as clip
+    for vo, n, swrota in zip(VOs, nvert, rota):
+        VO = vo[:n].tolist()
+        # Add scaled VO to clipper
+        pc.AddPath(VO, pyclipper.PT_CLIP, True)
+        # For RotA it is possible to ignore
+        if priocode == "RS6" and swrota:
+            pc_rota.AddPath(VO, pyclipper.PT_CLIP, True)
+        # Detect conflicts for smaller layer in RS7 and RS8
+        if priocode == "RS7" or priocode == "RS8":
+            if pyclipper.PointInPolygon(pyclipper.scale_to_clipper(own), VO):
+                inconf2 = True
+        if priocode == "RS5":
+            if pyclipper.PointInPolygon(pyclipper.scale_to_clipper(ap), VO):
+                ap_free = False
+
+    # Execute clipper command
+    FRV = pyclipper.scale_from_clipper(
+        pc.Execute(pyclipper.CT_INTERSECTION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO))
+
+    ARV = pc.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
+
+    if not priocode == "RS1" and not priocode == "RS5" and not priocode == "RS7" and not priocode == "RS8":
+        # Make another clipper object for extra intersections
+        pc2 = pyclipper.Pyclipper()
+        # When using RotA clip with pc_rota
+        if priocode == "RS6":
+            # Calculate ARV for RotA
+            ARV_rota = pc_rota.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO,
+                                       pyclipper.PFT_NONZERO)
+            if len(ARV_rota) > 0:
+                pc2.AddPaths(ARV_rota, pyclipper.PT_CLIP, True)
+        else:
+            # Put the ARV in there, make sure it's not empty
+            if len(ARV) > 0:
+                pc2.AddPaths(ARV, pyclipper.PT_CLIP, True)
+
+    # Scale back
+    ARV = pyclipper.scale_from_clipper(ARV)
+
+    # Check if ARV or FRV is empty
+    if len(ARV) == 0:
+        # No aircraft in the vicinity
+        # Map them into the format ARV wants. Outercircle CCW, innercircle CW
+        return circle_lst, [], [], np.pi * (vmax ** 2 - vmin ** 2), 0., inconf2, ap_free
+    if len(FRV) == 0:
+        # Should not happen with one a/c or no other a/c in the vicinity.
+        # These are handled earlier. Happens when RotA has removed all
+        # Map them into the format ARV wants. Outercircle CCW, innercircle CW
+        return [], circle_lst, circle_lst, 0., np.pi * (vmax ** 2 - vmin ** 2), inconf2, ap_free
+
+    # Check multi exteriors, if this layer is not a list, it means it has no exteriors
+    # In that case, make it a list, such that its format is consistent with further code
+    if not type(FRV[0][0]) == list:
+        FRV = [FRV]
+    if not type(ARV[0][0]) == list:
+        ARV = [ARV]
+    # Calculate areas
+    FRV_area = SSD.area(None, FRV)
+    ARV_area = SSD.area(None, ARV)
+
+    # For resolution purposes sometimes extra intersections are wanted
+    if priocode == "RS2" or priocode == "RS9" or priocode == "RS6" or priocode == "RS3" or priocode == "RS4":
+        # Make a box that covers right or left of SSD
+        own_hdg = hdg * np.pi / 180
+        # Efficient calculation of box, see notes
+        if priocode == "RS2" or priocode == "RS6":
+            # CW or right-turning
+            sin_table = np.array([[1, 0], [-1, 0], [-1, -1], [1, -1]], dtype=np.float64)
+            cos_table = np.array([[0, 1], [0, -1], [1, -1], [1, 1]], dtype=np.float64)
+        elif priocode == "RS9":
+            # CCW or left-turning
+            sin_table = np.array([[1, 0], [1, 1], [-1, 1], [-1, 0]], dtype=np.float64)
+            cos_table = np.array([[0, 1], [-1, 1], [-1, -1], [0, -1]], dtype=np.float64)
+        # Overlay a part of the full SSD
+        if priocode == "RS2" or priocode == "RS9" or priocode == "RS6":
+            # Normalized coordinates of box
+            xyp = np.sin(own_hdg) * sin_table + np.cos(own_hdg) * cos_table
+            # Scale with vmax (and some factor) and put in tuple
+            part = pyclipper.scale_to_clipper(tuple(map(tuple, 1.1 * vmax * xyp)))
+            pc2.AddPath(part, pyclipper.PT_SUBJECT, True)
+        elif priocode == "RS3":
+            # Small ring
+            xyp = (tuple(map(tuple, np.flipud(XYC * min(vmax, gs_ap + 0.1)))),
+                   tuple(map(tuple, XYC * max(vmin, gs_ap - 0.1))))
+            part = pyclipper.scale_to_clipper(xyp)
+            pc2.AddPaths(part, pyclipper.PT_SUBJECT, True)
+        elif priocode == "RS4":
+            hdg_sel = hdg * np.pi / 180
+            xyp = np.array([[np.sin(hdg_sel - 0.0087), np.cos(hdg_sel - 0.0087)],
+                            [0, 0],
+                            [np.sin(hdg_sel + 0.0087), np.cos(hdg_sel + 0.0087)]],
+                           dtype=np.float64)
+            part = pyclipper.scale_to_clipper(tuple(map(tuple, 1.1 * vmax * xyp)))
+            pc2.AddPath(part, pyclipper.PT_SUBJECT, True)
+        # Execute clipper command
+        ARV_calc = pyclipper.scale_from_clipper(
+            pc2.Execute(pyclipper.CT_INTERSECTION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO))
+        # If no smaller ARV is found, take the full ARV
+        if len(ARV_calc) == 0:
+            ARV_calc = ARV
+        # Check multi exteriors, if this layer is not a list, it means it has no exteriors
+        # In that case, make it a list, such that its format is consistent with further code
+        if not type(ARV_calc[0][0]) == list:
+            ARV_calc = [ARV_calc]
+    # Shortest way out prio, so use full SSD (ARV_calc = ARV)
+    else:
+        ARV_calc = ARV
+
+    return FRV, ARV, ARV_calc, FRV_area, ARV_area, inconf2, ap_free
+
+
+def edgepoints(polygons, x, y):
+    """ For every set of polygons (list of exteriors) in polygons, calculate
+        the points on all of its edges that are closest to point (x, y) of
+        that set. Returns the index of the set, the point, and the squared
+        distance for every edge. """
+    # It's just linalg, however credits to: http://stackoverflow.com/a/1501725
+    # Put the edges of all exteriors of all sets in one array
+    p = [np.array(ext) for poly in polygons for ext in poly]
+    q = [np.diff(np.vstack((ext, ext[0])), axis=0) for ext in p]
+    nedges = [len(ext) for ext in p]
+    owner = np.repeat(np.repeat(np.arange(len(polygons)), [len(poly) for poly in polygons]), nedges)
+    p = np.concatenate(p)
+    q = np.concatenate(q)
+    px = x[owner]
+    py = y[owner]
+    # Calculate squared distance between edges
+    l2 = q[:, 0] ** 2 + q[:, 1] ** 2
+    # Catch l2 == 0 (exception)
+    same = l2 < 1e-8
+    l2[same] = 1.
+    # Calc t, which must be limited between 0 and 1
+    t = ((px - p[:, 0]) * q[:, 0] + (py - p[:, 1]) * q[:, 1]) / l2
+    t = np.clip(t, 0., 1.)
+    t[same] = 0.
+    # Calculate closest point to each edge
+    x1 = p[:, 0] + t * q[:, 0]
+    y1 = p[:, 1] + t * q[:, 1]
+    # Get distance squared
+    d2 = (x1 - px) ** 2 + (y1 - py) ** 2
+    return owner, x1, y1, d2
+
+
+def closestpoints(polygons, x, y):
+    """ For every set of polygons (list of exteriors) in polygons, return the
+        point on its edges that is closest to point (x, y) of that set. """
+    owner, x1, y1, d2 = edgepoints(polygons, x, y)
+    # Select the closest edge of every set
+    order = np.lexsort((d2, owner))
+    first = order[np.searchsorted(owner[order], np.arange(len(polygons)))]
+    return x1[first], y1[first]
+
+
 class SSD(ConflictResolution):
+    def __init__(self):
+        super().__init__()
+        # [-] Number of worker processes for the clipping, 0 means serial
+        self.nworkers = bs.settings.asas_ssdworkers
+        # [m/s, deg] Change of the SSD geometry below which a cached SSD is reused, 0 means no caching
+        self.tolerance = bs.settings.asas_ssdtolerance
+        # Per priocode, the SSDs of the last step and the geometry they were constructed for, by uid
+        self.cache = dict()
+        self.pool = None
+        self.poolsize = 0
+
+    def reset(self):
+        super().reset()
+        self.nworkers = bs.settings.asas_ssdworkers
+        self.tolerance = bs.settings.asas_ssdtolerance
+        self.cache = dict()
+        self.closepool()
+
+    @stack.command(name='SSDENGINE')
+    def setengine(self, nworkers: int = None, tolerance: float = None):
+        ''' Set the number of worker processes used to construct the SSDs
+            (0 = serial), and the change in geometry below which cached SSDs
+            are reused (0 = no caching). '''
+        if nworkers is None:
+            return True, 'SSDENGINE [NWORKERS] [TOLERANCE]' + \
+                f'\nSSDs are constructed using {self.nworkers or "no"} worker processes, ' + \
+                ('caching is OFF' if self.tolerance <= 0.0 else
+                 f'cached SSDs are reused for changes up to {self.tolerance} m/s, deg')
+        if nworkers < 0 or (tolerance is not None and tolerance < 0.0):
+            return False, 'SSDENGINE: number of workers and tolerance should be at least 0'
+        self.nworkers = nworkers
+        if nworkers == 0:
+            self.closepool()
+        if tolerance is not None:
+            self.tolerance = tolerance
+            self.cache = dict()
+        return True
+
+    def getpool(self):
+        ''' Return the worker pool, (re)creating it when the number of
+            workers has changed. '''
+        if self.pool is None or self.poolsize != self.nworkers:
+            self.closepool()
+            self.pool = ProcessPoolExecutor(self.nworkers)
+            self.poolsize = self.nworkers
+        return self.pool
+
+    def closepool(self):
+        ''' Shut down the worker processes, if any. '''
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.pool = None
+        self.poolsize = 0
+
     def setprio(self, flag=None, priocode=''):
         '''Set the prio switch and the type of prio '''
         if flag is None:
@@ -136,12 +391,9 @@ class SSD(ConflictResolution):
 
     def constructSSD(self, conf, ownship, priocode="RS1"):
         """ Calculates the FRV and ARV of the SSD """
-        N = 0
         # Parameters
-        N_angle = 180  # [-] Number of points on circle (discretization)
         hsep = conf.rpz  # [m] Horizontal separation (5 NM)
         margin = self.resofach  # [-] Safety margin for evasion
-        hsepm = hsep * margin  # [m] Horizontal separation with safety margin
         alpham = 0.4999 * np.pi  # [rad] Maximum half-angle for VO
         betalos = np.pi / 4  # [rad] Minimum divertion angle for LOS (45 deg seems optimal)
         adsbmax = 65. * nm  # [m] Maximum ADS-B range
@@ -160,6 +412,8 @@ class SSD(ConflictResolution):
         hdg_ap = ownship.ap.trk
         apnorth = np.cos(hdg_ap / 180 * np.pi) * gs_ap
         apeast = np.sin(hdg_ap / 180 * np.pi) * gs_ap
+        vmin = ownship.perf.vmin
+        vmax = ownship.perf.vmax
 
         # Local variables, will be put into asas later
         FRV_loc = [None] * ownship.ntraf
@@ -169,299 +423,163 @@ class SSD(ConflictResolution):
         FRV_area_loc = np.zeros(ownship.ntraf, dtype=np.float32)
         ARV_area_loc = np.zeros(ownship.ntraf, dtype=np.float32)
 
-        # # Use velocity limits for the ring-shaped part of the SSD
-        # Discretize the circles using points on circle
-        angles = np.arange(0, 2 * np.pi, 2 * np.pi / N_angle)
-        # Put points of unit-circle in a (180x2)-array (CW)
-        xyc = np.transpose(np.reshape(np.concatenate((np.sin(angles), np.cos(angles))), (2, N_angle)))
-
         # If no traffic
         if ntraf == 0:
             return
 
-        # # If only one aircraft
-        # elif ntraf == 1:
-        #     # Map them into the format ARV wants. Outercircle CCW, innercircle CW
-        #     ARV_loc[0] = circle_lst
-        #     FRV_loc[0] = []
-        #     ARV_calc_loc[0] = ARV_loc[0]
-        #     # Calculate areas and store in asas
-        #     FRV_area_loc[0] = 0
-        #     ARV_area_loc[0] = np.pi * (vmax ** 2 - vmin ** 2)
-        #     return
-
-        # Function qdrdist_matrix needs 4 vectors as input (lat1,lon1,lat2,lon2)
-        # To be efficient, calculate all qdr and dist in one function call
-        # Example with ntraf = 5:   ind1 = [0,0,0,0,1,1,1,2,2,3]
-        #                           ind2 = [1,2,3,4,2,3,4,3,4,4]
-        # This way the qdrdist is only calculated once between every aircraft
-        # To get all combinations, use this function to get the indices
-        ind1, ind2 = self.qdrdist_matrix_indices(ntraf)
-        # Get absolute bearing [deg] and distance [nm]
-        # Not sure abs/rel, but qdr is defined from [-180,180] deg, w.r.t. North
+        # Calculate SSD only for aircraft in conflict (See formulas appendix).
+        # In the first time step, ASAS runs before perf, which means that vmin
+        # and vmax will be zero and the SSD cannot be constructed
+        own = np.flatnonzero(conf.inconf & ~((vmin == vmax) & (vmax == 0)))
+
+        # Geometry of all pairs of these aircraft (i) with the other aircraft (j),
+        # ordered by i and j. Bearing and distance are calculated from the
+        # aircraft with the lowest to the one with the highest index, so
+        # the VO of pairs with j < i has to be mirrored
+        i = np.repeat(own, ntraf - 1)
+        j = np.tile(np.arange(ntraf - 1), len(own))
+        j += j >= i
+        mirror = j < i
+        ind1, ind2 = np.minimum(i, j), np.maximum(i, j)
         [qdr, dist] = geo.qdrdist_matrix(lat[ind1], lon[ind1], lat[ind2], lon[ind2])
-        # Put result of function from matrix to ndarray
-        qdr = np.reshape(np.array(qdr), np.shape(ind1))
-        dist = np.reshape(np.array(dist), np.shape(ind1))
-        # SI-units from [deg] to [rad]
-        qdr = np.deg2rad(qdr)
-        # Get distance from [nm] to [m]
-        dist = dist * nm
+        # SI-units from [deg] to [rad] and from [nm] to [m]
+        qdr = np.deg2rad(np.reshape(np.array(qdr), np.shape(ind1)))
+        dist = np.reshape(np.array(dist), np.shape(ind1)) * nm
 
+        # Horizontal separation with safety margin [m] of each pair
+        hsepm = np.maximum(hsep[ind1], hsep[ind2]) * margin
         # In LoS the VO can't be defined, act as if dist is on edge
-        dist[dist < hsepm] = hsepm
+        los = dist <= hsepm
+        dist = np.maximum(dist, hsepm)
+
+        # Only consider aircraft that are within ADS-B range
+        inrange = dist < adsbmax
+        i, j, mirror, los = i[inrange], j[inrange], mirror[inrange], los[inrange]
+        qdr, dist, hsepm = qdr[inrange], dist[inrange], hsepm[inrange]
 
         # Calculate vertices of Velocity Obstacle (CCW)
         # These are still in relative velocity space, see derivation in appendix
-        # Half-angle of the Velocity obstacle [rad]
-        # Include safety margin
-        alpha = np.arcsin(hsepm / dist)
+        # Half-angle of the Velocity obstacle [rad], including safety margin
         # Limit half-angle alpha to 89.982 deg. Ensures that VO can be constructed
-        alpha[alpha > alpham] = alpham
+        alpha = np.minimum(np.arcsin(hsepm / dist), alpham)
         # Relevant sin/cos/tan
         sinqdr = np.sin(qdr)
         cosqdr = np.cos(qdr)
         tanalpha = np.tan(alpha)
         cosqdrtanalpha = cosqdr * tanalpha
         sinqdrtanalpha = sinqdr * tanalpha
-
-        # Consider every aircraft
-        for i in range(ntraf):
-            # Calculate SSD only for aircraft in conflict (See formulas appendix)
-            if conf.inconf[i]:
-
-                vmin = ownship.perf.vmin[i]
-                vmax = ownship.perf.vmax[i]
-
-                # in the first time step, ASAS runs before perf, which means that his value will be zero
-                # and the SSD cannot be constructed
-                if vmin == vmax == 0:
-                    continue
-
-                # Map them into the format pyclipper wants. Outercircle CCW, innercircle CW
-                circle_tup = (tuple(map(tuple, np.flipud(xyc * vmax))), tuple(map(tuple, xyc * vmin)))
-                circle_lst = [list(map(list, np.flipud(xyc * vmax))), list(map(list, xyc * vmin))]
-
-                # Relevant x1,y1,x2,y2 (x0 and y0 are zero in relative velocity space)
-                x1 = (sinqdr + cosqdrtanalpha) * 2 * vmax
-                x2 = (sinqdr - cosqdrtanalpha) * 2 * vmax
-                y1 = (cosqdr - sinqdrtanalpha) * 2 * vmax
-                y2 = (cosqdr + sinqdrtanalpha) * 2 * vmax
-
-                # SSD for aircraft i
-                # Get indices that belong to aircraft i
-                ind = np.where(np.logical_or(ind1 == i, ind2 == i))[0]
-                # Check whether there are any aircraft in the vicinity
-                if len(ind) == 0:
-                    # No aircraft in the vicinity
-                    # Map them into the format ARV wants. Outercircle CCW, innercircle CW
-                    ARV_loc[i] = circle_lst
-                    FRV_loc[i] = []
-                    ARV_calc_loc[i] = ARV_loc[i]
-                    # Calculate areas and store in asas
-                    FRV_area_loc[i] = 0
-                    ARV_area_loc[i] = np.pi * (vmax ** 2 - vmin ** 2)
+        fix = np.where(mirror, -1., 1.)
+
+        # Relevant x1,y1,x2,y2 (x0 and y0 are zero in relative velocity space)
+        x1 = (sinqdr + cosqdrtanalpha) * 2 * vmax[i]
+        x2 = (sinqdr - cosqdrtanalpha) * 2 * vmax[i]
+        y1 = (cosqdr - sinqdrtanalpha) * 2 * vmax[i]
+        y2 = (cosqdr + sinqdrtanalpha) * 2 * vmax[i]
+
+        # Vertices of the VO's in an array of [npairs x 4 x 2], the
+        # triangular VO's only use the first three
+        VO = np.zeros((len(i), 4, 2))
+        VO[:, 0, 0] = gseast[j]
+        VO[:, 0, 1] = gsnorth[j]
+        VO[:, 1, 0] = x1 * fix + gseast[j]
+        VO[:, 1, 1] = y1 * fix + gsnorth[j]
+        VO[:, 2, 0] = x2 * fix + gseast[j]
+        VO[:, 2, 1] = y2 * fix + gsnorth[j]
+
+        # Pairs in LOS get a darttip instead of a triangular VO
+        qdr_los = np.where(mirror, qdr + np.pi, qdr)[los]
+        # Length of inner-leg of darttip
+        leg = (1.1 * vmax[i[los]] / np.cos(beta)).reshape(-1, 1)
+        # Angles of darttip, the fourth vertex is the origin
+        angles_los = np.stack((qdr_los + 2 * beta, qdr_los, qdr_los - 2 * beta), axis=1)
+        VO[los, :3, 0] = leg * np.sin(angles_los)
+        VO[los, :3, 1] = leg * np.cos(angles_los)
+        VO[los, 3] = 0.
+        nvert = np.where(los, 4, 3)
+        # Scale to clipper integer coordinates, as pyclipper.scale_to_clipper
+        VO = (VO * CLIPPERSCALE).astype(np.int64)
+
+        # For RotA it is possible to ignore VO's
+        if priocode == "RS6":
+            # Bearing calculations from own view and other view
+            fix_ang = np.where(mirror, 180., 0.)
+            brg_own = np.mod((np.rad2deg(qdr) + fix_ang - hdg[i]) + 540., 360.) - 180.
+            brg_other = np.mod((np.rad2deg(qdr) + 180. - fix_ang - hdg[j]) + 540., 360.) - 180.
+            # Head-on or converging from right, or in overtaking position
+            rota = np.logical_and(brg_own >= -20., brg_own <= 110.) | \
+                (brg_other <= -110.) | (brg_other >= 110.)
+        else:
+            rota = np.zeros(len(i), dtype=bool)
+
+        # The VO's of each aircraft in own
+        start = np.searchsorted(i, own, side='left')
+        stop = np.searchsorted(i, own, side='right')
+        if ntraf > 1:
+            for k, a, b in zip(own, start, stop):
+                if not priocode == "RS7" and not priocode == "RS8":
+                    # Put it in class-object (not for RS7 and RS8)
+                    conf.inrange[k] = j[a:b]
                 else:
-                    # The i's of the other aircraft
-                    i_other = np.delete(np.arange(0, ntraf), i)
-                    # Aircraft that are within ADS-B range
-                    ac_adsb = np.where(dist[ind] < adsbmax)[0]
-                    # Now account for ADS-B range in indices of other aircraft (i_other)
-                    ind = ind[ac_adsb]
-                    i_other = i_other[ac_adsb]
-                    if not priocode == "RS7" and not priocode == "RS8":
-                        # Put it in class-object (not for RS7 and RS8)
-                        conf.inrange[i] = i_other
-                    else:
-                        conf.inrange2[i] = i_other
-                    # VO from 2 to 1 is mirror of 1 to 2. Only 1 to 2 can be constructed in
-                    # this manner, so need a correction vector that will mirror the VO
-                    fix = np.ones(np.shape(i_other))
-                    fix[i_other < i] = -1
-                    # Relative bearing [deg] from [-180,180]
-                    # (less required conversions than rad in RotA)
-                    fix_ang = np.zeros(np.shape(i_other))
-                    fix_ang[i_other < i] = 180.
-
-                    # Get vertices in an x- and y-array of size (ntraf-1)*3x1
-                    x = np.concatenate((gseast[i_other],
-                                        x1[ind] * fix + gseast[i_other],
-                                        x2[ind] * fix + gseast[i_other]))
-                    y = np.concatenate((gsnorth[i_other],
-                                        y1[ind] * fix + gsnorth[i_other],
-                                        y2[ind] * fix + gsnorth[i_other]))
-                    # Reshape [(ntraf-1)x3] and put arrays in one array [(ntraf-1)x3x2]
-                    x = np.transpose(x.reshape(3, np.shape(i_other)[0]))
-                    y = np.transpose(y.reshape(3, np.shape(i_other)[0]))
-                    xy = np.dstack((x, y))
-
-                    # Make a clipper object
-                    pc = pyclipper.Pyclipper()
-                    # Add circles (ring-shape) to clipper as subject
-                    pc.AddPaths(pyclipper.scale_to_clipper(circle_tup), pyclipper.PT_SUBJECT, True)
-
-                    # Extra stuff needed for RotA
-                    if priocode == "RS6":
-                        # Make another clipper object for RotA
-                        pc_rota = pyclipper.Pyclipper()
-                        pc_rota.AddPaths(pyclipper.scale_to_clipper(circle_tup), pyclipper.PT_SUBJECT, True)
-                        # Bearing calculations from own view and other view
-                        brg_own = np.mod((np.rad2deg(qdr[ind]) + fix_ang - hdg[i]) + 540., 360.) - 180.
-                        brg_other = np.mod((np.rad2deg(qdr[ind]) + 180. - fix_ang - hdg[i_other]) + 540., 360.) - 180.
-
-                    # Add each other other aircraft to clipper as clip
-                    for j in range(np.shape(i_other)[0]):
-                        ## Debug prints
-                        ## print(traf.id[i] + " - " + traf.id[i_other[j]])
-                        ## print(dist[ind[j]])
-                        # Scale VO when not in LOS
-                        if dist[ind[j]] > hsepm:
-                            # Normally VO shall be added of this other a/c
-                            VO = pyclipper.scale_to_clipper(tuple(map(tuple, xy[j, :, :])))
-                        else:
-                            # Pair is in LOS, instead of triangular VO, use darttip
-                            # Check if bearing should be mirrored
-                            if i_other[j] < i:
-                                qdr_los = qdr[ind[j]] + np.pi
-                            else:
-                                qdr_los = qdr[ind[j]]
-                            # Length of inner-leg of darttip
-                            leg = 1.1 * vmax / np.cos(beta) * np.array([1, 1, 1, 0])
-                            # Angles of darttip
-                            angles_los = np.array([qdr_los + 2 * beta, qdr_los, qdr_los - 2 * beta, 0.])
-                            # Calculate coordinates (CCW)
-                            x_los = leg * np.sin(angles_los)
-                            y_los = leg * np.cos(angles_los)
-                            # Put in array of correct format
-                            xy_los = np.vstack((x_los, y_los)).T
-                            # Scale darttip
-                            VO = pyclipper.scale_to_clipper(tuple(map(tuple, xy_los)))
-                        # Add scaled VO to clipper
-                        pc.AddPath(VO, pyclipper.PT_CLIP, True)
-                        # For RotA it is possible to ignore
-                        if priocode == "RS6":
-                            if brg_own[j] >= -20. and brg_own[j] <= 110.:
-                                # Head-on or converging from right
-                                pc_rota.AddPath(VO, pyclipper.PT_CLIP, True)
-                            elif brg_other[j] <= -110. or brg_other[j] >= 110.:
-                                # In overtaking position
-                                pc_rota.AddPath(VO, pyclipper.PT_CLIP, True)
-                        # Detect conflicts for smaller layer in RS7 and RS8
-                        if priocode == "RS7" or priocode == "RS8":
-                            if pyclipper.PointInPolygon(pyclipper.scale_to_clipper((gseast[i], gsnorth[i])), VO):
-                                conf.inconf2[i] = True
-                        if priocode == "RS5":
-                            if pyclipper.PointInPolygon(pyclipper.scale_to_clipper((apeast[i], apnorth[i])), VO):
-                                conf.ap_free[i] = False
-
-                    # Execute clipper command
-                    FRV = pyclipper.scale_from_clipper(
-                        pc.Execute(pyclipper.CT_INTERSECTION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO))
-
-                    ARV = pc.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
-
-                    if not priocode == "RS1" and not priocode == "RS5" and not priocode == "RS7" and not priocode == "RS8":
-                        # Make another clipper object for extra intersections
-                        pc2 = pyclipper.Pyclipper()
-                        # When using RotA clip with pc_rota
-                        if priocode == "RS6":
-                            # Calculate ARV for RotA
-                            ARV_rota = pc_rota.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO,
-                                                       pyclipper.PFT_NONZERO)
-                            if len(ARV_rota) > 0:
-                                pc2.AddPaths(ARV_rota, pyclipper.PT_CLIP, True)
-                        else:
-                            # Put the ARV in there, make sure it's not empty
-                            if len(ARV) > 0:
-                                pc2.AddPaths(ARV, pyclipper.PT_CLIP, True)
-
-                    # Scale back
-                    ARV = pyclipper.scale_from_clipper(ARV)
-
-                    # Check if ARV or FRV is empty
-                    if len(ARV) == 0:
-                        # No aircraft in the vicinity
-                        # Map them into the format ARV wants. Outercircle CCW, innercircle CW
-                        ARV_loc[i] = []
-                        FRV_loc[i] = circle_lst
-                        ARV_calc_loc[i] = []
-                        # Calculate areas and store in asas
-                        FRV_area_loc[i] = np.pi * (vmax ** 2 - vmin ** 2)
-                        ARV_area_loc[i] = 0
-                    elif len(FRV) == 0:
-                        # Should not happen with one a/c or no other a/c in the vicinity.
-                        # These are handled earlier. Happens when RotA has removed all
-                        # Map them into the format ARV wants. Outercircle CCW, innercircle CW
-                        ARV_loc[i] = circle_lst
-                        FRV_loc[i] = []
-                        ARV_calc_loc[i] = circle_lst
-                        # Calculate areas and store in asas
-                        FRV_area_loc[i] = 0
-                        ARV_area_loc[i] = np.pi * (vmax ** 2 - vmin ** 2)
-                    else:
-                        # Check multi exteriors, if this layer is not a list, it means it has no exteriors
-                        # In that case, make it a list, such that its format is consistent with further code
-                        if not type(FRV[0][0]) == list:
-                            FRV = [FRV]
-                        if not type(ARV[0][0]) == list:
-                            ARV = [ARV]
-                        # Store in asas
-                        FRV_loc[i] = FRV
-                        ARV_loc[i] = ARV
-                        # Calculate areas and store in asas
-                        FRV_area_loc[i] = self.area(FRV)
-                        ARV_area_loc[i] = self.area(ARV)
-
-                        # For resolution purposes sometimes extra intersections are wanted
-                        if priocode == "RS2" or priocode == "RS9" or priocode == "RS6" or priocode == "RS3" or priocode == "RS4":
-                            # Make a box that covers right or left of SSD
-                            own_hdg = hdg[i] * np.pi / 180
-                            # Efficient calculation of box, see notes
-                            if priocode == "RS2" or priocode == "RS6":
-                                # CW or right-turning
-                                sin_table = np.array([[1, 0], [-1, 0], [-1, -1], [1, -1]], dtype=np.float64)
-                                cos_table = np.array([[0, 1], [0, -1], [1, -1], [1, 1]], dtype=np.float64)
-                            elif priocode == "RS9":
-                                # CCW or left-turning
-                                sin_table = np.array([[1, 0], [1, 1], [-1, 1], [-1, 0]], dtype=np.float64)
-                                cos_table = np.array([[0, 1], [-1, 1], [-1, -1], [0, -1]], dtype=np.float64)
-                            # Overlay a part of the full SSD
-                            if priocode == "RS2" or priocode == "RS9" or priocode == "RS6":
-                                # Normalized coordinates of box
-                                xyp = np.sin(own_hdg) * sin_table + np.cos(own_hdg) * cos_table
-                                # Scale with vmax (and some factor) and put in tuple
-                                part = pyclipper.scale_to_clipper(tuple(map(tuple, 1.1 * vmax * xyp)))
-                                pc2.AddPath(part, pyclipper.PT_SUBJECT, True)
-                            elif priocode == "RS3":
-                                # Small ring
-                                xyp = (tuple(map(tuple, np.flipud(xyc * min(vmax, gs_ap[i] + 0.1)))),
-                                       tuple(map(tuple, xyc * max(vmin, gs_ap[i] - 0.1))))
-                                part = pyclipper.scale_to_clipper(xyp)
-                                pc2.AddPaths(part, pyclipper.PT_SUBJECT, True)
-                            elif priocode == "RS4":
-                                hdg_sel = hdg[i] * np.pi / 180
-                                xyp = np.array([[np.sin(hdg_sel - 0.0087), np.cos(hdg_sel - 0.0087)],
-                                                [0, 0],
-                                                [np.sin(hdg_sel + 0.0087), np.cos(hdg_sel + 0.0087)]],
-                                               dtype=np.float64)
-                                part = pyclipper.scale_to_clipper(tuple(map(tuple, 1.1 * vmax * xyp)))
-                                pc2.AddPath(part, pyclipper.PT_SUBJECT, True)
-                            # Execute clipper command
-                            ARV_calc = pyclipper.scale_from_clipper(
-                                pc2.Execute(pyclipper.CT_INTERSECTION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO))
-                            N += 1
-                            # If no smaller ARV is found, take the full ARV
-                            if len(ARV_calc) == 0:
-                                ARV_calc = ARV
-                            # Check multi exteriors, if this layer is not a list, it means it has no exteriors
-                            # In that case, make it a list, such that its format is consistent with further code
-                            if not type(ARV_calc[0][0]) == list:
-                                ARV_calc = [ARV_calc]
-                        # Shortest way out prio, so use full SSD (ARV_calc = ARV)
-                        else:
-                            ARV_calc = ARV
-                        # Update calculatable ARV for resolutions
-                        ARV_calc_loc[i] = ARV_calc
+                    conf.inrange2[k] = j[a:b]
+
+        tasks = [(priocode, vmin[k], vmax[k], hdg[k], gs_ap[k], (gseast[k], gsnorth[k]),
+                  (apeast[k], apnorth[k]), VO[a:b], nvert[a:b], rota[a:b])
+                 for k, a, b in zip(own, start, stop)]
+
+        # SSDs are reused when the aircraft has the same intruders as when its
+        # SSD was constructed, and neither the VO's nor its own relevant
+        # speeds and heading have moved by more than the tolerance since then
+        if self.tolerance > 0.0:
+            ownvars = [vmin, vmax]
+            if priocode in ("RS2", "RS3", "RS4", "RS6", "RS9"):
+                ownvars += [hdg, gs_ap]
+            elif priocode == "RS5":
+                ownvars += [apeast, apnorth]
+            elif priocode == "RS7" or priocode == "RS8":
+                ownvars += [gseast, gsnorth]
+            ownvars = np.stack(ownvars, axis=1)
+            uid = ownship.uid
+            geometry = [(uid[j[a:b]], nvert[a:b], rota[a:b], VO[a:b], ownvars[k])
+                        for k, a, b in zip(own, start, stop)]
+        cache = self.cache.get(priocode, dict()) if self.tolerance > 0.0 else dict()
+
+        def isclean(n, k):
+            if ownship.uid[k] not in cache:
+                return False
+            (intruders, nv, ra, vo, ov), _ = cache[ownship.uid[k]]
+            intruders_new, nv_new, ra_new, vo_new, ov_new = geometry[n]
+            return np.array_equal(intruders, intruders_new) and np.array_equal(nv, nv_new) and \
+                np.array_equal(ra, ra_new) and \
+                np.all(np.abs(vo - vo_new) <= self.tolerance * CLIPPERSCALE) and \
+                np.all(np.abs(ov - ov_new) <= self.tolerance)
+
+        # Construct the SSDs that are not clean, in parallel when worker processes are used
+        todo = [n for n, k in enumerate(own) if not isclean(n, k)]
+        if self.nworkers > 0 and len(todo) > 1:
+            results = self.getpool().map(ssdpolygons, [tasks[n] for n in todo],
+                                         chunksize=max(1, len(todo) // (4 * self.nworkers)))
+        else:
+            results = map(ssdpolygons, [tasks[n] for n in todo])
+        constructed = dict(zip(todo, results))
+
+        newcache = dict()
+        for n, k in enumerate(own):
+            if n in constructed:
+                result = constructed[n]
+                if self.tolerance > 0.0:
+                    newcache[ownship.uid[k]] = (geometry[n], result)
+            else:
+                newcache[ownship.uid[k]] = cache[ownship.uid[k]]
+                result = cache[ownship.uid[k]][1]
+            FRV_loc[k], ARV_loc[k], ARV_calc_loc[k], FRV_area_loc[k], ARV_area_loc[k], \
+                inconf2, ap_free = result
+            # Detected conflicts for smaller layer in RS7 and RS8
+            if inconf2:
+                conf.inconf2[k] = True
+            # Autopilot setting inside a VO in RS5
+            if not ap_free:
+                conf.ap_free[k] = False
+        self.cache[priocode] = newcache
 
         # If sequential approach, the local should go elsewhere
         if not priocode == "RS7" and not priocode == "RS8":
@@ -477,7 +595,6 @@ class SSD(ConflictResolution):
 
     def calculate_resolution(self, conf, ownship):
         """ Calculates closest conflict-free point according to ruleset """
-        # It's just linalg, however credits to: http://stackoverflow.com/a/1501725
         # Variables
         ARV = conf.ARV_calc
         if self.priocode == "RS7" or self.priocode == "RS8":
@@ -489,118 +606,64 @@ class SSD(ConflictResolution):
         else:
             gsnorth = ownship.gsnorth
             gseast = ownship.gseast
-        ntraf = ownship.ntraf
 
-        # Loop through SSDs of all aircraft
-        for i in range(ntraf):
-            # Only those that are in conflict need to resolve
-            if conf.inconf[i] and ARV[i] is not None and len(ARV[i]) > 0:
-                # First check if AP-setting is free
-                if conf.ap_free[i] and self.priocode == "RS5":
-                    conf.asase[i] = gseast[i]
-                    conf.asasn[i] = gsnorth[i]
-                else:
-                    # Loop through all exteriors and append. Afterwards concatenate
-                    p = []
-                    q = []
-                    for j in range(len(ARV[i])):
-                        p.append(np.array(ARV[i][j]))
-                        q.append(np.diff(np.row_stack((p[j], p[j][0])), axis=0))
-                    p = np.concatenate(p)
-                    q = np.concatenate(q)
-                    # Calculate squared distance between edges
-                    l2 = np.sum(q ** 2, axis=1)
-                    # Catch l2 == 0 (exception)
-                    same = l2 < 1e-8
-                    l2[same] = 1.
-                    # Calc t
-                    t = np.sum((np.array([gseast[i], gsnorth[i]]) - p) * q, axis=1) / l2
-                    # Speed of boolean indices only slightly faster (negligible)
-                    # t must be limited between 0 and 1
-                    t = np.clip(t, 0., 1.)
-                    t[same] = 0.
-                    # Calculate closest point to each edge
-                    x1 = p[:, 0] + t * q[:, 0]
-                    y1 = p[:, 1] + t * q[:, 1]
-                    # Get distance squared
-                    d2 = (x1 - gseast[i]) ** 2 + (y1 - gsnorth[i]) ** 2
-                    # Sort distance
-                    ind = np.argsort(d2)
-                    x1 = x1[ind]
-                    y1 = y1[ind]
-
-                    if self.priocode == "RS7" or self.priocode == "RS8" and conf.inconf2[i]:
-                        # Loop through all exteriors and append. Afterwards concatenate
-                        p = []
-                        q = []
-                        for j in range(len(ARV2[i])):
-                            p.append(np.array(ARV2[i][j]))
-                            q.append(np.diff(np.row_stack((p[j], p[j][0])), axis=0))
-                        p = np.concatenate(p)
-                        q = np.concatenate(q)
-                        # Calculate squared distance between edges
-                        l2 = np.sum(q ** 2, axis=1)
-                        # Catch l2 == 0 (exception)
-                        same = l2 < 1e-8
-                        l2[same] = 1.
-                        # Calc t
-                        t = np.sum((np.array([gseast[i], gsnorth[i]]) - p) * q, axis=1) / l2
-                        # Speed of boolean indices only slightly faster (negligible)
-                        # t must be limited between 0 and 1
-                        t = np.clip(t, 0., 1.)
-                        t[same] = 0.
-                        # Calculate closest point to each edge
-                        x2 = p[:, 0] + t * q[:, 0]
-                        y2 = p[:, 1] + t * q[:, 1]
-                        # Get distance squared
-                        d2 = (x2 - gseast[i]) ** 2 + (y2 - gsnorth[i]) ** 2
-                        # Sort distance
-                        ind = np.argsort(d2)
-                        x2 = x2[ind]
-                        y2 = y2[ind]
-                        d2 = d2[ind]
-
-                    # Store result in conf
-                    if not conf.inconf2[i] or not self.priocode == "RS7" and not self.priocode == "RS8":
-                        conf.asase[i] = x1[0]
-                        conf.asasn[i] = y1[0]
-                    else:
-                        # Sequential method, check if both result in very similar resolutions
-                        if (x1[0] - x2[0]) * (x1[0] - x2[0]) + (x1[0] - x2[0]) * (x1[0] - x2[0]) < 1:
-                            # In that case take the full layer
-                            conf.asase[i] = x1[0]
-                            conf.asasn[i] = y1[0]
-                        else:
-                            # In that case take the partial layer solution and see which
-                            # results in lower TLOS
-                            conf.asase[i] = x1[0]
-                            conf.asasn[i] = y1[0]
-                            # dv2 for the RS1-solution
-                            dist12 = (x1[0] - gseast[i]) ** 2 + (y1[0] - gsnorth[i]) ** 2
-                            # distances for the partial layer solution stored in d2
-                            ind = d2 < dist12
-                            if sum(ind) == 1:
-                                conf.asase[i] = x2[0]
-                                conf.asasn[i] = y2[0]
-                            elif sum(ind) > 1:
-                                x2 = x2[ind]
-                                y2 = y2[ind]
-                                # Get solution with minimum TLOS
-                                i_other = conf.inrange[i]
-                                idx = self.minTLOS(conf, ownship, i, i_other, x1, y1, x2, y2)
-                                # Get solution with maximum TLOS
-                                conf.asase[i] = x2[idx]
-                                conf.asasn[i] = y2[idx]
-                            else:
-                                # This case should not happen...
-                                conf.asase[i] = x1[0]
-                                conf.asasn[i] = y1[0]
-
-            # Those that are not in conflict will be assigned zeros
-            # Or those that have no solutions (full ARV)
-            else:
-                conf.asase[i] = 0.
-                conf.asasn[i] = 0.
+        # Those that are not in conflict will be assigned zeros
+        # Or those that have no solutions (full ARV)
+        conf.asase[:] = 0.
+        conf.asasn[:] = 0.
+
+        # Only those that are in conflict need to resolve
+        reso = np.array([i for i in np.flatnonzero(conf.inconf)
+                         if ARV[i] is not None and len(ARV[i]) > 0], dtype=np.int64)
+        # First check if AP-setting is free
+        if self.priocode == "RS5":
+            free = reso[conf.ap_free[reso]]
+            conf.asase[free] = gseast[free]
+            conf.asasn[free] = gsnorth[free]
+            reso = reso[~conf.ap_free[reso]]
+        if len(reso) == 0:
+            return
+
+        # Closest point on the edges of the ARV of each aircraft
+        x1, y1 = closestpoints([ARV[i] for i in reso], gseast[reso], gsnorth[reso])
+        conf.asase[reso] = x1
+        conf.asasn[reso] = y1
+
+        if not self.priocode == "RS7" and not self.priocode == "RS8":
+            return
+
+        # Sequential method: compare with the partial layer solutions
+        for i, x1i, y1i in zip(reso, x1, y1):
+            if not conf.inconf2[i] or not ARV2[i]:
+                continue
+            _, x2, y2, d2 = edgepoints([ARV2[i]], gseast[[i]], gsnorth[[i]])
+            # Sort distance
+            ind = np.argsort(d2)
+            x2 = x2[ind]
+            y2 = y2[ind]
+            d2 = d2[ind]
+            # Check if both result in very similar resolutions,
+            # in that case take the full layer
+            if (x1i - x2[0]) * (x1i - x2[0]) + (x1i - x2[0]) * (x1i - x2[0]) < 1:
+                continue
+            # Otherwise take the partial layer solution and see which
+            # results in lower TLOS
+            # dv2 for the RS1-solution
+            dist12 = (x1i - gseast[i]) ** 2 + (y1i - gsnorth[i]) ** 2
+            # distances for the partial layer solution stored in d2
+            ind = d2 < dist12
+            if sum(ind) == 1:
+                conf.asase[i] = x2[0]
+                conf.asasn[i] = y2[0]
+            elif sum(ind) > 1:
+                x2 = x2[ind]
+                y2 = y2[ind]
+                # Get solution with minimum TLOS
+                i_other = conf.inrange[i]
+                idx = self.minTLOS(conf, ownship, i, i_other, x1i, y1i, x2, y2)
+                # Get solution with maximum TLOS
+                conf.asase[i] = x2[idx]
+                conf.asasn[i] = y2[idx]
 
 
     def area(self, vset):
@@ -620,20 +683,6 @@ class SSD(ConflictResolution):
         return A
 
 
-    def qdrdist_matrix_indices(self, ntraf):
-        """ This function gives the indices that can be used in the lon/lat-vectors """
-        # The indices will be n*(n-1)/2 long
-        # Only works for n >= 2, which is logical...
-        # This is faster than np.triu_indices :)
-        tmp_range = np.arange(ntraf - 1, dtype=np.int32)
-        ind1 = np.repeat(tmp_range, (tmp_range + 1)[::-1])
-        ind2 = np.ones(ind1.shape[0], dtype=np.int32)
-        inds = np.cumsum(tmp_range[1:][::-1] + 1)
-        np.put(ind2, inds, np.arange(ntraf * -1 + 3, 1))
-        ind2 = np.cumsum(ind2, out=ind2)
-        return ind1, ind2
-
-
     def minTLOS(self, conf, ownship, i, i_other, x1, y1, x, y):
         """ This function calculates the aggregated TLOS for all resolution points """
         # Get speeds of other AC in range
@@ -661,7 +710,7 @@ class SSD(ConflictResolution):
         # CPA distance
         dcpa2 = np.square(np.dot(dist.reshape((L, 1)), np.ones((1, W)))) - np.square(tcpa) * vrel2
         # Calculate time to LOS
-        R2 = conf.rpz * conf.rpz
+        R2 = (np.maximum(conf.rpz[i], conf.rpz[i_other]) ** 2).reshape((L, 1))
         swhorconf = dcpa2 < R2
         dxinhor = np.sqrt(np.maximum(0, R2 - dcpa2))
         dtinhor = dxinhor / np.sqrt(vrel2)
@@ -88,11 +88,11 @@ class Metrics(Entity):
         confpairs, lospairs, inconf, tcpamax, qdr, dist, dcpa, tcpa, tLOS = \
             traf.cd.detect(traf, traf, np.ones(traf.ntraf) * 20 * nm, traf.cd.hpz, np.ones(traf.ntraf) * 3600)
 
-        if confpairs:
-            own, intr = zip(*confpairs)
-            ownidx = traf.id2idx(own)
+        confpairs = traf.cd.pairindices(confpairs)
+        if len(confpairs):
+            ownidx = confpairs[:, 0]
             mask = traf.alt[ownidx] > 70 * ft
-            ownidx = np.array(ownidx)[mask]
+            ownidx = ownidx[mask]
             dcpa = np.array(dcpa)[mask]
             tcpa = np.array(tcpa)[mask]
         else:
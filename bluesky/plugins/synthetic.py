@@ -151,7 +151,7 @@ def funnel(size:int):
                  achdg=90, acalt=alt, acspd=spd)
 
     # the factor 1.01 is so that the funnel doesn't collide with itself
-    separation=traf.cd.rpz*1.01 #[m]
+    separation=traf.cd.rpz_def*1.01 #[m]
     sepdeg=separation/np.sqrt(2.)/mperdeg #[deg]
 
     for f_row in range(1):
@@ -177,7 +177,7 @@ def matrix(size:int):
     '''
     sim.reset()
     mperdeg = 111319.
-    hsep = traf.cd.rpz  # [m] horizontal separation minimum
+    hsep = traf.cd.rpz_def  # [m] horizontal separation minimum
     hseplat = hsep/mperdeg
     matsep = 1.1  # factor of extra space in the matrix
     hseplat = hseplat*matsep
@@ -215,7 +215,7 @@ def floor():
     sim.reset()
     mperdeg = 111319.
     altdif = 3000  # ft
-    hsep = traf.cd.rpz  # [m] horizontal separation minimum
+    hsep = traf.cd.rpz_def  # [m] horizontal separation minimum
     floorsep = 1.1  # factor of extra spacing in the floor
     hseplat = hsep/mperdeg*floorsep
     traf.cre(acid="OWNSHIP", actype="FLOOR",
@@ -256,7 +256,7 @@ def wall():
 
     mperdeg = 111319.
     distance = 0.6  # in degrees lat/lon, for now
-    hsep = traf.cd.rpz  # [m] horizontal separation minimum
+    hsep = traf.cd.rpz_def  # [m] horizontal separation minimum
     hseplat = hsep/mperdeg
     wallsep = 1.1  # factor of extra space in the wall
     traf.cre(acid="OWNSHIP", actype="WALL",
@@ -268,7 +268,7 @@ def wall():
                  aclat=(i-10)*hseplat*wallsep, aclon=distance,
                  achdg=270, acalt=20000*ft, acspd=200)
 
-        return True
+    return True
 
 
 @syn.subcommand
@@ -280,7 +280,7 @@ def row(numac:int, angle:int, radius:float=1.0, alt:'alt'=1e5,
     sim.reset()
 
     mperdeg = 111319.
-    hsep = traf.cd.rpz  # [m] horizontal separation minimum
+    hsep = traf.cd.rpz_def  # [m] horizontal separation minimum
     hseplat = hsep/mperdeg
     matsep = 1.1  # factor of extra space in the formation
     hseplat = hseplat*matsep
@@ -314,7 +314,7 @@ def col(numac:int, angle:int, radius:float=1.0, alt:'alt'=1e5,
     sim.reset()
 
     mperdeg = 111319.
-    hsep = traf.cd.rpz  # [m] horizontal separation minimum
+    hsep = traf.cd.rpz_def  # [m] horizontal separation minimum
     hseplat = hsep/mperdeg
     matsep = 1.1  # factor of extra space in the formation
     hseplat = hseplat*matsep
@@ -82,6 +82,9 @@ class Simulation:
             bs.traf.update()
             simtime.update()
 
+            # Delete the aircraft marked for deletion in this timestep at once
+            bs.traf.flushdelete()
+
     def update(self):
         ''' Perform a simulation update. 
             This involves performing a simulation step, and when running in real-time mode
@@ -151,7 +151,7 @@ def initbasecmds():
         "CRE": [
             "CRE acid,type,lat,lon,hdg,alt,spd",
             "txt,txt,latlon,[hdg,alt,spd]",
-            bs.traf.cre,
+            bs.traf.addcre,
             "Create an aircraft",
         ],
         "CRECMD": [
@@ -187,7 +187,7 @@ def initbasecmds():
             if isinstance(a[0], str)
             else bs.traf.groups.delgroup(a[0])
             if hasattr(a[0], "groupname")
-            else bs.traf.delete(a),
+            else bs.traf.deferdelete(a),
             "Delete command (aircraft, wind, area)",
         ],
 
@@ -360,6 +360,12 @@ def initbasecmds():
             "[bool]",
             bs.sim.realtime,
             "En-/disable realtime running allowing a variable timestep."],
+        "RENAME": [
+            "RENAME acid,newid",
+            "acid,txt",
+            bs.traf.rename,
+            "Rename an aircraft",
+        ],
         "RESET": ["RESET", "", bs.sim.reset, "Reset simulation"],
         "SEED": [
             "SEED value",
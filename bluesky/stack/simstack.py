@@ -16,7 +16,7 @@ settings.set_variable_defaults(start_location="EHAM", scenario_path="scenario")
 
 # List of TMX commands not yet implemented in BlueSky
 tmxlist = ("BGPASAS", "DFFLEVEL", "FFLEVEL", "FILTCONF", "FILTTRED", "FILTTAMB",
-           "GRAB", "HDGREF", "MOVIE", "NAVDB", "PREDASAS", "RENAME", "RETYPE",
+           "GRAB", "HDGREF", "MOVIE", "NAVDB", "PREDASAS", "RETYPE",
            "SWNLRPASAS", "TRAFRECDT", "TRAFLOGDT", "TREACT", "WINDGRID")
 
 
@@ -64,6 +64,13 @@ def process(from_pcall=None):
         cmdu = cmd.upper()
         cmdobj = Command.cmddict.get(cmdu)
 
+        # Consecutive CRE and DEL commands are applied as one batch, before
+        # any other command is processed
+        if cmdobj is not Command.cmddict.get('CRE'):
+            bs.traf.flushcre()
+        if cmdobj is not Command.cmddict.get('DEL'):
+            bs.traf.flushdelete()
+
         # If no function is found for 'cmd', check if cmd is actually an aircraft id
         if not cmdobj and cmdu in bs.traf.id:
             cmd, argstring = argparser.getnextarg(argstring)
@@ -130,6 +137,10 @@ def process(from_pcall=None):
         if echotext:
             bs.scr.echo(echotext, echoflags)
 
+    # Create and delete the remaining batches of aircraft
+    bs.traf.flushcre()
+    bs.traf.flushdelete()
+
     # Clear the processed commands
     if from_pcall is None:
         Stack.clear()
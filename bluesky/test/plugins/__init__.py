@@ -0,0 +1,3 @@
+"""
+Tests of the plugins and their tools.
+"""
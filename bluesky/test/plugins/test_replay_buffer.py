@@ -0,0 +1,67 @@
+"""
+Tests the replay buffers of the MultiAgentCRatt tools
+"""
+import numpy as np
+
+from plugins.MultiAgentCRattTools.replay_buffer import PrioritizedReplayBuffer, RaggedReplayBuffer, SumTree
+
+
+def store(buffer, value, n):
+    """ Store a transition of n agents in which all data is value """
+    buffer.store(np.full((n, 2), value), np.full((n, 1), value), np.full(n, value),
+                 np.full((n, 2), value), False)
+
+
+def live(buffer):
+    """ Slots of the transitions that are stored, oldest first """
+    return (buffer.first + np.arange(buffer.size)) % buffer.max_size
+
+
+def test_raggedreplaybuffer_zero_agents():
+    """
+    A transition without agents does not keep newer transitions whose rows
+    are overwritten from being evicted.
+    """
+    buffer = RaggedReplayBuffer(2, 1, size=8, agent_capacity=6)
+    for value, n in enumerate((0, 3, 3, 2)):
+        store(buffer, value, n)
+    assert [buffer.counts[slot] for slot in live(buffer)] == [3, 2]
+    assert np.all(buffer.obs_buf[buffer.offsets[2]:buffer.offsets[2] + 3] == 2)
+
+
+def test_raggedreplaybuffer_wraparound():
+    """
+    With any mix of agent counts, including zero, every stored transition
+    keeps its own data, and only the oldest transitions are evicted.
+    """
+    rng = np.random.default_rng(5)
+    buffer = RaggedReplayBuffer(2, 1, size=20, agent_capacity=30, batch_size=4)
+    stored = []
+    for value in range(2000):
+        n = int(rng.choice([0, 0, 1, 3, 7, 12]))
+        store(buffer, value, n)
+        stored.append((value, n))
+        slots = live(buffer)
+        assert buffer.size > 0 and buffer.counts[slots].sum() <= buffer.agent_capacity
+        for slot, (value, n) in zip(slots, stored[len(stored) - buffer.size:]):
+            assert buffer.counts[slot] == n
+            rows = slice(buffer.offsets[slot], buffer.offsets[slot] + n)
+            assert np.all(buffer.acts_buf[rows] == value)
+            assert np.all(buffer.obs_buf[rows] == value)
+
+    batch = buffer.sample_batch()
+    assert np.all(batch['obs'][~batch['mask']] == 0.)
+    assert np.all(batch['obs'][..., 0] == np.where(batch['mask'], batch['rews'], 0.))
+
+
+def test_sumtree_empty_update():
+    """ Updating no leaves leaves the tree unchanged """
+    tree = SumTree(5)
+    tree.update(np.arange(3), np.array([1., 2., 3.]))
+    tree.update(np.array([], dtype=np.int64), np.array([]))
+    tree.update(np.array([]), np.array([]))
+    assert tree.total == 6.
+
+    buffer = PrioritizedReplayBuffer(2, 1, 3, size=4, batch_size=2)
+    buffer.update_priorities(np.array([]), np.array([]))
+    assert buffer.tree.total == 0.
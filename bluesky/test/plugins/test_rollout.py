@@ -0,0 +1,153 @@
+"""
+Tests the shared replay buffer and the vectorized rollout of the
+MultiAgentCR tools
+"""
+import functools
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pytest
+import torch
+
+from plugins.MultiAgentCRTools import constants, functions
+from plugins.MultiAgentCRTools.actor import FeedForwardActor
+from plugins.MultiAgentCRTools.critic_q import FeedForward_Q
+from plugins.MultiAgentCRTools.rollout import BlueSkyEnv, SharedReplayBuffer, VectorRollout
+from plugins.MultiAgentCRTools.SAC import SAC
+
+
+N_AGENTS = 3
+
+
+def ring_scenario(n_agents, rng):
+    """ Aircraft on a ring around constants.CENTER, flying towards it """
+    from bluesky import traf
+    bearing = rng.uniform(0, 360, n_agents)
+    distance = rng.uniform(20, 40, n_agents)   # km
+    lat, lon = functions.get_point_at_distance(constants.CENTER[0], constants.CENTER[1],
+                                               distance, bearing)
+    traf.cre([f'AC{i}' for i in range(n_agents)], 'A320', lat, lon,
+             (bearing + 180) % 360, 3000., 150.)
+
+
+def empty_scenario(n_agents, rng):
+    pass
+
+
+def zero_reward(obs):
+    return np.zeros(len(obs), dtype=np.float32)
+
+
+class DummyEnv:
+    """ Environment with random observations that needs no simulation """
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self):
+        return self.rng.standard_normal((N_AGENTS, 2)).astype(np.float32)
+
+    def step(self, action):
+        return self.reset(), np.zeros(N_AGENTS, dtype=np.float32), False
+
+
+def store(buffer, value):
+    buffer.store(np.full((N_AGENTS, 2), value), np.full((N_AGENTS, 1), value),
+                 np.full(N_AGENTS, value), np.full((N_AGENTS, 2), value), False)
+    buffer.close()
+
+
+def target_headings(workdir):
+    """ Target headings after an aircraft is created and one is deleted
+    during an episode, and the headings the aircraft were created with """
+    env = BlueSkyEnv(N_AGENTS, ring_scenario, zero_reward, workdir=workdir)
+    env.reset()
+    traf = env.bs.traf
+    expected = list(traf.hdg[1:]) + [123.]
+    traf.cre('X1', 'A320', 52., 4., 123., 3000., 150.)
+    env.step(np.zeros((N_AGENTS, 2)))
+    traf.delete(0)
+    obs, _, _ = env.step(np.zeros((N_AGENTS, 2)))
+    return list(env.target.hdg), expected, obs.shape
+
+
+def test_sharedreplaybuffer():
+    """ Transitions stored by another process are sampled by the owner """
+    buffer = SharedReplayBuffer(2, 1, N_AGENTS, size=4, batch_size=2)
+    try:
+        ctx = mp.get_context('spawn')
+        for value in (1., 2.):
+            proc = ctx.Process(target=store, args=(buffer, value))
+            proc.start()
+            proc.join()
+            assert proc.exitcode == 0
+        assert len(buffer) == 2 and buffer.ptr == 2
+        batch = buffer.sample_batch()
+        assert sorted(batch['obs'][:, 0, 0]) == [1., 2.]
+        np.testing.assert_array_equal(batch['rews'][:, 0], batch['obs'][:, 0, 0])
+    finally:
+        buffer.close()
+
+
+@pytest.mark.parametrize('scenario', [ring_scenario, empty_scenario])
+def test_vectorrollout(scenario, tmp_path):
+    """ Every vector step stores one transition per environment, episodes are
+    reset in the workers, also without traffic """
+    env_fn = functools.partial(BlueSkyEnv, n_agents=N_AGENTS, scenario=scenario,
+                               reward_fn=zero_reward, episode_length=2,
+                               workdir=tmp_path)
+    obs_dim = 3 + 7 * constants.NUM_AC_STATE
+    buffer = SharedReplayBuffer(obs_dim, 2, N_AGENTS, size=16)
+    try:
+        with VectorRollout(env_fn, num_envs=2, n_agents=N_AGENTS, obs_dim=obs_dim,
+                           action_dim=2, buffer=buffer) as rollout:
+            obs = rollout.reset()
+            assert obs.shape == (2, N_AGENTS, obs_dim)
+            for step in range(3):
+                obs, dones = rollout.step(np.zeros(rollout.actions.shape))
+                assert list(dones) == [step == 1] * 2
+        assert len(buffer) == 6
+        assert list(buffer.done_buf[:6]) == [0., 0., 1., 1., 0., 0.]
+        hastraffic = np.any(buffer.obs_buf[:6] != 0, axis=(1, 2))
+        assert np.all(hastraffic == (scenario is ring_scenario))
+    finally:
+        buffer.close()
+
+
+def test_bluesky_env_target_heading(tmp_path):
+    """ Target headings follow the aircraft that are created and deleted
+    during an episode """
+    with mp.get_context('spawn').Pool(1) as pool:
+        target, expected, shape = pool.apply(target_headings, (tmp_path,))
+    assert target == expected
+    assert shape == (N_AGENTS, 3 + 7 * constants.NUM_AC_STATE)
+
+
+
+def test_vectorrollout_async_learner():
+    """ With an asynchronous learner the rollout only passes its steps to the
+    learner thread, which trains on the transitions of the workers """
+    buffer = SharedReplayBuffer(2, 2, N_AGENTS, size=64, batch_size=4)
+    model = SAC(2, buffer, FeedForwardActor(2, 2, hidden_dim=8),
+                FeedForward_Q(2, 2, hidden_dim=8), FeedForward_Q(2, 2, hidden_dim=8),
+                policy_update_freq=2, async_learner=True)
+    try:
+        with VectorRollout(DummyEnv, num_envs=2, n_agents=N_AGENTS, obs_dim=2,
+                           action_dim=2, buffer=buffer) as rollout:
+            rollout.run(model, steps=20)
+        assert len(buffer) == 40
+
+        # One update for every policy_update_freq vector steps
+        deadline = time.time() + 30
+        while model.learner_updates < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        model.stop_learner()
+        assert model.learner_updates == 10
+
+        model.sync_weights()
+        for policy, actor in zip(model.policy.parameters(), model.actor.parameters()):
+            assert policy is not actor
+            assert torch.equal(policy, actor)
+    finally:
+        model.stop_learner()
+        buffer.close()
@@ -0,0 +1,128 @@
+"""
+Tests the ring-buffered ADS-B model and multi-dimensional traffic arrays
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import bluesky as bs
+from bluesky.core import TrafficArrays
+from bluesky.traffic.adsbmodel import ADSB, FIELDS
+
+
+class TruthRoot(TrafficArrays):
+    """
+    Root of the traffic arrays with the true state variables used by ADSB.
+    """
+    def __init__(self):
+        super().__init__()
+        TrafficArrays.setroot(self)
+        with self.settrafarrays():
+            self.ident = np.array([])
+            for name in FIELDS:
+                setattr(self, name, np.array([]))
+            self.matrix = np.zeros((0, 4, 3))
+
+    def cre(self, ident):
+        n = len(ident)
+        self.create(n)
+        self.ident[-n:] = ident
+        self.settruth(-n)
+        self.create_children(n)
+
+    def settruth(self, start=0):
+        # Every state variable is a unique function of aircraft and time
+        for k, name in enumerate(FIELDS):
+            getattr(self, name)[start:] = self.ident[start:] * 1000. + k + bs.sim.simt
+
+
+@pytest.fixture
+def traf(monkeypatch):
+    monkeypatch.setattr(TrafficArrays, 'root', None)
+    monkeypatch.setattr(bs, 'sim', SimpleNamespace(simt=0.0, simdt=0.5), raising=False)
+    root = TruthRoot()
+    monkeypatch.setattr(bs, 'traf', root, raising=False)
+    # A new ADSB object instead of the singleton, as child of this root
+    root.adsb = object.__new__(ADSB)
+    root.adsb.__init__()
+    return root
+
+
+def step(traf):
+    bs.sim.simt += bs.sim.simdt
+    traf.adsb.update()
+    traf.settruth()
+
+
+def test_trafficarrays_ndarray(traf):
+    """
+    Multi-dimensional traffic arrays are created, deleted and reset along
+    the aircraft axis.
+    """
+    traf.cre([1., 2., 3.])
+    assert traf.matrix.shape == (3, 4, 3)
+    traf.matrix[:] = traf.ident[:, np.newaxis, np.newaxis]
+    traf.delete(1)
+    assert traf.matrix.shape == (2, 4, 3)
+    assert np.all(traf.matrix[0] == 1.) and np.all(traf.matrix[1] == 3.)
+    assert traf.adsb.hist.shape == (2, traf.adsb.histlen, len(FIELDS))
+    traf.reset()
+    assert traf.matrix.shape == (0, 4, 3) and traf.adsb.ntraf == 0
+
+
+def test_adsb_perfect(traf):
+    """
+    Without interval, latency and dropout the ADS-B data is the true state
+    at the time of the update.
+    """
+    traf.cre([1., 2., 3.])
+    for i in range(10):
+        truth = traf.adsb.truth()
+        step(traf)
+        if i == 4:
+            traf.delete(0)
+            traf.cre([4.])
+            # New aircraft start with their state at creation
+            truth = np.vstack((truth[1:], traf.adsb.truth(slice(-1, None))))
+        for k, name in enumerate(FIELDS):
+            assert np.array_equal(getattr(traf.adsb, name), truth[:, k])
+
+
+def test_adsb_latency(traf):
+    """
+    Received data is the true state of the most recent broadcast that
+    has arrived, also across the start of the history.
+    """
+    traf.cre([1., 2., 3., 4.])
+    traf.adsb.setmodel(0, 0.0, 2.0, 0.0)
+    traf.adsb.setmodel(1, 1.0, 0.0, 0.0)
+    traf.adsb.setmodel(2, 1.5, 3.0, 0.0)
+    traf.adsb.setmodel(3, 0.0, 0.0, 1.0)
+    for _ in range(200):
+        step(traf)
+        adsb = traf.adsb
+        # Truth was recorded just before each update, labelled with its time
+        tsent = adsb.lastupdate[:3]
+        trecorded = np.floor(tsent / bs.sim.simdt) * bs.sim.simdt - bs.sim.simdt
+        expected = traf.ident[:3] * 1000. + np.maximum(trecorded, 0.0)
+        assert np.allclose(adsb.lat[:3], expected)
+        if bs.sim.simt > 10.0:
+            # After the first broadcasts have arrived
+            age = bs.sim.simt - adsb.lastupdate
+            assert np.all(age[:3] <= adsb.interval[:3] + adsb.latency[:3] + bs.sim.simdt)
+            assert np.all(age[:3] >= adsb.latency[:3])
+        # All broadcasts of the last aircraft are dropped
+        assert adsb.lastupdate[3] == 0.0 and adsb.lat[3] == 4000.
+
+
+def test_adsb_commands(traf):
+    traf.cre([1., 2.])
+    assert not traf.adsb.setmodel(0, -1.0)[0]
+    assert not traf.adsb.setdefault(dropout=1.5)[0]
+    traf.adsb.setdefault(2.0, 1.0)
+    traf.cre([3.])
+    assert np.all(traf.adsb.interval == 2.0) and np.all(traf.adsb.latency == 1.0)
+    assert np.all(traf.adsb.phase < 2.0)
+    # Longer delays than the history give a warning
+    assert 'Warning' in traf.adsb.setmodel(1, 100.0)[1]
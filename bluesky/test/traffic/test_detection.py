@@ -0,0 +1,100 @@
+"""
+Tests the conflict database of ConflictDetection when aircraft are deleted
+"""
+import numpy as np
+import pytest
+
+import bluesky as bs
+from bluesky.core import TrafficArrays
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.traffic.traffic import aircraft_deleted
+
+
+class PairRoot(TrafficArrays):
+    """
+    Root of the traffic arrays used by conflict detection.
+    """
+    def __init__(self):
+        super().__init__()
+        TrafficArrays.setroot(self)
+        with self.settrafarrays():
+            self.id = []
+            self.uid = np.array([], dtype=np.int64)
+            for name in ('lat', 'lon', 'trk', 'gs', 'alt', 'vs'):
+                setattr(self, name, np.array([]))
+
+    @property
+    def ntraf(self):
+        return len(self.lat)
+
+    def cre(self, acid, lat, lon, trk):
+        n = len(acid)
+        self.create(n)
+        self.id[-n:] = acid
+        self.uid[-n:] = np.arange(self.ntraf - n, self.ntraf)
+        self.lat[-n:], self.lon[-n:], self.trk[-n:] = lat, lon, trk
+        self.gs[-n:], self.alt[-n:] = 150., 3000.
+        self.create_children(n)
+
+    def delete(self, idx):
+        # Notify the index holders, as Traffic.delete does
+        keep = np.ones(self.ntraf, dtype=bool)
+        keep[idx] = False
+        super().delete(idx)
+        aircraft_deleted.emit(np.flatnonzero(~keep), np.where(keep, np.cumsum(keep) - 1, -1))
+
+    def uid2idx(self, uid):
+        idx = np.minimum(np.searchsorted(self.uid, uid), self.ntraf - 1)
+        return np.where(self.uid[idx] == uid, idx, -1)
+
+
+@pytest.fixture
+def traf(monkeypatch):
+    monkeypatch.setattr(TrafficArrays, 'root', None)
+    root = PairRoot()
+    monkeypatch.setattr(bs, 'traf', root, raising=False)
+    # A new StateBased object instead of the singleton, as child of this root
+    root.cd = object.__new__(StateBased)
+    root.cd.__init__()
+    return root
+
+
+def test_detection_delete(traf):
+    """
+    Deleting an aircraft between detection updates removes its pairs, and
+    renumbers the pairs of the remaining aircraft.
+    """
+    # Two head-on encounters
+    traf.cre(['A0', 'A1', 'A2', 'A3'], [52., 52., 53., 53.], [4., 4.2, 4., 4.2],
+             [90., 270., 90., 270.])
+    traf.cd.update(traf, traf)
+    assert sorted(map(tuple, traf.cd.confidx)) == [(0, 1), (1, 0), (2, 3), (3, 2)]
+    assert traf.cd.nconf_cur == 2
+    pairdata = {(traf.id[i], traf.id[j]): traf.cd.tcpa[k]
+                for k, (i, j) in enumerate(traf.cd.confidx)}
+
+    traf.delete(0)
+    assert sorted(map(tuple, traf.cd.confidx)) == [(1, 2), (2, 1)]
+    assert sorted(traf.cd.confpairs) == [('A2', 'A3'), ('A3', 'A2')]
+    assert len(traf.cd.qdr) == len(traf.cd.tcpa) == 2
+    for k, pair in enumerate(traf.cd.confpairs):
+        assert traf.cd.tcpa[k] == pairdata[pair]
+    assert traf.cd.nconf_cur == 1
+    assert traf.cd.confpairs_unique == {frozenset(('A2', 'A3'))}
+
+
+def test_detection_delete_unselected(traf):
+    """
+    The conflicts of a detection method that is not selected are renumbered
+    as well, so that they are valid when it is selected again.
+    """
+    traf.cre(['A0', 'A1', 'A2', 'A3'], [52., 52., 53., 53.], [4., 4.2, 4., 4.2],
+             [90., 270., 90., 270.])
+    traf.cd.update(traf, traf)
+    unselected = traf.cd
+    traf.cd = object.__new__(StateBased)
+    traf.cd.__init__()
+
+    traf.delete([0, 1])
+    assert sorted(map(tuple, unselected.confidx)) == [(0, 1), (1, 0)]
+    assert sorted(unselected.confpairs) == [('A2', 'A3'), ('A3', 'A2')]
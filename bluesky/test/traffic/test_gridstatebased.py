@@ -0,0 +1,53 @@
+"""
+Tests the grid based conflict detection against StateBased
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from bluesky.tools.aero import nm, ft
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.traffic.asas.gridstatebased import GridStateBased
+
+
+def make_traffic(rng, n, lat0, lon0, spread):
+    """
+    Random traffic in a square around (lat0, lon0), at a few flight levels.
+    """
+    traf = SimpleNamespace(
+        ntraf=n, id=[f'AC{i}' for i in range(n)],
+        lat=lat0 + rng.uniform(-spread, spread, n),
+        lon=lon0 + rng.uniform(-spread, spread, n),
+        trk=rng.uniform(0, 360, n), gs=rng.uniform(100, 250, n),
+        alt=rng.choice([3000., 3300., 6000.], n) + rng.uniform(-200, 200, n),
+        vs=rng.choice([0., 0., 5., -5.], n))
+    traf.gseast = traf.gs * np.sin(np.radians(traf.trk))
+    traf.gsnorth = traf.gs * np.cos(np.radians(traf.trk))
+    return traf
+
+
+@pytest.mark.parametrize('n, lat0, lon0, spread', [
+    (1, 52., 4., 1.),
+    (200, 52., 4., 0.3),
+    (400, 52., 4., 3.),
+    (200, -60., 179.9, 1.),
+])
+def test_gridstatebased_matches_statebased(n, lat0, lon0, spread):
+    """
+    GridStateBased should return exactly the same conflicts, LoS pairs
+    and conflict data as StateBased.
+    """
+    rng = np.random.default_rng(n)
+    ownship = make_traffic(rng, n, lat0, lon0, spread)
+    rpz = np.full(n, 5 * nm)
+    rpz[:n // 3] = 3 * nm
+    hpz = np.full(n, 1000 * ft)
+    dtlookahead = np.full(n, 300.)
+    dtlookahead[::5] = 120.
+
+    expected = object.__new__(StateBased).detect(ownship, ownship, rpz, hpz, dtlookahead)
+    result = object.__new__(GridStateBased).detect(ownship, ownship, rpz, hpz, dtlookahead)
+
+    for res, exp in zip(result, expected):
+        assert np.array_equal(np.asarray(res), np.asarray(exp))
@@ -0,0 +1,222 @@
+"""
+Tests the array-wide MVP resolution against a loop over the conflict pairs
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from bluesky.tools.aero import nm, ft
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.traffic.asas.mvp import MVP
+from bluesky.test.traffic.test_gridstatebased import make_traffic
+
+
+def make_mvp(swprio, priocode, noreso, resooff):
+    mvp = object.__new__(MVP)
+    mvp.swprio = swprio
+    mvp.priocode = priocode
+    mvp.resofach = 1.05
+    mvp.resofacv = 1.05
+    mvp.noresoac = noreso
+    mvp.resooffac = resooff
+    return mvp
+
+
+def applyprio(mvp, dv_mvp, dv1, dv2, vs1, vs2):
+    """
+    Reference: the priority rules for a single conflict pair.
+    """
+    # Primary Free Flight prio rules (no priority)
+    if mvp.priocode == 'FF1':
+        # since cooperative, the vertical resolution component can be halved, and then dv_mvp can be added
+        dv_mvp[2] = dv_mvp[2] / 2.0
+        dv1 = dv1 - dv_mvp
+        dv2 = dv2 + dv_mvp
+
+    # Secondary Free Flight (Cruising aircraft has priority, combined resolutions)
+    if mvp.priocode == 'FF2':
+        # since cooperative, the vertical resolution component can be halved, and then dv_mvp can be added
+        dv_mvp[2] = dv_mvp[2]/2.0
+        # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 2 solves conflict
+        if abs(vs1) < 0.1 and abs(vs2) > 0.1:
+            dv2 = dv2 + dv_mvp
+        # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 1 solves conflict
+        elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
+            dv1 = dv1 - dv_mvp
+        else:  # both are climbing/descending/cruising -> both aircraft solves the conflict
+            dv1 = dv1 - dv_mvp
+            dv2 = dv2 + dv_mvp
+
+    # Tertiary Free Flight (Climbing/descending aircraft have priority and crusing solves with horizontal resolutions)
+    elif mvp.priocode == 'FF3':
+        # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 1 solves conflict horizontally
+        if abs(vs1) < 0.1 and abs(vs2) > 0.1:
+            dv_mvp[2] = 0.0
+            dv1 = dv1 - dv_mvp
+        # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 2 solves conflict horizontally
+        elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
+            dv_mvp[2] = 0.0
+            dv2 = dv2 + dv_mvp
+        else:  # both are climbing/descending/cruising -> both aircraft solves the conflict, combined
+            dv_mvp[2] = dv_mvp[2]/2.0
+            dv1 = dv1 - dv_mvp
+            dv2 = dv2 + dv_mvp
+
+    # Primary Layers (Cruising aircraft has priority and clmibing/descending solves. All conflicts solved horizontally)
+    elif mvp.priocode == 'LAY1':
+        dv_mvp[2] = 0.0
+        # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 2 solves conflict horizontally
+        if abs(vs1) < 0.1 and abs(vs2) > 0.1:
+            dv2 = dv2 + dv_mvp
+        # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 1 solves conflict horizontally
+        elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
+            dv1 = dv1 - dv_mvp
+        else:  # both are climbing/descending/cruising -> both aircraft solves the conflict horizontally
+            dv1 = dv1 - dv_mvp
+            dv2 = dv2 + dv_mvp
+
+    # Secondary Layers (Climbing/descending aircraft has priority and cruising solves. All conflicts solved horizontally)
+    elif mvp.priocode == 'LAY2':
+        dv_mvp[2] = 0.0
+        # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 1 solves conflict horizontally
+        if abs(vs1) < 0.1 and abs(vs2) > 0.1:
+            dv1 = dv1 - dv_mvp
+        # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 2 solves conflict horizontally
+        elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
+            dv2 = dv2 + dv_mvp
+        else:  # both are climbing/descending/cruising -> both aircraft solves the conflic horizontally
+            dv1 = dv1 - dv_mvp
+            dv2 = dv2 + dv_mvp
+
+    return dv1, dv2
+
+
+def mvp_pair(mvp, ownship, intruder, conf, qdr, dist, tcpa, tLOS, idx1, idx2):
+    """
+    Reference: the Modified Voltage Potential resolution of a single conflict pair.
+    """
+    # Preliminary calculations-------------------------------------------------
+    # Determine largest RPZ and HPZ of the conflict pair, use lookahead of ownship
+    rpz_m = np.max(conf.rpz[[idx1, idx2]] * mvp.resofach)
+    hpz_m = np.max(conf.hpz[[idx1, idx2]] * mvp.resofacv)
+    dtlook = conf.dtlookahead[idx1]
+    # Convert qdr from degrees to radians
+    qdr = np.radians(qdr)
+
+    # Relative position vector between id1 and id2
+    drel = np.array([np.sin(qdr) * dist, \
+                    np.cos(qdr) * dist, \
+                    intruder.alt[idx2] - ownship.alt[idx1]])
+
+    # Write velocities as vectors and find relative velocity vector
+    v1 = np.array([ownship.gseast[idx1], ownship.gsnorth[idx1], ownship.vs[idx1]])
+    v2 = np.array([intruder.gseast[idx2], intruder.gsnorth[idx2], intruder.vs[idx2]])
+    vrel = v2 - v1
+
+    # Horizontal resolution----------------------------------------------------
+
+    # Find horizontal distance at the tcpa (min horizontal distance)
+    dcpa  = drel + vrel*tcpa
+    dabsH = np.sqrt(dcpa[0] * dcpa[0] + dcpa[1] * dcpa[1])
+
+    # Compute horizontal intrusion
+    iH = rpz_m - dabsH
+
+    # Exception handlers for head-on conflicts
+    # This is done to prevent division by zero in the next step
+    if dabsH <= 10.:
+        dabsH = 10.
+        dcpa[0] = drel[1] / dist * dabsH
+        dcpa[1] = -drel[0] / dist * dabsH
+
+    # If intruder is outside the ownship PZ, then apply extra factor
+    # to make sure that resolution does not graze IPZ
+    if rpz_m < dist and dabsH < dist:
+        # Compute the resolution velocity vector in horizontal direction.
+        # abs(tcpa) because it bcomes negative during intrusion.
+        erratum = np.cos(np.arcsin(rpz_m / dist)-np.arcsin(dabsH / dist))
+        dv1 = ((rpz_m / erratum - dabsH) * dcpa[0]) / (abs(tcpa) * dabsH)
+        dv2 = ((rpz_m / erratum - dabsH) * dcpa[1]) / (abs(tcpa) * dabsH)
+    else:
+        dv1 = (iH * dcpa[0]) / (abs(tcpa) * dabsH)
+        dv2 = (iH * dcpa[1]) / (abs(tcpa) * dabsH)
+
+    # Vertical resolution------------------------------------------------------
+
+    # Compute the  vertical intrusion
+    # Amount of vertical intrusion dependent on vertical relative velocity
+    iV = hpz_m if abs(vrel[2]) > 0.0 else hpz_m - abs(drel[2])
+
+    # Get the time to solve the conflict vertically - tsolveV
+    tsolV = abs(drel[2] / vrel[2]) if abs(vrel[2]) > 0.0 else tLOS
+
+    # If the time to solve the conflict vertically is longer than the look-ahead time,
+    # because the the relative vertical speed is very small, then solve the intrusion
+    # within tinconf
+    if tsolV > dtlook:
+        tsolV = tLOS
+        iV    = hpz_m
+
+    # Compute the resolution velocity vector in the vertical direction
+    # The direction of the vertical resolution is such that the aircraft with
+    # higher climb/decent rate reduces their climb/decent rate
+    dv3 = np.where(abs(vrel[2]) > 0.0, (iV / tsolV) * (-vrel[2] / abs(vrel[2])), (iV / tsolV))
+
+    # Combine resolutions------------------------------------------------------
+
+    # combine the dv components
+    dv = np.array([dv1, dv2, dv3])
+
+    return dv, tsolV
+
+
+def resolve_loop(mvp, conf, ownship, intruder):
+    """
+    Reference: the per pair loop over the scalar MVP function.
+    """
+    dv = np.zeros((ownship.ntraf, 3))
+    timesolveV = np.ones(ownship.ntraf) * 1e9
+    for ((idx1, idx2), qdr, dist, tcpa, tLOS) in zip(conf.confidx, conf.qdr, conf.dist, conf.tcpa, conf.tLOS):
+        dv_mvp, tsolV = mvp_pair(mvp, ownship, intruder, conf, qdr, dist, tcpa, tLOS, idx1, idx2)
+        if tsolV < timesolveV[idx1]:
+            timesolveV[idx1] = tsolV
+        if mvp.swprio:
+            dv[idx1], _ = applyprio(mvp, dv_mvp, dv[idx1], dv[idx2], ownship.vs[idx1], intruder.vs[idx2])
+        else:
+            dv_mvp[2] = 0.5 * dv_mvp[2]
+            dv[idx1] = dv[idx1] - dv_mvp
+        if mvp.noresoac[idx2]:
+            dv[idx1] = dv[idx1] + dv_mvp
+        if mvp.resooffac[idx1]:
+            dv[idx1] = 0.0
+    return dv, timesolveV
+
+
+@pytest.mark.parametrize('swprio, priocode', [
+    (False, ''), (True, 'FF1'), (True, 'FF2'), (True, 'FF3'), (True, 'LAY1'), (True, 'LAY2'),
+])
+def test_mvp_pairs_match_loop(swprio, priocode):
+    """
+    The vectorised resolution should give exactly the same resolution
+    vectors and vertical solve times as the loop over the pairs.
+    """
+    n = 200
+    rng = np.random.default_rng(13)
+    traf = make_traffic(rng, n, 52., 4., 0.3)
+    rpz = np.full(n, 5 * nm)
+    hpz = np.full(n, 1000 * ft)
+    dtlookahead = np.full(n, 300.)
+    confidx, _, _, _, qdr, dist, _, tcpa, tLOS = \
+        object.__new__(StateBased).detect(traf, traf, rpz, hpz, dtlookahead)
+    conf = SimpleNamespace(confidx=confidx, qdr=qdr, dist=dist, tcpa=tcpa,
+                           tLOS=tLOS, rpz=rpz, hpz=hpz, dtlookahead=dtlookahead)
+    assert len(confidx) > 100
+
+    mvp = make_mvp(swprio, priocode,
+                   noreso=rng.random(n) < 0.1, resooff=rng.random(n) < 0.1)
+    expected = resolve_loop(mvp, conf, traf, traf)
+    result = mvp.resolutionvectors(conf, traf, traf)
+
+    for res, exp in zip(result, expected):
+        np.testing.assert_array_equal(res, exp)
@@ -0,0 +1,594 @@
+"""
+Tests the batched SSD construction against the per-aircraft construction
+it replaced, also with cached SSDs and with a worker pool
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from bluesky.tools import geo
+from bluesky.tools.aero import nm
+from bluesky.plugins.asas.ssd import SSD
+from bluesky.test.traffic.test_gridstatebased import make_traffic
+
+pyclipper = pytest.importorskip('pyclipper')
+
+
+class ReferenceSSD(SSD):
+    """
+    Reference: the SSD construction and resolution with a loop over the
+    aircraft and a loop over the intruders of each aircraft. Only changed
+    to use the largest rpz of each pair, instead of the rpz array as a
+    scalar, and to skip the sequential comparison when the partial layer
+    has no ARV.
+    """
+    def constructSSD(self, conf, ownship, priocode="RS1"):
+        """ Calculates the FRV and ARV of the SSD """
+        N = 0
+        # Parameters
+        N_angle = 180  # [-] Number of points on circle (discretization)
+        hsep = conf.rpz  # [m] Horizontal separation (5 NM)
+        margin = self.resofach  # [-] Safety margin for evasion
+        alpham = 0.4999 * np.pi  # [rad] Maximum half-angle for VO
+        betalos = np.pi / 4  # [rad] Minimum divertion angle for LOS (45 deg seems optimal)
+        adsbmax = 65. * nm  # [m] Maximum ADS-B range
+        beta = np.pi / 4 + betalos / 2
+        if priocode == "RS7" or priocode == "RS8":
+            adsbmax /= 2
+
+        # Relevant info from traf
+        gsnorth = ownship.gsnorth
+        gseast = ownship.gseast
+        lat = ownship.lat
+        lon = ownship.lon
+        ntraf = ownship.ntraf
+        hdg = ownship.hdg
+        gs_ap = ownship.ap.tas
+        hdg_ap = ownship.ap.trk
+        apnorth = np.cos(hdg_ap / 180 * np.pi) * gs_ap
+        apeast = np.sin(hdg_ap / 180 * np.pi) * gs_ap
+
+        # Local variables, will be put into asas later
+        FRV_loc = [None] * ownship.ntraf
+        ARV_loc = [None] * ownship.ntraf
+        # For calculation purposes
+        ARV_calc_loc = [None] * ownship.ntraf
+        FRV_area_loc = np.zeros(ownship.ntraf, dtype=np.float32)
+        ARV_area_loc = np.zeros(ownship.ntraf, dtype=np.float32)
+
+        # # Use velocity limits for the ring-shaped part of the SSD
+        # Discretize the circles using points on circle
+        angles = np.arange(0, 2 * np.pi, 2 * np.pi / N_angle)
+        # Put points of unit-circle in a (180x2)-array (CW)
+        xyc = np.transpose(np.reshape(np.concatenate((np.sin(angles), np.cos(angles))), (2, N_angle)))
+
+        # If no traffic
+        if ntraf == 0:
+            return
+
+        ind1, ind2 = self.qdrdist_matrix_indices(ntraf)
+        # Get absolute bearing [deg] and distance [nm]
+        # Not sure abs/rel, but qdr is defined from [-180,180] deg, w.r.t. North
+        [qdr, dist] = geo.qdrdist_matrix(lat[ind1], lon[ind1], lat[ind2], lon[ind2])
+        # Put result of function from matrix to ndarray
+        qdr = np.reshape(np.array(qdr), np.shape(ind1))
+        dist = np.reshape(np.array(dist), np.shape(ind1))
+        # SI-units from [deg] to [rad]
+        qdr = np.deg2rad(qdr)
+        # Get distance from [nm] to [m]
+        dist = dist * nm
+
+        # [m] Horizontal separation with safety margin of each pair
+        hsepm = np.maximum(hsep[ind1], hsep[ind2]) * margin
+
+        # In LoS the VO can't be defined, act as if dist is on edge
+        dist[dist < hsepm] = hsepm[dist < hsepm]
+
+        # Calculate vertices of Velocity Obstacle (CCW)
+        # These are still in relative velocity space, see derivation in appendix
+        # Half-angle of the Velocity obstacle [rad]
+        # Include safety margin
+        alpha = np.arcsin(hsepm / dist)
+        # Limit half-angle alpha to 89.982 deg. Ensures that VO can be constructed
+        alpha[alpha > alpham] = alpham
+        # Relevant sin/cos/tan
+        sinqdr = np.sin(qdr)
+        cosqdr = np.cos(qdr)
+        tanalpha = np.tan(alpha)
+        cosqdrtanalpha = cosqdr * tanalpha
+        sinqdrtanalpha = sinqdr * tanalpha
+
+        # Consider every aircraft
+        for i in range(ntraf):
+            # Calculate SSD only for aircraft in conflict (See formulas appendix)
+            if conf.inconf[i]:
+
+                vmin = ownship.perf.vmin[i]
+                vmax = ownship.perf.vmax[i]
+
+                # in the first time step, ASAS runs before perf, which means that his value will be zero
+                # and the SSD cannot be constructed
+                if vmin == vmax == 0:
+                    continue
+
+                # Map them into the format pyclipper wants. Outercircle CCW, innercircle CW
+                circle_tup = (tuple(map(tuple, np.flipud(xyc * vmax))), tuple(map(tuple, xyc * vmin)))
+                circle_lst = [list(map(list, np.flipud(xyc * vmax))), list(map(list, xyc * vmin))]
+
+                # Relevant x1,y1,x2,y2 (x0 and y0 are zero in relative velocity space)
+                x1 = (sinqdr + cosqdrtanalpha) * 2 * vmax
+                x2 = (sinqdr - cosqdrtanalpha) * 2 * vmax
+                y1 = (cosqdr - sinqdrtanalpha) * 2 * vmax
+                y2 = (cosqdr + sinqdrtanalpha) * 2 * vmax
+
+                # SSD for aircraft i
+                # Get indices that belong to aircraft i
+                ind = np.where(np.logical_or(ind1 == i, ind2 == i))[0]
+                # Check whether there are any aircraft in the vicinity
+                if len(ind) == 0:
+                    # No aircraft in the vicinity
+                    # Map them into the format ARV wants. Outercircle CCW, innercircle CW
+                    ARV_loc[i] = circle_lst
+                    FRV_loc[i] = []
+                    ARV_calc_loc[i] = ARV_loc[i]
+                    # Calculate areas and store in asas
+                    FRV_area_loc[i] = 0
+                    ARV_area_loc[i] = np.pi * (vmax ** 2 - vmin ** 2)
+                else:
+                    # The i's of the other aircraft
+                    i_other = np.delete(np.arange(0, ntraf), i)
+                    # Aircraft that are within ADS-B range
+                    ac_adsb = np.where(dist[ind] < adsbmax)[0]
+                    # Now account for ADS-B range in indices of other aircraft (i_other)
+                    ind = ind[ac_adsb]
+                    i_other = i_other[ac_adsb]
+                    if not priocode == "RS7" and not priocode == "RS8":
+                        # Put it in class-object (not for RS7 and RS8)
+                        conf.inrange[i] = i_other
+                    else:
+                        conf.inrange2[i] = i_other
+                    # VO from 2 to 1 is mirror of 1 to 2. Only 1 to 2 can be constructed in
+                    # this manner, so need a correction vector that will mirror the VO
+                    fix = np.ones(np.shape(i_other))
+                    fix[i_other < i] = -1
+                    # Relative bearing [deg] from [-180,180]
+                    # (less required conversions than rad in RotA)
+                    fix_ang = np.zeros(np.shape(i_other))
+                    fix_ang[i_other < i] = 180.
+
+                    # Get vertices in an x- and y-array of size (ntraf-1)*3x1
+                    x = np.concatenate((gseast[i_other],
+                                        x1[ind] * fix + gseast[i_other],
+                                        x2[ind] * fix + gseast[i_other]))
+                    y = np.concatenate((gsnorth[i_other],
+                                        y1[ind] * fix + gsnorth[i_other],
+                                        y2[ind] * fix + gsnorth[i_other]))
+                    # Reshape [(ntraf-1)x3] and put arrays in one array [(ntraf-1)x3x2]
+                    x = np.transpose(x.reshape(3, np.shape(i_other)[0]))
+                    y = np.transpose(y.reshape(3, np.shape(i_other)[0]))
+                    xy = np.dstack((x, y))
+
+                    # Make a clipper object
+                    pc = pyclipper.Pyclipper()
+                    # Add circles (ring-shape) to clipper as subject
+                    pc.AddPaths(pyclipper.scale_to_clipper(circle_tup), pyclipper.PT_SUBJECT, True)
+
+                    # Extra stuff needed for RotA
+                    if priocode == "RS6":
+                        # Make another clipper object for RotA
+                        pc_rota = pyclipper.Pyclipper()
+                        pc_rota.AddPaths(pyclipper.scale_to_clipper(circle_tup), pyclipper.PT_SUBJECT, True)
+                        # Bearing calculations from own view and other view
+                        brg_own = np.mod((np.rad2deg(qdr[ind]) + fix_ang - hdg[i]) + 540., 360.) - 180.
+                        brg_other = np.mod((np.rad2deg(qdr[ind]) + 180. - fix_ang - hdg[i_other]) + 540., 360.) - 180.
+
+                    # Add each other other aircraft to clipper as clip
+                    for j in range(np.shape(i_other)[0]):
+                        # Scale VO when not in LOS
+                        if dist[ind[j]] > hsepm[ind[j]]:
+                            # Normally VO shall be added of this other a/c
+                            VO = pyclipper.scale_to_clipper(tuple(map(tuple, xy[j, :, :])))
+                        else:
+                            # Pair is in LOS, instead of triangular VO, use darttip
+                            # Check if bearing should be mirrored
+                            if i_other[j] < i:
+                                qdr_los = qdr[ind[j]] + np.pi
+                            else:
+                                qdr_los = qdr[ind[j]]
+                            # Length of inner-leg of darttip
+                            leg = 1.1 * vmax / np.cos(beta) * np.array([1, 1, 1, 0])
+                            # Angles of darttip
+                            angles_los = np.array([qdr_los + 2 * beta, qdr_los, qdr_los - 2 * beta, 0.])
+                            # Calculate coordinates (CCW)
+                            x_los = leg * np.sin(angles_los)
+                            y_los = leg * np.cos(angles_los)
+                            # Put in array of correct format
+                            xy_los = np.vstack((x_los, y_los)).T
+                            # Scale darttip
+                            VO = pyclipper.scale_to_clipper(tuple(map(tuple, xy_los)))
+                        # Add scaled VO to clipper
+                        pc.AddPath(VO, pyclipper.PT_CLIP, True)
+                        # For RotA it is possible to ignore
+                        if priocode == "RS6":
+                            if brg_own[j] >= -20. and brg_own[j] <= 110.:
+                                # Head-on or converging from right
+                                pc_rota.AddPath(VO, pyclipper.PT_CLIP, True)
+                            elif brg_other[j] <= -110. or brg_other[j] >= 110.:
+                                # In overtaking position
+                                pc_rota.AddPath(VO, pyclipper.PT_CLIP, True)
+                        # Detect conflicts for smaller layer in RS7 and RS8
+                        if priocode == "RS7" or priocode == "RS8":
+                            if pyclipper.PointInPolygon(pyclipper.scale_to_clipper((gseast[i], gsnorth[i])), VO):
+                                conf.inconf2[i] = True
+                        if priocode == "RS5":
+                            if pyclipper.PointInPolygon(pyclipper.scale_to_clipper((apeast[i], apnorth[i])), VO):
+                                conf.ap_free[i] = False
+
+                    # Execute clipper command
+                    FRV = pyclipper.scale_from_clipper(
+                        pc.Execute(pyclipper.CT_INTERSECTION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO))
+
+                    ARV = pc.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO)
+
+                    if not priocode == "RS1" and not priocode == "RS5" and not priocode == "RS7" and not priocode == "RS8":
+                        # Make another clipper object for extra intersections
+                        pc2 = pyclipper.Pyclipper()
+                        # When using RotA clip with pc_rota
+                        if priocode == "RS6":
+                            # Calculate ARV for RotA
+                            ARV_rota = pc_rota.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_NONZERO,
+                                                       pyclipper.PFT_NONZERO)
+                            if len(ARV_rota) > 0:
+                                pc2.AddPaths(ARV_rota, pyclipper.PT_CLIP, True)
+                        else:
+                            # Put the ARV in there, make sure it's not empty
+                            if len(ARV) > 0:
+                                pc2.AddPaths(ARV, pyclipper.PT_CLIP, True)
+
+                    # Scale back
+                    ARV = pyclipper.scale_from_clipper(ARV)
+
+                    # Check if ARV or FRV is empty
+                    if len(ARV) == 0:
+                        # No aircraft in the vicinity
+                        # Map them into the format ARV wants. Outercircle CCW, innercircle CW
+                        ARV_loc[i] = []
+                        FRV_loc[i] = circle_lst
+                        ARV_calc_loc[i] = []
+                        # Calculate areas and store in asas
+                        FRV_area_loc[i] = np.pi * (vmax ** 2 - vmin ** 2)
+                        ARV_area_loc[i] = 0
+                    elif len(FRV) == 0:
+                        # Should not happen with one a/c or no other a/c in the vicinity.
+                        # These are handled earlier. Happens when RotA has removed all
+                        # Map them into the format ARV wants. Outercircle CCW, innercircle CW
+                        ARV_loc[i] = circle_lst
+                        FRV_loc[i] = []
+                        ARV_calc_loc[i] = circle_lst
+                        # Calculate areas and store in asas
+                        FRV_area_loc[i] = 0
+                        ARV_area_loc[i] = np.pi * (vmax ** 2 - vmin ** 2)
+                    else:
+                        # Check multi exteriors, if this layer is not a list, it means it has no exteriors
+                        # In that case, make it a list, such that its format is consistent with further code
+                        if not type(FRV[0][0]) == list:
+                            FRV = [FRV]
+                        if not type(ARV[0][0]) == list:
+                            ARV = [ARV]
+                        # Store in asas
+                        FRV_loc[i] = FRV
+                        ARV_loc[i] = ARV
+                        # Calculate areas and store in asas
+                        FRV_area_loc[i] = self.area(FRV)
+                        ARV_area_loc[i] = self.area(ARV)
+
+                        # For resolution purposes sometimes extra intersections are wanted
+                        if priocode == "RS2" or priocode == "RS9" or priocode == "RS6" or priocode == "RS3" or priocode == "RS4":
+                            # Make a box that covers right or left of SSD
+                            own_hdg = hdg[i] * np.pi / 180
+                            # Efficient calculation of box, see notes
+                            if priocode == "RS2" or priocode == "RS6":
+                                # CW or right-turning
+                                sin_table = np.array([[1, 0], [-1, 0], [-1, -1], [1, -1]], dtype=np.float64)
+                                cos_table = np.array([[0, 1], [0, -1], [1, -1], [1, 1]], dtype=np.float64)
+                            elif priocode == "RS9":
+                                # CCW or left-turning
+                                sin_table = np.array([[1, 0], [1, 1], [-1, 1], [-1, 0]], dtype=np.float64)
+                                cos_table = np.array([[0, 1], [-1, 1], [-1, -1], [0, -1]], dtype=np.float64)
+                            # Overlay a part of the full SSD
+                            if priocode == "RS2" or priocode == "RS9" or priocode == "RS6":
+                                # Normalized coordinates of box
+                                xyp = np.sin(own_hdg) * sin_table + np.cos(own_hdg) * cos_table
+                                # Scale with vmax (and some factor) and put in tuple
+                                part = pyclipper.scale_to_clipper(tuple(map(tuple, 1.1 * vmax * xyp)))
+                                pc2.AddPath(part, pyclipper.PT_SUBJECT, True)
+                            elif priocode == "RS3":
+                                # Small ring
+                                xyp = (tuple(map(tuple, np.flipud(xyc * min(vmax, gs_ap[i] + 0.1)))),
+                                       tuple(map(tuple, xyc * max(vmin, gs_ap[i] - 0.1))))
+                                part = pyclipper.scale_to_clipper(xyp)
+                                pc2.AddPaths(part, pyclipper.PT_SUBJECT, True)
+                            elif priocode == "RS4":
+                                hdg_sel = hdg[i] * np.pi / 180
+                                xyp = np.array([[np.sin(hdg_sel - 0.0087), np.cos(hdg_sel - 0.0087)],
+                                                [0, 0],
+                                                [np.sin(hdg_sel + 0.0087), np.cos(hdg_sel + 0.0087)]],
+                                               dtype=np.float64)
+                                part = pyclipper.scale_to_clipper(tuple(map(tuple, 1.1 * vmax * xyp)))
+                                pc2.AddPath(part, pyclipper.PT_SUBJECT, True)
+                            # Execute clipper command
+                            ARV_calc = pyclipper.scale_from_clipper(
+                                pc2.Execute(pyclipper.CT_INTERSECTION, pyclipper.PFT_NONZERO, pyclipper.PFT_NONZERO))
+                            N += 1
+                            # If no smaller ARV is found, take the full ARV
+                            if len(ARV_calc) == 0:
+                                ARV_calc = ARV
+                            # Check multi exteriors, if this layer is not a list, it means it has no exteriors
+                            # In that case, make it a list, such that its format is consistent with further code
+                            if not type(ARV_calc[0][0]) == list:
+                                ARV_calc = [ARV_calc]
+                        # Shortest way out prio, so use full SSD (ARV_calc = ARV)
+                        else:
+                            ARV_calc = ARV
+                        # Update calculatable ARV for resolutions
+                        ARV_calc_loc[i] = ARV_calc
+
+        # If sequential approach, the local should go elsewhere
+        if not priocode == "RS7" and not priocode == "RS8":
+            conf.FRV = FRV_loc
+            conf.ARV = ARV_loc
+            conf.ARV_calc = ARV_calc_loc
+            conf.FRV_area = FRV_area_loc
+            conf.ARV_area = ARV_area_loc
+        else:
+            conf.ARV_calc2 = ARV_calc_loc
+        return
+
+    def calculate_resolution(self, conf, ownship):
+        """ Calculates closest conflict-free point according to ruleset """
+        # It's just linalg, however credits to: http://stackoverflow.com/a/1501725
+        # Variables
+        ARV = conf.ARV_calc
+        if self.priocode == "RS7" or self.priocode == "RS8":
+            ARV2 = conf.ARV_calc2
+        # Select AP-setting as reference point for closest to target rulesets
+        if self.priocode == "RS5" or self.priocode == "RS8":
+            gsnorth = np.cos(ownship.ap.trk / 180 * np.pi) * ownship.ap.tas
+            gseast = np.sin(ownship.ap.trk / 180 * np.pi) * ownship.ap.tas
+        else:
+            gsnorth = ownship.gsnorth
+            gseast = ownship.gseast
+        ntraf = ownship.ntraf
+
+        # Loop through SSDs of all aircraft
+        for i in range(ntraf):
+            # Only those that are in conflict need to resolve
+            if conf.inconf[i] and ARV[i] is not None and len(ARV[i]) > 0:
+                # First check if AP-setting is free
+                if conf.ap_free[i] and self.priocode == "RS5":
+                    conf.asase[i] = gseast[i]
+                    conf.asasn[i] = gsnorth[i]
+                else:
+                    # Loop through all exteriors and append. Afterwards concatenate
+                    p = []
+                    q = []
+                    for j in range(len(ARV[i])):
+                        p.append(np.array(ARV[i][j]))
+                        q.append(np.diff(np.vstack((p[j], p[j][0])), axis=0))
+                    p = np.concatenate(p)
+                    q = np.concatenate(q)
+                    # Calculate squared distance between edges
+                    l2 = np.sum(q ** 2, axis=1)
+                    # Catch l2 == 0 (exception)
+                    same = l2 < 1e-8
+                    l2[same] = 1.
+                    # Calc t
+                    t = np.sum((np.array([gseast[i], gsnorth[i]]) - p) * q, axis=1) / l2
+                    # t must be limited between 0 and 1
+                    t = np.clip(t, 0., 1.)
+                    t[same] = 0.
+                    # Calculate closest point to each edge
+                    x1 = p[:, 0] + t * q[:, 0]
+                    y1 = p[:, 1] + t * q[:, 1]
+                    # Get distance squared
+                    d2 = (x1 - gseast[i]) ** 2 + (y1 - gsnorth[i]) ** 2
+                    # Sort distance
+                    ind = np.argsort(d2)
+                    x1 = x1[ind]
+                    y1 = y1[ind]
+
+                    sequential = (self.priocode == "RS7" or self.priocode == "RS8") and \
+                        conf.inconf2[i] and ARV2[i]
+                    if sequential:
+                        # Loop through all exteriors and append. Afterwards concatenate
+                        p = []
+                        q = []
+                        for j in range(len(ARV2[i])):
+                            p.append(np.array(ARV2[i][j]))
+                            q.append(np.diff(np.vstack((p[j], p[j][0])), axis=0))
+                        p = np.concatenate(p)
+                        q = np.concatenate(q)
+                        # Calculate squared distance between edges
+                        l2 = np.sum(q ** 2, axis=1)
+                        # Catch l2 == 0 (exception)
+                        same = l2 < 1e-8
+                        l2[same] = 1.
+                        # Calc t
+                        t = np.sum((np.array([gseast[i], gsnorth[i]]) - p) * q, axis=1) / l2
+                        # t must be limited between 0 and 1
+                        t = np.clip(t, 0., 1.)
+                        t[same] = 0.
+                        # Calculate closest point to each edge
+                        x2 = p[:, 0] + t * q[:, 0]
+                        y2 = p[:, 1] + t * q[:, 1]
+                        # Get distance squared
+                        d2 = (x2 - gseast[i]) ** 2 + (y2 - gsnorth[i]) ** 2
+                        # Sort distance
+                        ind = np.argsort(d2)
+                        x2 = x2[ind]
+                        y2 = y2[ind]
+                        d2 = d2[ind]
+
+                    # Store result in conf
+                    if not sequential:
+                        conf.asase[i] = x1[0]
+                        conf.asasn[i] = y1[0]
+                    else:
+                        # Sequential method, check if both result in very similar resolutions
+                        if (x1[0] - x2[0]) * (x1[0] - x2[0]) + (x1[0] - x2[0]) * (x1[0] - x2[0]) < 1:
+                            # In that case take the full layer
+                            conf.asase[i] = x1[0]
+                            conf.asasn[i] = y1[0]
+                        else:
+                            # In that case take the partial layer solution and see which
+                            # results in lower TLOS
+                            conf.asase[i] = x1[0]
+                            conf.asasn[i] = y1[0]
+                            # dv2 for the RS1-solution
+                            dist12 = (x1[0] - gseast[i]) ** 2 + (y1[0] - gsnorth[i]) ** 2
+                            # distances for the partial layer solution stored in d2
+                            ind = d2 < dist12
+                            if sum(ind) == 1:
+                                conf.asase[i] = x2[0]
+                                conf.asasn[i] = y2[0]
+                            elif sum(ind) > 1:
+                                x2 = x2[ind]
+                                y2 = y2[ind]
+                                # Get solution with minimum TLOS
+                                i_other = conf.inrange[i]
+                                idx = self.minTLOS(conf, ownship, i, i_other, x1, y1, x2, y2)
+                                # Get solution with maximum TLOS
+                                conf.asase[i] = x2[idx]
+                                conf.asasn[i] = y2[idx]
+
+            # Those that are not in conflict will be assigned zeros
+            # Or those that have no solutions (full ARV)
+            else:
+                conf.asase[i] = 0.
+                conf.asasn[i] = 0.
+
+    def qdrdist_matrix_indices(self, ntraf):
+        """ This function gives the indices that can be used in the lon/lat-vectors """
+        # The indices will be n*(n-1)/2 long
+        # Only works for n >= 2, which is logical...
+        tmp_range = np.arange(ntraf - 1, dtype=np.int32)
+        ind1 = np.repeat(tmp_range, (tmp_range + 1)[::-1])
+        ind2 = np.ones(ind1.shape[0], dtype=np.int32)
+        inds = np.cumsum(tmp_range[1:][::-1] + 1)
+        np.put(ind2, inds, np.arange(ntraf * -1 + 3, 1))
+        ind2 = np.cumsum(ind2, out=ind2)
+        return ind1, ind2
+
+
+def make_ssd(cls, priocode, nworkers=0, tolerance=0.0):
+    ssd = object.__new__(cls)
+    ssd.priocode = priocode
+    ssd.resofach = 1.05
+    ssd.nworkers = nworkers
+    ssd.tolerance = tolerance
+    ssd.cache = dict()
+    ssd.pool = None
+    ssd.poolsize = 0
+    return ssd
+
+
+def make_ssd_traffic(rng, n, spread):
+    """
+    Random traffic with the autopilot and performance limits SSD uses,
+    with some pairs in loss of separation.
+    """
+    traf = make_traffic(rng, n, 52., 4., spread)
+    traf.lat[3::10] = traf.lat[2::10][:len(traf.lat[3::10])] + 0.03
+    traf.lon[3::10] = traf.lon[2::10][:len(traf.lon[3::10])]
+    traf.uid = np.arange(100, 100 + n)
+    traf.hdg = traf.trk
+    traf.selalt = traf.alt
+    traf.ap = SimpleNamespace(trk=traf.trk + rng.uniform(-30, 30, n),
+                              tas=traf.gs + rng.uniform(-20, 20, n))
+    traf.perf = SimpleNamespace(vmin=rng.uniform(50, 80, n), vmax=rng.uniform(200, 260, n))
+    # No SSD can be constructed before the first performance update
+    traf.perf.vmin[-1] = traf.perf.vmax[-1] = 0.
+    return traf
+
+
+def make_conf(rng, n):
+    rpz = np.full(n, 5 * nm)
+    rpz[::3] = 3 * nm
+    inconf = rng.random(n) < 0.6
+    inconf[:2] = True
+    return SimpleNamespace(rpz=rpz, inconf=inconf)
+
+
+def assert_same_resolution(ssd, ref, traf, conf):
+    """ Resolve with ssd and ref on copies of conf, the resolutions
+    and SSDs should be exactly the same """
+    result = SimpleNamespace(**vars(conf))
+    expected = SimpleNamespace(**vars(conf))
+    for res, exp in zip(ssd.resolve(result, traf, traf), ref.resolve(expected, traf, traf)):
+        np.testing.assert_array_equal(res, exp)
+    for name in ('FRV', 'ARV', 'ARV_calc', 'ARV_calc2'):
+        assert getattr(result, name) == getattr(expected, name)
+    for name in ('inrange', 'inrange2'):
+        assert [None if x is None else list(x) for x in getattr(result, name)] == \
+            [None if x is None else list(x) for x in getattr(expected, name)]
+    for name in ('FRV_area', 'ARV_area', 'inconf2', 'ap_free', 'asase', 'asasn'):
+        np.testing.assert_array_equal(getattr(result, name), getattr(expected, name))
+    return result
+
+
+@pytest.mark.parametrize('n, spread', [(2, 0.05), (20, 0.3), (80, 0.5)])
+@pytest.mark.parametrize('priocode', [f'RS{i}' for i in range(1, 10)])
+def test_ssd_matches_reference(priocode, n, spread):
+    """
+    The batched construction should give exactly the same SSDs and
+    resolutions as the per-aircraft construction.
+    """
+    rng = np.random.default_rng(n)
+    traf = make_ssd_traffic(rng, n, spread)
+    conf = make_conf(rng, n)
+    assert_same_resolution(make_ssd(SSD, priocode), make_ssd(ReferenceSSD, priocode), traf, conf)
+
+
+@pytest.mark.parametrize('priocode', ['RS1', 'RS6', 'RS7'])
+def test_ssd_pool_matches_reference(priocode):
+    """
+    Constructing the SSDs in worker processes should not change them.
+    """
+    rng = np.random.default_rng(3)
+    traf = make_ssd_traffic(rng, 80, 0.5)
+    conf = make_conf(rng, 80)
+    ssd = make_ssd(SSD, priocode, nworkers=2)
+    try:
+        assert_same_resolution(ssd, make_ssd(ReferenceSSD, priocode), traf, conf)
+        assert ssd.pool is not None
+    finally:
+        ssd.closepool()
+    assert ssd.pool is None
+
+
+def test_ssd_cache():
+    """
+    Cached SSDs are reused as long as the geometry changes less than the
+    tolerance, and are constructed again as the reference otherwise.
+    """
+    rng = np.random.default_rng(4)
+    traf = make_ssd_traffic(rng, 40, 0.4)
+    conf = make_conf(rng, 40)
+    ssd = make_ssd(SSD, 'RS2', tolerance=0.5)
+    ref = make_ssd(ReferenceSSD, 'RS2')
+    first = assert_same_resolution(ssd, ref, traf, conf)
+    built = [k for k, arv in enumerate(first.ARV) if arv is not None]
+    assert len(built) > 10
+
+    # All SSDs come from the cache, also after a change below the tolerance
+    for delta in (0.0, 0.2):
+        traf.gseast += delta
+        result = SimpleNamespace(**vars(conf))
+        ssd.resolve(result, traf, traf)
+        assert all(result.ARV[k] is first.ARV[k] for k in built)
+
+    # Above the tolerance every SSD is constructed again
+    traf.gseast += 1.0
+    result = assert_same_resolution(ssd, ref, traf, conf)
+    assert not any(result.ARV[k] is first.ARV[k] for k in built)
@@ -0,0 +1,45 @@
+"""
+Tests the in-place StateBased detection with reused scratch matrices
+"""
+from types import SimpleNamespace
+
+import numpy as np
+
+from bluesky.tools import geo
+from bluesky.tools.aero import nm, ft
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.test.traffic.test_gridstatebased import make_traffic
+
+
+def test_kwikqdrdist_outer_matches_matrix():
+    """
+    The 1-D array geo kernel should give the same results as the matrix version.
+    """
+    rng = np.random.default_rng(0)
+    lata, lona = rng.uniform(-60, 60, 50), rng.uniform(-180, 180, 50)
+    latb, lonb = rng.uniform(-60, 60, 30), rng.uniform(-180, 180, 30)
+    expected = geo.kwikqdrdist_matrix(np.asmatrix(lata), np.asmatrix(lona),
+                                      np.asmatrix(latb), np.asmatrix(lonb))
+    qdr, dist = np.empty((50, 30)), np.empty((50, 30))
+    result = geo.kwikqdrdist_outer(lata, lona, latb, lonb, qdr=qdr, dist=dist, ws=geo.Workspace())
+    assert result[0] is qdr and result[1] is dist
+    for res, exp in zip(result, expected):
+        assert np.array_equal(res, np.asarray(exp))
+
+
+def test_statebased_workspace_reuse():
+    """
+    Detection with a workspace that is reused for changing numbers of
+    aircraft should give the same results as detection without workspace.
+    """
+    rng = np.random.default_rng(1)
+    cd = SimpleNamespace(workspace=geo.Workspace())
+    for n in (300, 100, 400, 1):
+        ownship = make_traffic(rng, n, 52., 4., 0.5)
+        rpz = np.full(n, 5 * nm)
+        hpz = np.full(n, 1000 * ft)
+        dtlookahead = np.full(n, 300.)
+        expected = StateBased.detect(None, ownship, ownship, rpz, hpz, dtlookahead)
+        result = StateBased.detect(cd, ownship, ownship, rpz, hpz, dtlookahead)
+        for res, exp in zip(result, expected):
+            assert np.array_equal(np.asarray(res), np.asarray(exp))
@@ -0,0 +1,45 @@
+"""
+Tests the tiled, multi-threaded conflict detection against StateBased
+"""
+import numpy as np
+import pytest
+
+from bluesky.tools.aero import nm, ft
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.traffic.asas.tiledstatebased import TiledStateBased
+from bluesky.test.traffic.test_gridstatebased import make_traffic
+
+
+def make_detector(blocksize, nthreads, broadphase):
+    cd = object.__new__(TiledStateBased)
+    cd.blocksize = blocksize
+    cd.nthreads = nthreads
+    cd.swbroadphase = broadphase
+    cd.pool = None
+    cd.poolsize = 0
+    return cd
+
+
+@pytest.mark.parametrize('n, lat0, spread', [(1, 52., 1.), (300, 52., 0.5), (200, 88., 1.)])
+@pytest.mark.parametrize('blocksize, nthreads', [(50, 1), (1000, 4), (10**6, 0)])
+@pytest.mark.parametrize('broadphase', [True, False])
+def test_tiledstatebased_matches_statebased(n, lat0, spread, blocksize, nthreads, broadphase):
+    """
+    TiledStateBased should return exactly the same conflicts, LoS pairs
+    and conflict data as StateBased, for any block size and thread count.
+    """
+    rng = np.random.default_rng(n)
+    ownship = make_traffic(rng, n, lat0, 4., spread)
+    rpz = np.full(n, 5 * nm)
+    rpz[:n // 3] = 3 * nm
+    hpz = np.full(n, 1000 * ft)
+    dtlookahead = np.full(n, 300.)
+    dtlookahead[::5] = 120.
+
+    expected = object.__new__(StateBased).detect(ownship, ownship, rpz, hpz, dtlookahead)
+    cd = make_detector(blocksize, nthreads, broadphase)
+    result = cd.detect(ownship, ownship, rpz, hpz, dtlookahead)
+    cd.pool.shutdown()
+
+    for res, exp in zip(result, expected):
+        assert np.array_equal(np.asarray(res), np.asarray(exp))
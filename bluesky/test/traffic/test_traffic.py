@@ -147,3 +147,104 @@ def test_traffic_reset(traffic_):
 
 
 # test remaining traffic functions
+
+
+def test_traffic_id2idx(traffic_):
+    """
+    Test the callsign lookup after creation, deletion and renaming,
+    for single callsigns, lists, and numpy arrays of callsigns.
+    """
+    import numpy as np
+
+    acids = ['IDX001', 'IDX002', 'IDX003', 'IDX004']
+    traffic_.cre(acids, 'B744', np.full(4, 52.), np.full(4, 4.), 0., 1000., 100.)
+    idx = [traffic_.id2idx(acid) for acid in acids]
+    assert [traffic_.id[i] for i in idx] == acids
+    assert traffic_.id2idx('idx002') == idx[1]
+    assert traffic_.id2idx('#') == traffic_.ntraf - 1
+    assert traffic_.id2idx('IDX999') == -1
+    assert traffic_.id2idx(acids + ['IDX999']) == idx + [-1]
+    assert list(traffic_.id2idx(np.array(acids + ['IDX999']))) == idx + [-1]
+
+    traffic_.delete([idx[0], idx[2]])
+    assert traffic_.id2idx('IDX001') == traffic_.id2idx('IDX003') == -1
+    assert traffic_.id[traffic_.id2idx('IDX004')] == 'IDX004'
+
+    assert traffic_.rename(traffic_.id2idx('IDX002'), 'IDX005') is True
+    assert not traffic_.rename(traffic_.id2idx('IDX005'), 'IDX004')[0]
+    assert traffic_.id2idx('IDX002') == -1
+    assert traffic_.id[traffic_.id2idx('IDX005')] == 'IDX005'
+    assert list(traffic_.id2idx(np.array(['IDX004', 'IDX005']))) == \
+        [traffic_.id2idx('IDX004'), traffic_.id2idx('IDX005')]
+    traffic_.delete([traffic_.id2idx('IDX004'), traffic_.id2idx('IDX005')])
+
+
+def test_traffic_crebatch(traffic_):
+    """
+    Test creation of a batch of aircraft of different types with one call,
+    and the batch of CRE commands that is created by flushcre.
+    """
+    import numpy as np
+
+    ntraf = traffic_.ntraf
+    acids = ['BAT001', 'BAT002', 'BAT003']
+    traffic_.cre(acids, ['A320', 'B744', 'A320'], [52., 53., 54.], 4., [0., 90., 180.],
+                 1000., np.array([100., 120., 140.]))
+    assert traffic_.ntraf == ntraf + 3 and traffic_.id[-3:] == acids
+    assert list(traffic_.lat[-3:]) == [52., 53., 54.] and list(traffic_.alt[-3:]) == [1000.] * 3
+    # Performance parameters follow the type of each aircraft
+    mass = traffic_.perf.mass[-3:]
+    assert mass[0] == mass[2] != mass[1]
+
+    assert traffic_.addcre('BAT004', 'A320', 52., 4., 0., 1000., 100.) is True
+    assert not traffic_.addcre('BAT004', 'A320', 52., 4., 0., 1000., 100.)[0]
+    assert not traffic_.addcre('BAT001', 'A320', 52., 4., 0., 1000., 100.)[0]
+    assert traffic_.addcre('BAT005', 'B744', 53., 5., 90., 2000., 120.) is True
+    assert traffic_.ntraf == ntraf + 3
+    traffic_.flushcre()
+    assert traffic_.ntraf == ntraf + 5 and traffic_.id[-2:] == ['BAT004', 'BAT005']
+    assert traffic_.perf.mass[-2] == mass[0] and traffic_.perf.mass[-1] == mass[1]
+    traffic_.delete(np.arange(ntraf, ntraf + 5))
+    assert traffic_.ntraf == ntraf
+
+
+def test_traffic_deferdelete(traffic_):
+    """
+    Test deletion of a batch of aircraft with flushdelete, and the index
+    map that is emitted to the subscribers of aircraft_deleted.
+    """
+    import numpy as np
+    import pytest
+    from bluesky.traffic.traffic import aircraft_deleted
+
+    ntraf = traffic_.ntraf
+    acids = ['DEF{:03d}'.format(i) for i in range(12)]
+    traffic_.cre(acids, 'B744', 52., 4., 0., 1000., 100.)
+    emitted = []
+
+    def remap(idx, newidx):
+        emitted.append((idx, newidx))
+
+    aircraft_deleted.connect(remap)
+    # Indices remain valid until the batch is deleted, also for duplicates
+    traffic_.deferdelete(ntraf + np.arange(0, 12, 2))
+    traffic_.deferdelete([ntraf + 1, ntraf + 3, ntraf + 5, ntraf + 2])
+    assert traffic_.ntraf == ntraf + 12
+    traffic_.flushdelete()
+    aircraft_deleted.disconnect(remap)
+
+    assert traffic_.ntraf == ntraf + 3 and len(traffic_.lat) == len(traffic_.id) == ntraf + 3
+    assert traffic_.id[-3:] == ['DEF007', 'DEF009', 'DEF011']
+    assert traffic_.id2idx('DEF004') == -1 and traffic_.id2idx('DEF009') == ntraf + 1
+    assert len(emitted) == 1
+    idx, newidx = emitted[0]
+    assert list(idx) == list(ntraf + np.array([0, 1, 2, 3, 4, 5, 6, 8, 10]))
+    assert list(newidx[:ntraf]) == list(range(ntraf))
+    assert list(newidx[ntraf + 7::2]) == [ntraf, ntraf + 1, ntraf + 2]
+    assert np.all(newidx[idx] == -1)
+    # -1 is the index of aircraft that do not exist, not of the last aircraft
+    with pytest.raises(IndexError):
+        traffic_.delete([ntraf, -1])
+    assert traffic_.ntraf == ntraf + 3
+    traffic_.delete(np.arange(ntraf, ntraf + 3))
+    assert traffic_.ntraf == ntraf
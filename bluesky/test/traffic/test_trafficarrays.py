@@ -11,6 +11,8 @@ Tests TrafficArrays
 import pytest
 import numpy as np
 from bluesky.core import TrafficArrays
+from bluesky.core.entity import Proxy
+from bluesky.core.stateblock import REFCOUNTS
 
 
 @pytest.fixture(scope="module")
@@ -142,3 +144,174 @@ def test_trafficarrays_reset(t_a):
 
     assert not root.fl_list
     assert not root.children[0].np_array_bool
+
+
+@pytest.mark.parametrize('refcounts', [True, False])
+@pytest.mark.parametrize('stateblock', [False, True])
+def test_trafficarrays_buffers(monkeypatch, stateblock, refcounts):
+    """
+    Tests that traffic arrays on capacity buffers, or in a state block,
+    behave as separately allocated arrays, when creating and deleting
+    aircraft, when arrays are replaced, and when arrays are stored elsewhere.
+    Without reliable reference counts, the buffers are always reallocated.
+    """
+    if refcounts and not REFCOUNTS:
+        pytest.skip('reference counts are not as expected in this interpreter')
+    monkeypatch.setattr('bluesky.core.trafficarrays.REFCOUNTS', refcounts)
+    monkeypatch.setattr('bluesky.core.stateblock.REFCOUNTS', refcounts)
+
+    class BufferRoot(TrafficArrays):
+        """
+        Root with arrays of different types and shapes, and one child.
+        """
+
+        def __init__(self):
+            super().__init__()
+            TrafficArrays.setroot(self, stateblock)
+            with self.settrafarrays():
+                self.fl_array = np.array([])
+                self.int_array = np.array([], dtype=int)
+                self.bool_array = np.array([], dtype=bool)
+                self.matrix = np.zeros((0, 2, 3))
+                self.child = TrafficArrays()
+            with self.child.settrafarrays():
+                self.child.fl_array = np.array([])
+            self.ntraf = 0
+
+    monkeypatch.setattr(TrafficArrays, 'root', None)
+    root = BufferRoot()
+    names = ('fl_array', 'int_array', 'bool_array', 'matrix')
+    expected = {name: getattr(root, name).copy() for name in names}
+    expchild = np.array([])
+    rng = np.random.default_rng(1)
+    stored = []
+    for _ in range(500):
+        action = rng.integers(5)
+        if action < 2:
+            n = int(rng.integers(1, 40))
+            root.create(n)
+            root.create_children(n)
+            root.ntraf += n
+            for name in names:
+                arr = getattr(root, name)
+                assert np.all(arr[-n:] == 0)
+                arr[-n:] = rng.integers(100, size=arr[-n:].shape)
+                expected[name] = np.concatenate((expected[name], arr[-n:]))
+            root.child.fl_array[-n:] = rng.random(n)
+            expchild = np.append(expchild, root.child.fl_array[-n:])
+        elif action == 2 and root.ntraf:
+            idx = rng.choice(root.ntraf, int(rng.integers(1, min(root.ntraf, 20) + 1)), replace=False)
+            root.delete(idx if len(idx) > 1 else int(idx[0]))
+            root.ntraf -= len(idx)
+            for name in names:
+                expected[name] = np.delete(expected[name], idx, axis=0)
+            expchild = np.delete(expchild, idx)
+        elif action == 3:
+            # Replace an array by assignment, as in the traffic update
+            root.fl_array = root.fl_array + 1.0
+            expected['fl_array'] = expected['fl_array'] + 1.0
+        else:
+            # Arrays stored elsewhere should keep their values
+            stored.append((root.int_array, root.int_array.copy()))
+        for name in names:
+            assert np.array_equal(getattr(root, name), expected[name])
+        assert np.array_equal(root.child.fl_array, expchild)
+        for arr, copy in stored:
+            assert np.array_equal(arr, copy)
+
+    if stateblock:
+        assert set(root._BlkVars) == set(names) and not root._ArrVars
+        state = root._block.snapshot()
+        assert set(state) == set(names) | {'child.fl_array'}
+        root.fl_array[:] = -1.0
+        root.child.fl_array = root.child.fl_array * 0.0
+        root._block.restore(state)
+        assert np.array_equal(root.fl_array, expected['fl_array'])
+        assert np.array_equal(root.child.fl_array, expchild)
+
+    # Creating aircraft one by one only reallocates when the capacity is full
+    del stored, arr
+    if not refcounts:
+        return
+    buffers = []
+    for _ in range(1000):
+        root.create(1)
+        # Only the id, a reference would make the buffer look shared
+        if not buffers or id(root.fl_array.base) != buffers[-1]:
+            buffers.append(id(root.fl_array.base))
+    assert len(buffers) <= 8
+
+
+def test_trafficarrays_replaced_stateblock(monkeypatch):
+    """
+    Tests that only the implementation selected in a proxy keeps its arrays
+    in the state block, and that the arrays of the others keep their values.
+    """
+
+    class Impl(TrafficArrays):
+        """
+        Implementation of a replaceable child with one array.
+        """
+
+        def __init__(self):
+            super().__init__()
+            with self.settrafarrays():
+                self.fl_array = np.array([])
+
+    monkeypatch.setattr(TrafficArrays, 'root', None)
+    root = TrafficArrays()
+    TrafficArrays.setroot(root, True)
+    impls = [Impl(), Impl()]
+    proxy = Proxy()
+    proxy._replace(impls[0])
+
+    root.create(3)
+    root.create_children(3)
+    impls[0].fl_array[:] = [1., 2., 3.]
+    impls[1].fl_array[:] = [4., 5., 6.]
+    proxy._replace(impls[1])
+    assert [obj for obj, _ in root._block.columns] == [impls[1]]
+    assert impls[0]._ArrVars == ['fl_array'] and not impls[0]._BlkVars
+
+    root.delete(1)
+    root.create(2)
+    root.create_children(2)
+    proxy._replace(impls[0])
+    assert [obj for obj, _ in root._block.columns] == [impls[0]]
+    assert impls[0]._BlkVars == ['fl_array'] and not impls[0]._ArrVars
+    assert np.array_equal(impls[0].fl_array, [1., 3., 0., 0.])
+    assert np.array_equal(impls[1].fl_array, [4., 6., 0., 0.])
+
+
+@pytest.mark.skipif(not REFCOUNTS, reason='reference counts are not as expected in this interpreter')
+@pytest.mark.parametrize('stateblock', [False, True])
+def test_trafficarrays_unshared(monkeypatch, stateblock):
+    """
+    Pins the reference counts on which in-place modification of the traffic
+    array buffers relies: a buffer is unshared when only the traffic arrays
+    refer to it, and shared as long as any other array refers to it.
+    Without reliable reference counts, buffers are never unshared.
+    """
+    monkeypatch.setattr(TrafficArrays, 'root', None)
+    root = TrafficArrays()
+    TrafficArrays.setroot(root, stateblock)
+    with root.settrafarrays():
+        root.fl_array = np.array([])
+    root.create(4)
+
+    def isunshared():
+        return root._block.isunshared() if stateblock else root._isunshared('fl_array')
+
+    assert isunshared()
+    # Another reference to the array, to a view on it, or to its buffer
+    for getref in (lambda arr: arr, lambda arr: arr[1:], lambda arr: arr.base):
+        ref = getref(root.fl_array)
+        assert not isunshared()
+        del ref
+        assert isunshared()
+    # A replaced attribute no longer refers to the buffer
+    root.fl_array = root.fl_array + 1.0
+    assert isunshared()
+    monkeypatch.setattr('bluesky.core.trafficarrays.REFCOUNTS', False)
+    monkeypatch.setattr('bluesky.core.stateblock.REFCOUNTS', False)
+    assert not isunshared()
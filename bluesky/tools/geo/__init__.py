@@ -1,6 +1,9 @@
 ''' BlueSky functions for geographical calculations. '''
 from bluesky import settings
 from bluesky.tools.geo._geo import nm, magdec, initdecl_data, magdeccmd, kwikpos
+# Matrix functions on 1-D arrays with output and scratch buffers
+from bluesky.tools.geo._geo import (Workspace, qdrdist_outer, latlondist_outer,
+                                    kwikdist_outer, kwikqdrdist_outer)
 
 
 # Register settings defaults
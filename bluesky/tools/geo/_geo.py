@@ -147,8 +147,8 @@ def qdrdist_matrix(lat1, lon1, lat2, lon2):
     coslat1 = np.cos(np.radians(lat1))
     coslat2 = np.cos(np.radians(lat2))
 
-    sin21 = np.mat(np.sin(sin2))
-    cos21 = np.mat(np.cos(sin2))
+    sin21 = np.asmatrix(np.sin(sin2))
+    cos21 = np.asmatrix(np.cos(sin2))
     y = np.multiply(sin21, coslat2)
 
     x1 = np.multiply(coslat1.T, sinlat2)
@@ -159,8 +159,8 @@ def qdrdist_matrix(lat1, lon1, lat2, lon2):
 
     qdr = np.degrees(np.arctan2(y, x))
 
-    sin10 = np.mat(np.abs(np.sin(sin1/2.)))
-    sin20 = np.mat(np.abs(np.sin(sin2/2.)))
+    sin10 = np.asmatrix(np.abs(np.sin(sin1/2.)))
+    sin20 = np.asmatrix(np.abs(np.sin(sin2/2.)))
     sin1sin1 = np.multiply(sin10, sin10)
     sin2sin2 = np.multiply(sin20, sin20)
     sqrt = sin1sin1 + np.multiply((coslat1.T * coslat2), sin2sin2)
@@ -244,8 +244,8 @@ def latlondist_matrix(lat1, lon1, lat2, lon2):
     coslat1 = np.cos(np.radians(lat1))
     coslat2 = np.cos(np.radians(lat2))
 
-    sin10 = np.mat(np.sin(sin1/2))
-    sin20 = np.mat(np.sin(sin2/2))
+    sin10 = np.asmatrix(np.sin(sin1/2))
+    sin20 = np.asmatrix(np.sin(sin2/2))
     sin1sin1 =  np.multiply(sin10, sin10)
     sin2sin2 =  np.multiply(sin20, sin20)
     root =  sin1sin1+np.multiply((coslat1.T*coslat2), sin2sin2)
@@ -371,6 +371,214 @@ def kwikqdrdist_matrix(lata, lona, latb, lonb):
 
     return qdr, dist
 
+class Workspace:
+    """ Scratch arrays for the *_outer matrix functions, kept between calls.
+        Arrays are views on flat buffers that only grow, so a change in the
+        number of aircraft does not cause a new allocation every time. """
+    def __init__(self):
+        self.buffers = dict()
+
+    def get(self, name, shape, dtype=np.float64):
+        """ Return uninitialised scratch array name of given shape and dtype. """
+        size = int(np.prod(shape))
+        buf = self.buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size:
+            capacity = size if buf is None else max(size, int(1.5 * buf.size))
+            buf = self.buffers[name] = np.empty(capacity, dtype)
+        return buf[:size].reshape(shape)
+
+    def clear(self):
+        """ Release all scratch arrays. """
+        self.buffers.clear()
+
+
+def _scratch(ws, name, shape, dtype):
+    """ Scratch array from workspace ws, or a new array if ws is None. """
+    return np.empty(shape, dtype) if ws is None else ws.get(name, shape, dtype)
+
+
+def _out(out, shape, dtype):
+    """ Check caller-provided output array, or allocate a new one. """
+    if out is None:
+        return np.empty(shape, dtype)
+    if out.shape != shape or out.dtype != dtype:
+        raise ValueError(f'Output array should have shape {shape} and dtype {np.dtype(dtype)}')
+    return out
+
+
+def _rwgs84_outer(lata, latb, r, c, s, t):
+    """ Earth radius rwgs84_matrix(lata.T + latb) written into r,
+        using scratch arrays c, s and t. """
+    a      = 6378137.0       # [m] Major semi-axis WGS-84
+    b      = 6356752.314245  # [m] Minor semi-axis WGS-84
+    np.add(lata[:, np.newaxis], latb, out=r)
+    np.radians(r, out=r)
+    np.cos(r, out=c)
+    np.sin(r, out=s)
+    np.multiply(c, a * a, out=r)    # an * an
+    np.multiply(r, r, out=r)
+    np.multiply(s, b * b, out=t)    # bn * bn
+    np.multiply(t, t, out=t)
+    r += t
+    np.multiply(c, a, out=c)        # ad * ad
+    np.multiply(c, c, out=c)
+    np.multiply(s, b, out=s)        # bd * bd
+    np.multiply(s, s, out=s)
+    c += s
+    r /= c
+    np.sqrt(r, out=r)
+    return r
+
+
+def qdrdist_outer(lat1, lon1, lat2, lon2, qdr=None, dist=None,
+                  dtype=np.float64, ws=None, swqdr=True):
+    """ Calculate bearing and distance matrices of all combinations of
+        positions 1 and 2, using WGS'84. Same as qdrdist_matrix, but
+        without matrix inputs and temporaries: the results are written into
+        qdr and dist when given, and scratch arrays are taken from workspace
+        ws when given. With dtype=np.float32 the calculation is done in
+        single precision.
+        In:
+            lat1,lon1 en lat2, lon2 [deg] :positions 1 & 2 (1-D arrays)
+        Out:
+            qdr [deg] = heading from 1 to 2 (matrix)
+            d [nm]    = distance from 1 to 2 in nm (matrix) """
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=dtype) for v in (lat1, lon1, lat2, lon2))
+    shape = (lat1.size, lat2.size)
+    dist = _out(dist, shape, dtype)
+    qdr = _out(qdr, shape, dtype) if swqdr else None
+    r = _scratch(ws, 'r', shape, dtype)
+    dlat = _scratch(ws, 'dlat', shape, dtype)
+    dlon = _scratch(ws, 'dlon', shape, dtype)
+    c = _scratch(ws, 'cavelat', shape, dtype)
+    t = _scratch(ws, 'tmp', shape, dtype)
+    _rwgs84_outer(lat1, lat2, r, c, dlat, t)
+
+    # Different hemisphere: weighted average of the radii
+    a = 6378137.0
+    diffhemi = _scratch(ws, 'mask', shape, bool)
+    np.less(np.multiply(lat1[:, np.newaxis], lat2, out=t), 0, out=diffhemi)
+    if np.any(diffhemi):
+        i, j = np.nonzero(diffhemi)
+        u = np.abs(lat1) * (rwgs84(lat1) + a)
+        v = np.abs(lat2) * (rwgs84(lat2) + a)
+        r[i, j] = 0.5 * (u[i] + v[j]) / (np.abs(lat1)[i] + np.abs(lat2)[j])
+
+    np.subtract(lat2, lat1[:, np.newaxis], out=dlat)
+    np.radians(dlat, out=dlat)
+    np.subtract(lon2, lon1[:, np.newaxis], out=dlon)
+    np.radians(dlon, out=dlon)
+
+    sinlat1 = np.sin(np.radians(lat1))
+    sinlat2 = np.sin(np.radians(lat2))
+    coslat1 = np.cos(np.radians(lat1))
+    coslat2 = np.cos(np.radians(lat2))
+
+    if swqdr:
+        np.sin(dlon, out=qdr)                                 # y
+        qdr *= coslat2
+        np.multiply(coslat1[:, np.newaxis], sinlat2, out=t)   # x
+        np.multiply(sinlat1[:, np.newaxis], coslat2, out=c)
+        c *= np.cos(dlon, out=dist)
+        t -= c
+        np.arctan2(qdr, t, out=qdr)
+        np.degrees(qdr, out=qdr)
+
+    dlat /= 2.
+    np.sin(dlat, out=dlat)
+    np.multiply(dlat, dlat, out=dlat)
+    dlon /= 2.
+    np.sin(dlon, out=dlon)
+    np.multiply(dlon, dlon, out=dlon)
+    np.multiply(coslat1[:, np.newaxis], coslat2, out=t)
+    t *= dlon
+    dlat += t                                                 # root
+    np.subtract(1, dlat, out=t)
+    np.sqrt(t, out=t)
+    np.sqrt(dlat, out=dlat)
+    np.arctan2(dlat, t, out=dist)
+    dist *= 2.
+    r /= nm
+    np.multiply(r, dist, out=dist)
+
+    return qdr, dist
+
+
+def latlondist_outer(lat1, lon1, lat2, lon2, out=None, dtype=np.float64, ws=None):
+    """ Calculates the distance matrix of all combinations of positions
+        1 and 2 using haversine formulae and average r from wgs'84. Same as
+        latlondist_matrix, with the output written into out when given.
+        Input:
+              two lat/lon position 1-D arrays in degrees
+        Out:
+              distance matrix in nm """
+    return qdrdist_outer(lat1, lon1, lat2, lon2, dist=out, dtype=dtype, ws=ws, swqdr=False)[1]
+
+
+def kwikdist_outer(lata, lona, latb, lonb, out=None, dtype=np.float64, ws=None):
+    """
+    Quick and dirty dist [nm] of all combinations of positions a and b
+    In:
+        lat/lon, lat/lon 1-D arrays [deg]
+        out: optional (len(lata), len(latb)) output array for dist
+        dtype: float type of the calculation (np.float32 for fast screening)
+        ws: optional Workspace to keep the scratch arrays in
+    Out:
+        dist [nm] matrix, dist[i, j] is the distance from a[i] to b[j]
+    """
+    return kwikqdrdist_outer(lata, lona, latb, lonb, dist=out, dtype=dtype, ws=ws, swqdr=False)[1]
+
+
+def kwikqdrdist_outer(lata, lona, latb, lonb, qdr=None, dist=None,
+                      dtype=np.float64, ws=None, swqdr=True):
+    """Gives quick and dirty qdr[deg] and dist [nm] matrices of all
+       combinations of positions a and b, from 1-D lat/lon arrays.
+       Same as kwikqdrdist_matrix, but without matrix inputs and temporaries:
+       the results are written into qdr and dist when given, and scratch
+       arrays are taken from workspace ws when given. With dtype=np.float32
+       the calculation is done in single precision.
+       (note: does not work well close to poles)"""
+    lata, lona, latb, lonb = (np.asarray(v, dtype=dtype) for v in (lata, lona, latb, lonb))
+    shape = (lata.size, latb.size)
+    dist = _out(dist, shape, dtype)
+    qdr = _out(qdr, shape, dtype) if swqdr else None
+    dlat = _scratch(ws, 'dlat', shape, dtype)
+    dlon = _scratch(ws, 'dlon', shape, dtype)
+    cavelat = _scratch(ws, 'cavelat', shape, dtype)
+    tmp = _scratch(ws, 'tmp', shape, dtype)
+
+    re      = 6371000.  # radius earth [m]
+    np.subtract(latb, lata[:, np.newaxis], out=dlat)
+    np.radians(dlat, out=dlat)
+    np.subtract(lonb, lona[:, np.newaxis], out=dlon)
+    dlon += 180
+    np.remainder(dlon, 360, out=dlon)
+    dlon -= 180
+    np.radians(dlon, out=dlon)
+    np.add(latb, lata[:, np.newaxis], out=cavelat)
+    np.radians(cavelat, out=cavelat)
+    cavelat *= 0.5
+    np.cos(cavelat, out=cavelat)
+
+    # dangle = sqrt(dlat^2 + dlon^2 * cavelat^2)
+    np.multiply(dlon, dlon, out=dist)
+    np.multiply(cavelat, cavelat, out=tmp)
+    dist *= tmp
+    np.multiply(dlat, dlat, out=tmp)
+    np.add(tmp, dist, out=dist)
+    np.sqrt(dist, out=dist)
+    dist *= re
+    dist /= nm
+
+    if swqdr:
+        np.multiply(dlon, cavelat, out=dlon)
+        np.arctan2(dlon, dlat, out=qdr)
+        np.degrees(qdr, out=qdr)
+        np.remainder(qdr, 360., out=qdr)
+
+    return qdr, dist
+
+
 def kwikpos(latd1, lond1, qdr, dist):
     """ Fast, but quick and dirty, position calculation from vectors of reference position,
         bearing and distance using flat earth approximation
@@ -1,15 +1,39 @@
 """ ADS-B model. Implements real-life limitations of ADS-B communication."""
 import numpy as np
 import bluesky as bs
+from bluesky import stack
 from bluesky.tools.aero import ft
 from bluesky.core import Entity
 
 
+bs.settings.set_variable_defaults(adsb_histlen=64, adsb_interval=0.0,
+                                  adsb_latency=0.0, adsb_dropout=0.0)
+
+# Broadcast state variables, in the order in which they are stored in the history
+FIELDS = ('lat', 'lon', 'alt', 'trk', 'tas', 'gs', 'gsnorth', 'gseast', 'vs')
+
+
 class ADSB(Entity, replaceable=True):
-    """ ADS-B model. Implements real-life limitations of ADS-B communication."""
+    """ ADS-B model. Implements real-life limitations of ADS-B communication.
+
+        The true traffic state is recorded every update in a ring buffer
+        of the last histlen states of each aircraft. Aircraft broadcast
+        their state every interval seconds (0 = every update), and each
+        broadcast is received latency seconds later, unless it is dropped
+        with the dropout probability. The received states are looked up in
+        the history for all aircraft at once, so an update is O(ntraf). """
 
     def __init__(self):
         super().__init__()
+        # Defaults for new aircraft
+        self.interval_def = bs.settings.adsb_interval
+        self.latency_def = bs.settings.adsb_latency
+        self.dropout_def = bs.settings.adsb_dropout
+        # Times of the recorded states, and slot of the most recent state
+        self.histlen = bs.settings.adsb_histlen
+        self.histt = np.full(self.histlen, -np.inf)
+        self.head = -1
+
         # From here, define object arrays
         with self.settrafarrays():
             # Most recent broadcast data
@@ -20,40 +44,165 @@ class ADSB(Entity, replaceable=True):
             self.trk        = np.array([])
             self.tas        = np.array([])
             self.gs         = np.array([])
+            self.gsnorth    = np.array([])
+            self.gseast     = np.array([])
             self.vs         = np.array([])
 
+            # Broadcast interval [s], latency [s], dropout probability [-],
+            # and the phase of the broadcast interval [s]
+            self.interval   = np.array([])
+            self.latency    = np.array([])
+            self.dropout    = np.array([])
+            self.phase      = np.array([])
+            # Time of the most recent broadcast, also when it was dropped
+            self.lastbroadcast = np.array([])
+
+            # Recorded true states [ntraf x histlen x len(FIELDS)]
+            self.hist = np.zeros((0, self.histlen, len(FIELDS)))
+
         self.setnoise(False)
 
+    def reset(self):
+        super().reset()
+        self.interval_def = bs.settings.adsb_interval
+        self.latency_def = bs.settings.adsb_latency
+        self.dropout_def = bs.settings.adsb_dropout
+        self.histlen = bs.settings.adsb_histlen
+        self.histt = np.full(self.histlen, -np.inf)
+        self.head = -1
+        self.hist = np.zeros((0, self.histlen, len(FIELDS)))
+
+    @property
+    def ntraf(self):
+        ''' Number of aircraft, as for Traffic, so that ADS-B data can be
+            used as intruder in conflict detection and resolution. '''
+        return len(self.lastupdate)
+
     def setnoise(self, n):
         self.transnoise = n
-        self.truncated  = n
         self.transerror = [1e-4, 100 * ft]  # [degree,m] standard lat/lon distance, altitude error
-        self.trunctime  = 0  # [s]
+
+    @staticmethod
+    def truth(idx=slice(None)):
+        ''' Return the true state of aircraft idx as [n x len(FIELDS)] array. '''
+        return np.stack([getattr(bs.traf, name)[idx] for name in FIELDS], axis=1)
 
     def create(self, n=1):
         super().create(n)
 
-        self.lastupdate[-n:] = -self.trunctime * np.random.rand(n)
-        self.lat[-n:] = bs.traf.lat[-n:]
-        self.lon[-n:] = bs.traf.lon[-n:]
-        self.alt[-n:] = bs.traf.alt[-n:]
-        self.trk[-n:] = bs.traf.trk[-n:]
-        self.tas[-n:] = bs.traf.tas[-n:]
-        self.gs[-n:]  = bs.traf.gs[-n:]
+        self.interval[-n:] = self.interval_def
+        self.latency[-n:] = self.latency_def
+        self.dropout[-n:] = self.dropout_def
+        self.phase[-n:] = self.interval_def * np.random.rand(n) if self.interval_def > 0.0 else 0.0
+
+        # The initial state is known, and assumed to hold for the whole history
+        state = self.truth(slice(-n, None))
+        for k, name in enumerate(FIELDS):
+            getattr(self, name)[-n:] = state[:, k]
+        self.hist[-n:] = state[:, np.newaxis, :]
+        self.lastupdate[-n:] = bs.sim.simt
+        self.lastbroadcast[-n:] = bs.sim.simt
 
     def update(self):
-        up = np.where(self.lastupdate + self.trunctime < bs.sim.simt)
-        nup = len(up)
+        ''' Record the true traffic state, and update the received data with
+            the broadcasts that arrived since the previous update. '''
+        simt = bs.sim.simt
+        self.head = (self.head + 1) % self.histlen
+        self.histt[self.head] = simt
+        self.hist[:, self.head] = self.truth()
+
+        # Most recent broadcast that can have arrived by now
+        trx = simt - self.latency
+        periodic = self.interval > 0.0
+        interval = np.where(periodic, self.interval, 1.0)
+        tb = np.where(periodic,
+                      self.phase + np.floor((trx - self.phase) / interval) * interval, trx)
+        new = tb > self.lastbroadcast
+        self.lastbroadcast[new] = tb[new]
+
+        # Drop broadcasts. Only aircraft with dropouts use random numbers
+        lossy = np.flatnonzero(new & (self.dropout > 0.0))
+        new[lossy] = np.random.rand(len(lossy)) >= self.dropout[lossy]
+        up = np.flatnonzero(new)
+        if len(up) == 0:
+            return
+
+        # Look up the most recent recorded state at or before the broadcast
+        # time. Broadcasts older than the history get the oldest state.
+        order = (self.head + 1 + np.arange(self.histlen)) % self.histlen
+        tchron = self.histt[order]
+        oldest = np.searchsorted(tchron, -np.inf, side='right')
+        pos = np.maximum(np.searchsorted(tchron, tb[up], side='right') - 1, oldest)
+        state = self.hist[up, order[pos]]
+
         if self.transnoise:
-            self.lat[up] = bs.traf.lat[up] + np.random.normal(0, self.transerror[0], nup)
-            self.lon[up] = bs.traf.lon[up] + np.random.normal(0, self.transerror[0], nup)
-            self.alt[up] = bs.traf.alt[up] + np.random.normal(0, self.transerror[1], nup)
-        else:
-            self.lat[up] = bs.traf.lat[up]
-            self.lon[up] = bs.traf.lon[up]
-            self.alt[up] = bs.traf.alt[up]
-        self.trk[up] = bs.traf.trk[up]
-        self.tas[up] = bs.traf.tas[up]
-        self.gs[up]  = bs.traf.gs[up]
-        self.vs[up]  = bs.traf.vs[up]
-        self.lastupdate[up] = self.lastupdate[up] + self.trunctime
+            nup = len(up)
+            state[:, 0] += np.random.normal(0, self.transerror[0], nup)
+            state[:, 1] += np.random.normal(0, self.transerror[0], nup)
+            state[:, 2] += np.random.normal(0, self.transerror[1], nup)
+
+        for k, name in enumerate(FIELDS):
+            getattr(self, name)[up] = state[:, k]
+        self.lastupdate[up] = tb[up]
+
+    def setparams(self, idx, interval, latency, dropout):
+        ''' Set the broadcast parameters of aircraft idx, keeping
+            parameters that are None. '''
+        if interval is not None:
+            self.interval[idx] = interval
+            self.phase[idx] = interval * np.random.rand(*np.shape(self.phase[idx]))
+        if latency is not None:
+            self.latency[idx] = latency
+        if dropout is not None:
+            self.dropout[idx] = dropout
+
+    def checkparams(self, interval, latency, dropout):
+        ''' Check the broadcast parameters, return an error message or None. '''
+        if (interval is not None and interval < 0.0) or (latency is not None and latency < 0.0):
+            return 'ADS-B interval and latency should be at least 0 s'
+        if dropout is not None and not 0.0 <= dropout <= 1.0:
+            return 'ADS-B dropout probability should be between 0 and 1'
+        return None
+
+    def histwarning(self):
+        ''' Warn when the longest interval and latency exceed the history. '''
+        tmax = np.max(self.interval + self.latency, initial=self.interval_def + self.latency_def)
+        if tmax > (self.histlen - 1) * bs.sim.simdt:
+            return f'Warning: interval and latency of {tmax} s exceed the ADS-B ' + \
+                f'history of {(self.histlen - 1) * bs.sim.simdt} s, older states ' + \
+                'are not available (increase adsb_histlen in the settings)'
+        return ''
+
+    @stack.command(name='ADSBMODEL')
+    def setmodel(self, acidx: 'acid', interval: float = None, latency: float = None,
+                 dropout: float = None):
+        ''' Set the ADS-B broadcast interval [s] (0 = every update), latency [s]
+            and dropout probability [-] of an aircraft or group of aircraft. '''
+        if interval is None and latency is None and dropout is None:
+            return True, 'ADSBMODEL acid,[interval],[latency],[dropout]\n' + \
+                '\n'.join(f'{bs.traf.id[i]}: interval {self.interval[i]} s, '
+                          f'latency {self.latency[i]} s, dropout {self.dropout[i]}'
+                          for i in np.atleast_1d(acidx))
+        msg = self.checkparams(interval, latency, dropout)
+        if msg:
+            return False, msg
+        self.setparams(acidx, interval, latency, dropout)
+        return True, self.histwarning()
+
+    @stack.command(name='ADSBDEFAULT')
+    def setdefault(self, interval: float = None, latency: float = None,
+                   dropout: float = None):
+        ''' Set the ADS-B broadcast interval [s] (0 = every update), latency [s]
+            and dropout probability [-] of all current and new aircraft. '''
+        if interval is None and latency is None and dropout is None:
+            return True, 'ADSBDEFAULT [interval],[latency],[dropout]\n' + \
+                f'Default interval {self.interval_def} s, latency ' + \
+                f'{self.latency_def} s, dropout {self.dropout_def}'
+        msg = self.checkparams(interval, latency, dropout)
+        if msg:
+            return False, msg
+        self.interval_def = self.interval_def if interval is None else interval
+        self.latency_def = self.latency_def if latency is None else latency
+        self.dropout_def = self.dropout_def if dropout is None else dropout
+        self.setparams(slice(None), interval, latency, dropout)
+        return True, self.histwarning()
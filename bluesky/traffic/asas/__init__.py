@@ -1,4 +1,7 @@
 from .detection import ConflictDetection
 from .resolution import ConflictResolution
 from .statebased import StateBased
-from .mvp import MVP
\ No newline at end of file
+from .gridstatebased import GridStateBased
+from .tiledstatebased import TiledStateBased
+from .incrementalstatebased import IncrementalStateBased
+from .mvp import MVP
@@ -3,7 +3,7 @@ import numpy as np
 
 import bluesky as bs
 from bluesky.tools.aero import ft, nm
-from bluesky.core import Entity
+from bluesky.core import Entity, Signal
 from bluesky.stack import command
 
 
@@ -11,6 +11,30 @@ bs.settings.set_variable_defaults(asas_pzr=5.0, asas_pzh=1000.0,
                                   asas_dtlookahead=300.0)
 
 
+def pairkeys(uid1, uid2):
+    ''' Order-independent int64 key of aircraft uid pairs: (a, b) = (b, a). '''
+    uid1, uid2 = np.asarray(uid1, dtype=np.int64), np.asarray(uid2, dtype=np.int64)
+    return (np.minimum(uid1, uid2) << 32) | np.maximum(uid1, uid2)
+
+
+def splitkeys(keys):
+    ''' Return the two aircraft uids of each pair key. '''
+    return keys >> 32, keys & 0xffffffff
+
+
+def delpairs(idx, newidx):
+    ''' Remove deleted aircraft idx from the conflicts of all Conflict
+        Detection methods, and renumber the remaining pairs. Methods that
+        are not selected are updated as well, so that they are valid when
+        selected again. '''
+    for child in bs.traf._children:
+        if isinstance(child, ConflictDetection):
+            child.delpairs(newidx)
+
+
+Signal('aircraft_deleted').connect(delpairs)
+
+
 class ConflictDetection(Entity, replaceable=True):
     ''' Base class for Conflict Detection implementations. '''
     def __init__(self):
@@ -28,21 +52,28 @@ class ConflictDetection(Entity, replaceable=True):
         self.dtnolook_def = 0.0
         self.global_dtnolook = True
 
-        # Conflicts and LoS detected in the current timestep (used for resolving)
-        self.confpairs = list()
-        self.lospairs = list()
+        # Conflicts and LoS detected in the current timestep (used for resolving),
+        # stored as (ownship, intruder) index pairs, with per-pair data
+        self.confidx = np.zeros((0, 2), dtype=np.int32)
+        self.losidx = np.zeros((0, 2), dtype=np.int32)
         self.qdr = np.array([])
         self.dist = np.array([])
         self.dcpa = np.array([])
         self.tcpa = np.array([])
         self.tLOS = np.array([])
-        # Unique conflicts and LoS in the current timestep (a, b) = (b, a)
-        self.confpairs_unique = set()
-        self.lospairs_unique = set()
+        # Unique conflicts and LoS in the current timestep (a, b) = (b, a),
+        # as sorted arrays of uid pair keys
+        self.confkeys = np.array([], dtype=np.int64)
+        self.loskeys = np.array([], dtype=np.int64)
 
-        # All conflicts and LoS since simt=0
-        self.confpairs_all = list()
-        self.lospairs_all = list()
+        # All conflicts and LoS since simt=0, as chunks of uid pair keys
+        self.confkeys_all = list()
+        self.loskeys_all = list()
+        self.nconf_tot = 0
+        self.nlos_tot = 0
+        # Callsigns of the aircraft in confkeys_all/loskeys_all by uid,
+        # so that pairs of deleted aircraft can still be named
+        self.pairids = dict()
 
         # Per-aircraft conflict data
         with self.settrafarrays():
@@ -56,12 +87,58 @@ class ConflictDetection(Entity, replaceable=True):
             self.dtlookahead = np.array([])
             self.dtnolook = np.array([])
 
+    # Callsign views of the conflict database, generated on demand
+    @property
+    def confpairs(self):
+        ''' Current conflicts as a list of (ownship, intruder) callsigns. '''
+        return [(bs.traf.id[i], bs.traf.id[j]) for i, j in self.confidx]
+
+    @property
+    def lospairs(self):
+        ''' Current losses of separation as a list of (ownship, intruder) callsigns. '''
+        return [(bs.traf.id[i], bs.traf.id[j]) for i, j in self.losidx]
+
+    @property
+    def confpairs_unique(self):
+        ''' Current unique conflicts as a set of frozensets of callsigns. '''
+        return set(self._keys2pairs(self.confkeys))
+
+    @property
+    def lospairs_unique(self):
+        ''' Current unique losses of separation as a set of frozensets of callsigns. '''
+        return set(self._keys2pairs(self.loskeys))
+
+    @property
+    def confpairs_all(self):
+        ''' All conflicts since simt=0 as a list of frozensets of callsigns. '''
+        return self._keys2pairs(self.confkeys_all)
+
+    @property
+    def lospairs_all(self):
+        ''' All losses of separation since simt=0 as a list of frozensets of callsigns. '''
+        return self._keys2pairs(self.loskeys_all)
+
+    @property
+    def nconf_cur(self):
+        return len(self.confkeys)
+
+    @property
+    def nlos_cur(self):
+        return len(self.loskeys)
+
+    def _keys2pairs(self, keys):
+        ''' List of callsign frozensets of an array (or list of arrays) of pair keys. '''
+        if isinstance(keys, list):
+            keys = np.concatenate(keys) if keys else np.array([], dtype=np.int64)
+        uid1, uid2 = splitkeys(keys)
+        return [frozenset((self.pairids[a], self.pairids[b])) for a, b in zip(uid1, uid2)]
+
     def clearconfdb(self):
         ''' Clear conflict database. '''
-        self.confpairs_unique.clear()
-        self.lospairs_unique.clear()
-        self.confpairs.clear()
-        self.lospairs.clear()
+        self.confkeys = np.array([], dtype=np.int64)
+        self.loskeys = np.array([], dtype=np.int64)
+        self.confidx = np.zeros((0, 2), dtype=np.int32)
+        self.losidx = np.zeros((0, 2), dtype=np.int32)
         self.qdr = np.array([])
         self.dist = np.array([])
         self.dcpa = np.array([])
@@ -78,11 +155,29 @@ class ConflictDetection(Entity, replaceable=True):
         self.dtlookahead[-n:] = self.dtlookahead_def
         self.dtnolook[-n:] = self.dtnolook_def
 
+    def delpairs(self, newidx):
+        ''' Renumber the current pairs after a deletion with the new index of
+            each old aircraft index newidx (-1 for deleted aircraft), and
+            remove the pairs of deleted aircraft. '''
+        confidx = newidx[self.confidx]
+        exist = np.all(confidx >= 0, axis=1)
+        self.confidx = confidx[exist].astype(np.int32)
+        self.qdr, self.dist, self.dcpa, self.tcpa, self.tLOS = \
+            (np.asarray(data)[exist] for data in
+             (self.qdr, self.dist, self.dcpa, self.tcpa, self.tLOS))
+        losidx = newidx[self.losidx]
+        self.losidx = losidx[np.all(losidx >= 0, axis=1)].astype(np.int32)
+        self.confkeys = self.confkeys[np.all(bs.traf.uid2idx(splitkeys(self.confkeys)) >= 0, axis=0)]
+        self.loskeys = self.loskeys[np.all(bs.traf.uid2idx(splitkeys(self.loskeys)) >= 0, axis=0)]
+
     def reset(self):
         super().reset()
         self.clearconfdb()
-        self.confpairs_all.clear()
-        self.lospairs_all.clear()
+        self.confkeys_all.clear()
+        self.loskeys_all.clear()
+        self.nconf_tot = 0
+        self.nlos_tot = 0
+        self.pairids.clear()
         self.rpz_def = bs.settings.asas_pzr * nm
         self.hpz_def = bs.settings.asas_pzh * ft
         self.dtlookahead_def = bs.settings.asas_dtlookahead
@@ -208,30 +303,58 @@ class ConflictDetection(Entity, replaceable=True):
 
     def update(self, ownship, intruder):
         ''' Perform an update step of the Conflict Detection implementation. '''
-        self.confpairs, self.lospairs, self.inconf, self.tcpamax, self.qdr, \
+        confpairs, lospairs, self.inconf, self.tcpamax, self.qdr, \
             self.dist, self.dcpa, self.tcpa, self.tLOS = \
                 self.detect(ownship, intruder, self.rpz, self.hpz, self.dtlookahead)
+        self.confidx = self.pairindices(confpairs)
+        self.losidx = self.pairindices(lospairs)
 
-        # confpairs has conflicts observed from both sides (a, b) and (b, a)
-        # confpairs_unique keeps only one of these
-        confpairs_unique = {frozenset(pair) for pair in self.confpairs}
-        lospairs_unique = {frozenset(pair) for pair in self.lospairs}
+        # confidx has conflicts observed from both sides (a, b) and (b, a)
+        # confkeys keeps only one of these
+        uid = bs.traf.uid
+        confkeys = np.unique(pairkeys(uid[self.confidx[:, 0]], uid[self.confidx[:, 1]]))
+        loskeys = np.unique(pairkeys(uid[self.losidx[:, 0]], uid[self.losidx[:, 1]]))
 
-        self.confpairs_all.extend(confpairs_unique - self.confpairs_unique)
-        self.lospairs_all.extend(lospairs_unique - self.lospairs_unique)
+        newconf = np.setdiff1d(confkeys, self.confkeys, assume_unique=True)
+        newlos = np.setdiff1d(loskeys, self.loskeys, assume_unique=True)
+        if len(newconf) or len(newlos):
+            self.confkeys_all.append(newconf)
+            self.loskeys_all.append(newlos)
+            self.nconf_tot += len(newconf)
+            self.nlos_tot += len(newlos)
+            # Remember the callsigns of aircraft in new pairs
+            uids = np.unique(np.concatenate(splitkeys(newconf) + splitkeys(newlos)))
+            for acuid, idx in zip(uids, bs.traf.uid2idx(uids)):
+                self.pairids.setdefault(acuid, bs.traf.id[idx])
 
-        # Update confpairs_unique and lospairs_unique
-        self.confpairs_unique = confpairs_unique
-        self.lospairs_unique = lospairs_unique
+        # Update confkeys and loskeys
+        self.confkeys = confkeys
+        self.loskeys = loskeys
+
+    @staticmethod
+    def pairindices(pairs):
+        ''' Convert the pairs returned by detect() to an (n, 2) int32 array
+            of (ownship, intruder) indices. Detection methods return index
+            arrays, lists of callsign tuples are converted for compatibility. '''
+        if isinstance(pairs, np.ndarray):
+            return pairs.astype(np.int32, copy=False).reshape(-1, 2)
+        if not len(pairs):
+            return np.zeros((0, 2), dtype=np.int32)
+        own, intr = zip(*pairs)
+        return np.array([bs.traf.id2idx(own), bs.traf.id2idx(intr)], dtype=np.int32).T
 
     def detect(self, ownship, intruder, rpz, hpz, dtlookahead):
         ''' Detect any conflicts between ownship and intruder.
             This function should be reimplemented in a subclass for actual
             detection of conflicts. See for instance
             bluesky.traffic.asas.statebased.
+
+            confpairs and lospairs are returned as (n, 2) integer arrays of
+            (ownship index, intruder index) pairs, the per-pair data in the
+            same order.
         '''
-        confpairs = []
-        lospairs = []
+        confpairs = np.zeros((0, 2), dtype=np.int32)
+        lospairs = np.zeros((0, 2), dtype=np.int32)
         inconf = np.zeros(ownship.ntraf)
         tcpamax = np.zeros(ownship.ntraf)
         qdr = np.array([])
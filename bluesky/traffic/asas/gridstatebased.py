@@ -0,0 +1,194 @@
+''' State-based conflict detection with a spatial grid broad phase. '''
+import numpy as np
+from bluesky.tools.aero import nm
+from bluesky.traffic.asas.statebased import StateBased
+
+
+# Radius of the earth as used by geo.kwikqdrdist [m]
+REARTH = 6371000.
+
+
+def candidate_pairs(ownship, intruder, rpz, hpz, dtlookahead):
+    ''' Broad phase: return all ownship/intruder index pairs (i, j), i != j,
+        that can be in conflict or in loss of separation within the
+        lookahead time, in no particular order. Returns None when the
+        traffic cannot be binned (polar or globe spanning traffic).
+
+        Aircraft are binned in a lat/lon/altitude grid whose cells are at
+        least as large as the maximum distance over which two aircraft can
+        close in within the lookahead time, so only aircraft in the same or
+        in neighbouring cells need to be checked. '''
+    tlook = np.max(dtlookahead)
+    hsize = (np.max(rpz) + (np.max(ownship.gs) + np.max(intruder.gs)) * tlook) * 1.01 + 1.0
+    vsize = (np.max(hpz) + (np.max(np.abs(ownship.vs)) + np.max(np.abs(intruder.vs)) + 1e-6)
+             * tlook) * 1.01 + 1.0
+
+    lat = np.concatenate((ownship.lat, intruder.lat))
+    lon = np.concatenate((ownship.lon, intruder.lon))
+    alt = np.concatenate((ownship.alt, intruder.alt))
+    maxlat = np.max(np.abs(lat))
+    if maxlat > 85.0:
+        return None
+
+    # kwikdist >= re * |dlat| and >= re * |dlon| * cos(lat), so cells of
+    # these sizes in degrees are at least hsize wide
+    dlatcell = np.degrees(hsize / REARTH)
+    dloncell = np.degrees(hsize / (REARTH * np.cos(np.radians(maxlat))))
+    if np.max(lon) - np.min(lon) > 360.0 - 2.0 * dloncell:
+        # Pairs across the date line would not be in neighbouring cells
+        return None
+
+    # Integer cell coordinates, offset by one so that all neighbours are >= 0
+    ix = ((lat - np.min(lat)) / dlatcell).astype(np.int64) + 1
+    iy = ((lon - np.min(lon)) / dloncell).astype(np.int64) + 1
+    iz = ((alt - np.min(alt)) / vsize).astype(np.int64) + 1
+    ny, nz = np.max(iy) + 2, np.max(iz) + 2
+    key = (ix * ny + iy) * nz + iz
+
+    n = ownship.ntraf
+    ownkey, intkey = key[:n], key[n:]
+    order = np.argsort(intkey, kind='stable')
+    sortedkey = intkey[order]
+
+    own, intr = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                nbkey = ownkey + (dx * ny + dy) * nz + dz
+                start = np.searchsorted(sortedkey, nbkey, side='left')
+                count = np.searchsorted(sortedkey, nbkey, side='right') - start
+                total = np.sum(count)
+                if total == 0:
+                    continue
+                # Expand the (start, count) ranges to individual intruders
+                first = np.cumsum(count) - count
+                pos = np.arange(total) - np.repeat(first - start, count)
+                own.append(np.repeat(np.arange(n), count))
+                intr.append(order[pos])
+
+    if not own:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    own = np.concatenate(own)
+    intr = np.concatenate(intr)
+    keep = own != intr
+    return own[keep], intr[keep]
+
+
+def pairconflicts(ownship, intruder, rpz, hpz, dtlookahead, i, j):
+    ''' Narrow phase and state-based conflict test for candidate pairs
+        (i, j). All quantities are element [i, j] of the corresponding
+        StateBased matrix, evaluated with the same operations.
+
+        Returns the conflict pairs, the LoS pairs (both as index arrays
+        (i, j), in row-major order), and qdr, dist, dcpa, tcpa and tinconf
+        of the conflict pairs. '''
+    # Horizontal conflict ------------------------------------------------------
+    re = 6371000.
+    dlat = np.radians(intruder.lat[j] - ownship.lat[i])
+    dlon = np.radians(((intruder.lon[j] - ownship.lon[i]) + 180) % 360 - 180)
+    cavelat = np.cos(np.radians(intruder.lat[j] + ownship.lat[i]) * 0.5)
+    dangle = np.sqrt(dlat * dlat + (dlon * dlon) * (cavelat * cavelat))
+    dist = re * dangle / nm * nm
+    dalt = ownship.alt[j] - intruder.alt[i]
+
+    # Narrow phase: drop pairs that are too far apart to reach each other
+    # within the lookahead time, before evaluating the full CPA test
+    tlook = dtlookahead[i]
+    pairrpz = np.maximum(rpz[j], rpz[i])
+    pairhpz = np.maximum(hpz[j], hpz[i])
+    reach = ((ownship.gs[j] + intruder.gs[i]) * tlook + pairrpz) * 1.01 + 1.0
+    vreach = ((np.abs(ownship.vs[j]) + np.abs(intruder.vs[i]) + 1e-6) * tlook + pairhpz) * 1.01 + 1.0
+    near = np.flatnonzero((dist <= reach) & (np.abs(dalt) <= vreach))
+    # Same (row-major) order as the boolean masks of the matrix version
+    near = near[np.lexsort((j[near], i[near]))]
+    i, j = i[near], j[near]
+    dlat, dlon, cavelat = dlat[near], dlon[near], cavelat[near]
+    dist, dalt, tlook = dist[near], dalt[near], tlook[near]
+    pairrpz, pairhpz = pairrpz[near], pairhpz[near]
+
+    qdr = np.degrees(np.arctan2(dlon * cavelat, dlat)) % 360.
+
+    # Calculate horizontal closest point of approach (CPA)
+    qdrrad = np.radians(qdr)
+    dx = dist * np.sin(qdrrad)  # is pos j rel to i
+    dy = dist * np.cos(qdrrad)  # is pos j rel to i
+
+    # Ownship and intruder velocity components of the pairs
+    owntrkrad = np.radians(ownship.trk[j])
+    ownu = ownship.gs[j] * np.sin(owntrkrad)  # m/s
+    ownv = ownship.gs[j] * np.cos(owntrkrad)  # m/s
+    inttrkrad = np.radians(intruder.trk[i])
+    intu = intruder.gs[i] * np.sin(inttrkrad)  # m/s
+    intv = intruder.gs[i] * np.cos(inttrkrad)  # m/s
+
+    du = ownu - intu
+    dv = ownv - intv
+
+    dv2 = du * du + dv * dv
+    dv2 = np.where(np.abs(dv2) < 1e-6, 1e-6, dv2)  # limit lower absolute value
+    vrel = np.sqrt(dv2)
+
+    tcpa = -(du * dx + dv * dy) / dv2
+
+    # Calculate distance^2 at CPA (minimum distance^2)
+    dcpa2 = np.abs(dist * dist - tcpa * tcpa * dv2)
+
+    # Check for horizontal conflict
+    R2 = pairrpz * pairrpz
+    swhorconf = dcpa2 < R2  # conflict or not
+
+    # Calculate times of entering and leaving horizontal conflict
+    dxinhor = np.sqrt(np.maximum(0., R2 - dcpa2))  # half the distance travelled inzide zone
+    dtinhor = dxinhor / vrel
+
+    tinhor = np.where(swhorconf, tcpa - dtinhor, 1e8)  # Set very large if no conf
+    touthor = np.where(swhorconf, tcpa + dtinhor, -1e8)  # set very large if no conf
+
+    # Vertical conflict --------------------------------------------------------
+    dvs = ownship.vs[j] - intruder.vs[i]
+    dvs = np.where(np.abs(dvs) < 1e-6, 1e-6, dvs)  # prevent division by zero
+
+    tcrosshi = (dalt + pairhpz) / -dvs
+    tcrosslo = (dalt - pairhpz) / -dvs
+    tinver = np.minimum(tcrosshi, tcrosslo)
+    toutver = np.maximum(tcrosshi, tcrosslo)
+
+    # Combine vertical and horizontal conflict----------------------------------
+    tinconf = np.maximum(tinver, tinhor)
+    toutconf = np.minimum(toutver, touthor)
+
+    swconfl = swhorconf * (tinconf <= toutconf) * (toutconf > 0.0) * \
+        (tinconf < tlook)
+    swlos = (dist < pairrpz) * (np.abs(dalt) < pairhpz)
+
+    return np.stack((i[swconfl], j[swconfl]), axis=1).astype(np.int32), \
+        np.stack((i[swlos], j[swlos]), axis=1).astype(np.int32), \
+        qdr[swconfl], dist[swconfl], np.sqrt(dcpa2[swconfl]), \
+        tcpa[swconfl], tinconf[swconfl]
+
+
+def collectconflicts(ntraf, confpairs, lospairs, qdr, dist, dcpa, tcpa, tinconf):
+    ''' Combine the output of pairconflicts into the return values of
+        StateBased.detect. '''
+    # Ownship conflict flag and max tCPA
+    inconf = np.zeros(ntraf, dtype=bool)
+    inconf[confpairs[:, 0]] = True
+    tcpamax = np.zeros(ntraf)
+    np.maximum.at(tcpamax, confpairs[:, 0], tcpa)
+    return confpairs, lospairs, inconf, tcpamax, qdr, dist, dcpa, tcpa, tinconf
+
+
+class GridStateBased(StateBased):
+    ''' State-based conflict detection that only evaluates aircraft pairs
+        from neighbouring cells of a spatial grid. Gives the same results as
+        StateBased, but memory and time scale with the number of nearby
+        pairs instead of ntraf squared. '''
+    def detect(self, ownship, intruder, rpz, hpz, dtlookahead):
+        ''' Conflict detection between ownship (traf) and intruder (traf/adsb).'''
+        if ownship.ntraf == 0:
+            return super().detect(ownship, intruder, rpz, hpz, dtlookahead)
+        pairs = candidate_pairs(ownship, intruder, rpz, hpz, dtlookahead)
+        if pairs is None:
+            return super().detect(ownship, intruder, rpz, hpz, dtlookahead)
+        return collectconflicts(ownship.ntraf,
+            *pairconflicts(ownship, intruder, rpz, hpz, dtlookahead, *pairs))
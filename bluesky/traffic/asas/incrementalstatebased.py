@@ -0,0 +1,172 @@
+''' State-based conflict detection with incremental pair scheduling. '''
+from types import SimpleNamespace
+import numpy as np
+import bluesky as bs
+from bluesky import stack
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.traffic.asas.gridstatebased import GridStateBased, candidate_pairs, \
+    pairconflicts, collectconflicts
+
+
+bs.settings.set_variable_defaults(asas_cdvmargin=25.0, asas_cdhorizon=30.0)
+
+
+class IncrementalStateBased(GridStateBased):
+    ''' State-based conflict detection that only re-evaluates aircraft pairs
+        when they can possibly be in conflict.
+
+        Every horizon seconds a watch list of candidate pairs is built with
+        the grid broad phase, for a lookahead time extended by the horizon,
+        and assuming all aircraft fly vmargin faster than their current
+        ground speed. Pairs outside this list cannot get within reach of a
+        conflict before the next rebuild. For each watched pair the earliest
+        possible conflict time follows from the current distance and the
+        bound on the closing speed. A pair is only evaluated again when this
+        time is due; pairs near the threshold are evaluated every step.
+        The result is the same as StateBased, as long as no aircraft
+        speeds up by more than vmargin within the horizon. '''
+    def __init__(self):
+        super().__init__()
+        # [m/s] Bound on the increase of ground speed within the horizon
+        self.vmargin = bs.settings.asas_cdvmargin
+        # [s] Maximum time between rebuilds of the watch list
+        self.horizon = bs.settings.asas_cdhorizon
+        # [-] Switch to compare every step with full detection
+        self.swverify = False
+        # [-] Number of steps in which verification found a difference
+        self.nverifyfail = 0
+        # [-] Number of pairs evaluated in the last step
+        self.nevaluated = 0
+        self.clearwatchlist()
+
+    def reset(self):
+        super().reset()
+        self.vmargin = bs.settings.asas_cdvmargin
+        self.horizon = bs.settings.asas_cdhorizon
+        self.swverify = False
+        self.nverifyfail = 0
+        self.nevaluated = 0
+        self.clearwatchlist()
+
+    def clearwatchlist(self):
+        ''' Remove all pairs from the watch list, forcing a rebuild. '''
+        # Watched pairs as (ownship, intruder) uids and indices, and their due times
+        self.watchuid = np.zeros((0, 2), dtype=np.int64)
+        self.watchidx = np.zeros((0, 2), dtype=np.int64)
+        self.tdue = np.array([])
+        self.nwatch = 0
+        # Time of next rebuild, and the per-aircraft bounds on ground speed,
+        # rpz and lookahead time the watch list was built for, by uid
+        self.trebuild = -np.inf
+        self.limuid = np.array([], dtype=np.int64)
+        self.gslim = np.array([])
+        self.rpzlim = np.array([])
+        self.tlooklim = np.array([])
+        self.swfull = False
+
+    @stack.command(name='CDVERIFY')
+    def setverify(self, flag: 'onoff' = None):
+        ''' Compare incremental conflict detection with full detection
+            in every step. '''
+        if flag is None:
+            return True, 'CDVERIFY [ON/OFF]\nVerification is currently ' + \
+                ('ON' if self.swverify else 'OFF') + \
+                f', {self.nverifyfail} steps with differences found'
+        self.swverify = flag
+        return True
+
+    def detect(self, ownship, intruder, rpz, hpz, dtlookahead):
+        ''' Conflict detection between ownship (traf) and intruder (traf/adsb).'''
+        if ownship.ntraf == 0:
+            self.clearwatchlist()
+            return StateBased.detect(self, ownship, intruder, rpz, hpz, dtlookahead)
+
+        simt = bs.sim.simt
+        # The watch list has to be rebuilt when the horizon has passed, when
+        # aircraft are created, or when the bounds it was built for are exceeded
+        gs = np.maximum(ownship.gs, intruder.gs)
+        if simt >= self.trebuild or ownship.uid[-1] > self.limuid[-1]:
+            self.rebuild(ownship, intruder, rpz, hpz, dtlookahead, simt)
+        else:
+            # Aircraft are only deleted between rebuilds
+            lim = np.searchsorted(self.limuid, ownship.uid)
+            if np.any(gs > self.gslim[lim]) or np.any(rpz > self.rpzlim[lim]) or \
+                    np.any(dtlookahead > self.tlooklim[lim]):
+                self.rebuild(ownship, intruder, rpz, hpz, dtlookahead, simt)
+        lim = np.searchsorted(self.limuid, ownship.uid)
+        gslim, rpzlim, tlooklim = self.gslim[lim], self.rpzlim[lim], self.tlooklim[lim]
+
+        if self.swfull:
+            # Traffic that cannot be binned: full detection
+            self.nevaluated = ownship.ntraf * (ownship.ntraf - 1)
+            return StateBased.detect(self, ownship, intruder, rpz, hpz, dtlookahead)
+
+        # Remove pairs with deleted aircraft. Aircraft creation causes a
+        # rebuild, so a change in ntraf between rebuilds means deletion
+        if ownship.ntraf != self.nwatch:
+            self.nwatch = ownship.ntraf
+            self.watchidx = ownship.uid2idx(self.watchuid)
+            exist = np.all(self.watchidx >= 0, axis=1)
+            self.watchidx = self.watchidx[exist]
+            self.watchuid = self.watchuid[exist]
+            self.tdue = self.tdue[exist]
+
+        # Evaluate the pairs that are due, and schedule their next evaluation
+        due = np.flatnonzero(self.tdue <= simt)
+        i, j = self.watchidx[due, 0], self.watchidx[due, 1]
+        self.nevaluated = len(due)
+        result = collectconflicts(ownship.ntraf,
+            *pairconflicts(ownship, intruder, rpz, hpz, dtlookahead, i, j))
+        self.tdue[due] = simt + self.earliest(ownship, intruder, i, j, gslim, rpzlim, tlooklim)
+
+        if self.swverify:
+            full = StateBased.detect(self, ownship, intruder, rpz, hpz, dtlookahead)
+            if not all(np.array_equal(np.asarray(a), np.asarray(b))
+                       for a, b in zip(result, full)):
+                self.nverifyfail += 1
+                bs.scr.echo(f'CDVERIFY: incremental conflict detection differs from '
+                            f'full detection at t={simt:.1f}s, using full detection')
+                self.clearwatchlist()
+                return full
+        return result
+
+    def rebuild(self, ownship, intruder, rpz, hpz, dtlookahead, simt):
+        ''' Rebuild the watch list with all pairs that can get within reach
+            of a conflict within the horizon. '''
+        self.trebuild = simt + self.horizon
+        self.limuid = ownship.uid.copy()
+        self.gslim = np.maximum(ownship.gs, intruder.gs) + self.vmargin
+        self.rpzlim = np.array(rpz)
+        self.tlooklim = np.array(dtlookahead)
+
+        # Broad phase at the maximum ground speeds, over the lookahead time plus
+        # the horizon. Altitude is not used, as vertical speeds are not bounded
+        def bounded(ac):
+            return SimpleNamespace(ntraf=ac.ntraf, lat=ac.lat, lon=ac.lon,
+                                   alt=np.zeros(ac.ntraf), gs=self.gslim,
+                                   vs=np.zeros(ac.ntraf))
+        pairs = candidate_pairs(bounded(ownship), bounded(intruder), rpz, hpz,
+                                dtlookahead + self.horizon)
+        self.swfull = pairs is None
+        if self.swfull:
+            pairs = np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        i, j = pairs
+        self.watchidx = np.stack(pairs, axis=1)
+        self.watchuid = ownship.uid[self.watchidx]
+        self.nwatch = ownship.ntraf
+        self.tdue = simt + self.earliest(ownship, intruder, i, j,
+                                         self.gslim, self.rpzlim, self.tlooklim)
+
+    @staticmethod
+    def earliest(ownship, intruder, i, j, gslim, rpzlim, tlooklim):
+        ''' Time after which pairs (i, j) can first be within reach of a
+            conflict: the distance minus the reach, at the maximum closing
+            speed. Zero for pairs that are already within reach. '''
+        re = 6371000.
+        dlat = np.radians(intruder.lat[j] - ownship.lat[i])
+        dlon = np.radians(((intruder.lon[j] - ownship.lon[i]) + 180) % 360 - 180)
+        cavelat = np.cos(np.radians(intruder.lat[j] + ownship.lat[i]) * 0.5)
+        dist = re * np.sqrt(dlat * dlat + (dlon * dlon) * (cavelat * cavelat))
+        vclose = gslim[i] + gslim[j]
+        reach = (vclose * tlooklim[i] + np.maximum(rpzlim[i], rpzlim[j])) * 1.01 + 1.0
+        return np.maximum(0.0, (dist - reach) / vclose)
@@ -91,111 +91,42 @@ class MVP(ConflictResolution):
             # Do NOT swtich off self.swresohoriz if value == OFF
             self.swresovert = False
 
-    def applyprio(self, dv_mvp, dv1, dv2, vs1, vs2):
-        ''' Apply the desired priority setting to the resolution '''
+    def applyprio_pairs(self, dv_mvp, vs1, vs2):
+        ''' Apply the desired priority setting to the resolutions of all
+            conflict pairs at once. Scales the vertical component of dv_mvp
+            in place, and returns a boolean array that is True for the pairs
+            in which the ownship takes part in the resolution. '''
+        # Aircraft 1 is cruising, and aircraft 2 is climbing/descending
+        cruise1 = np.logical_and(np.abs(vs1) < 0.1, np.abs(vs2) > 0.1)
+        # Aircraft 2 is cruising, and aircraft 1 is climbing/descending
+        cruise2 = np.logical_and(np.abs(vs2) < 0.1, np.abs(vs1) > 0.1)
 
-        # Primary Free Flight prio rules (no priority)
         if self.priocode == 'FF1':
-            # since cooperative, the vertical resolution component can be halved, and then dv_mvp can be added
-            dv_mvp[2] = dv_mvp[2] / 2.0
-            dv1 = dv1 - dv_mvp
-            dv2 = dv2 + dv_mvp
-
-        # Secondary Free Flight (Cruising aircraft has priority, combined resolutions)
+            # Cooperative: both aircraft solve, vertical component halved
+            dv_mvp[:, 2] = dv_mvp[:, 2] / 2.0
+            return np.ones(len(dv_mvp), dtype=bool)
         if self.priocode == 'FF2':
-            # since cooperative, the vertical resolution component can be halved, and then dv_mvp can be added
-            dv_mvp[2] = dv_mvp[2]/2.0
-            # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 2 solves conflict
-            if abs(vs1) < 0.1 and abs(vs2) > 0.1:
-                dv2 = dv2 + dv_mvp
-            # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 1 solves conflict
-            elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
-                dv1 = dv1 - dv_mvp
-            else:  # both are climbing/descending/cruising -> both aircraft solves the conflict
-                dv1 = dv1 - dv_mvp
-                dv2 = dv2 + dv_mvp
-
-        # Tertiary Free Flight (Climbing/descending aircraft have priority and crusing solves with horizontal resolutions)
-        elif self.priocode == 'FF3':
-            # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 1 solves conflict horizontally
-            if abs(vs1) < 0.1 and abs(vs2) > 0.1:
-                dv_mvp[2] = 0.0
-                dv1 = dv1 - dv_mvp
-            # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 2 solves conflict horizontally
-            elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
-                dv_mvp[2] = 0.0
-                dv2 = dv2 + dv_mvp
-            else:  # both are climbing/descending/cruising -> both aircraft solves the conflict, combined
-                dv_mvp[2] = dv_mvp[2]/2.0
-                dv1 = dv1 - dv_mvp
-                dv2 = dv2 + dv_mvp
-
-        # Primary Layers (Cruising aircraft has priority and clmibing/descending solves. All conflicts solved horizontally)
-        elif self.priocode == 'LAY1':
-            dv_mvp[2] = 0.0
-            # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 2 solves conflict horizontally
-            if abs(vs1) < 0.1 and abs(vs2) > 0.1:
-                dv2 = dv2 + dv_mvp
-            # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 1 solves conflict horizontally
-            elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
-                dv1 = dv1 - dv_mvp
-            else:  # both are climbing/descending/cruising -> both aircraft solves the conflict horizontally
-                dv1 = dv1 - dv_mvp
-                dv2 = dv2 + dv_mvp
-
-        # Secondary Layers (Climbing/descending aircraft has priority and cruising solves. All conflicts solved horizontally)
-        elif self.priocode == 'LAY2':
-            dv_mvp[2] = 0.0
-            # If aircraft 1 is cruising, and aircraft 2 is climbing/descending -> aircraft 1 solves conflict horizontally
-            if abs(vs1) < 0.1 and abs(vs2) > 0.1:
-                dv1 = dv1 - dv_mvp
-            # If aircraft 2 is cruising, and aircraft 1 is climbing -> aircraft 2 solves conflict horizontally
-            elif abs(vs2) < 0.1 and abs(vs1) > 0.1:
-                dv2 = dv2 + dv_mvp
-            else:  # both are climbing/descending/cruising -> both aircraft solves the conflic horizontally
-                dv1 = dv1 - dv_mvp
-                dv2 = dv2 + dv_mvp
-
-        return dv1, dv2
-
+            # Cruising aircraft has priority, combined resolutions
+            dv_mvp[:, 2] = dv_mvp[:, 2] / 2.0
+            return ~cruise1
+        if self.priocode == 'FF3':
+            # Climbing/descending aircraft has priority, cruising aircraft
+            # solves horizontally
+            dv_mvp[:, 2] = np.where(cruise1 | cruise2, 0.0, dv_mvp[:, 2] / 2.0)
+            return ~cruise2
+        if self.priocode == 'LAY1':
+            # Cruising aircraft has priority, all conflicts solved horizontally
+            dv_mvp[:, 2] = 0.0
+            return ~cruise1
+        if self.priocode == 'LAY2':
+            # Climbing/descending aircraft has priority, all conflicts solved horizontally
+            dv_mvp[:, 2] = 0.0
+            return ~cruise2
+        return np.zeros(len(dv_mvp), dtype=bool)
 
     def resolve(self, conf, ownship, intruder):
         ''' Resolve all current conflicts '''
-        # Initialize an array to store the resolution velocity vector for all A/C
-        dv = np.zeros((ownship.ntraf, 3))
-
-        # Initialize an array to store time needed to resolve vertically
-        timesolveV = np.ones(ownship.ntraf) * 1e9
-
-        # Call MVP function to resolve conflicts-----------------------------------
-        for ((ac1, ac2), qdr, dist, tcpa, tLOS) in zip(conf.confpairs, conf.qdr, conf.dist, conf.tcpa, conf.tLOS):
-            idx1 = ownship.id.index(ac1)
-            idx2 = intruder.id.index(ac2)
-
-            # If A/C indexes are found, then apply MVP on this conflict pair
-            # Because ADSB is ON, this is done for each aircraft separately
-            if idx1 >-1 and idx2 > -1:
-                dv_mvp, tsolV = self.MVP(ownship, intruder, conf, qdr, dist, tcpa, tLOS, idx1, idx2)
-                if tsolV < timesolveV[idx1]:
-                    timesolveV[idx1] = tsolV
-
-                # Use priority rules if activated
-                if self.swprio:
-                    dv[idx1], _ = self.applyprio(dv_mvp, dv[idx1], dv[idx2], ownship.vs[idx1], intruder.vs[idx2])
-                else:
-                    # since cooperative, the vertical resolution component can be halved, and then dv_mvp can be added
-                    dv_mvp[2] = 0.5 * dv_mvp[2]
-                    dv[idx1] = dv[idx1] - dv_mvp
-
-                # Check the noreso aircraft. Nobody avoids noreso aircraft.
-                # But noreso aircraft will avoid other aircraft
-                if self.noresoac[idx2]:
-                    dv[idx1] = dv[idx1] + dv_mvp
-
-                # Check the resooff aircraft. These aircraft will not do resolutions.
-                if self.resooffac[idx1]:
-                    dv[idx1] = 0.0
-
+        dv, timesolveV = self.resolutionvectors(conf, ownship, intruder)
 
         # Determine new speed and limit resolution direction for all aicraft-------
 
@@ -264,88 +195,118 @@ class MVP(ConflictResolution):
         alt = alt * (1 - self.swresohoriz) + ownship.selalt * self.swresohoriz
         return newtrack, newgscapped, vscapped, alt
 
-    def MVP(self, ownship, intruder, conf, qdr, dist, tcpa, tLOS, idx1, idx2):
-        """Modified Voltage Potential (MVP) resolution method"""
+    def resolutionvectors(self, conf, ownship, intruder):
+        ''' Compute the summed MVP resolution velocity vector (ntraf x 3)
+            and the time needed to resolve vertically for all aircraft,
+            evaluating all conflict pairs at once. '''
+        # Initialize an array to store the resolution velocity vector for all A/C
+        dv = np.zeros((ownship.ntraf, 3))
+
+        # Initialize an array to store time needed to resolve vertically
+        timesolveV = np.ones(ownship.ntraf) * 1e9
+
+        # Only apply MVP on the conflict pairs of which both A/C are found.
+        # Because ADSB is ON, this is done for each aircraft separately
+        confidx = np.reshape(conf.confidx, (-1, 2))
+        valid = np.all(confidx > -1, axis=1)
+        if not np.any(valid):
+            return dv, timesolveV
+        idx1, idx2 = confidx[valid, 0], confidx[valid, 1]
+        dv_mvp, tsolV = self.MVP_pairs(ownship, intruder, conf,
+                                       np.asarray(conf.qdr)[valid], np.asarray(conf.dist)[valid],
+                                       np.asarray(conf.tcpa)[valid], np.asarray(conf.tLOS)[valid],
+                                       idx1, idx2)
+        np.minimum.at(timesolveV, idx1, tsolV)
+
+        # Use priority rules if activated
+        if self.swprio:
+            solve = self.applyprio_pairs(dv_mvp, ownship.vs[idx1], intruder.vs[idx2])
+        else:
+            # since cooperative, the vertical resolution component can be halved, and then dv_mvp can be added
+            dv_mvp[:, 2] = 0.5 * dv_mvp[:, 2]
+            solve = np.ones(len(idx1), dtype=bool)
+
+        # Nobody avoids noreso aircraft, but noreso aircraft will avoid other
+        # aircraft: the resolution of a pair with a noreso intruder is added
+        # back. Per pair the subtraction precedes the addition, in pair order,
+        # so the sums equal those of a sequential loop over the pairs.
+        steps = np.stack((-dv_mvp, dv_mvp), axis=1).reshape(-1, 3)
+        apply = np.stack((solve, self.noresoac[idx2]), axis=1).ravel()
+        np.add.at(dv, np.repeat(idx1, 2)[apply], steps[apply])
+
+        # Check the resooff aircraft. These aircraft will not do resolutions.
+        dv[self.resooffac] = 0.0
+        return dv, timesolveV
+
+    def MVP_pairs(self, ownship, intruder, conf, qdr, dist, tcpa, tLOS, idx1, idx2):
+        """Modified Voltage Potential (MVP) resolution method for arrays of
+           conflict pairs. Equivalent to MVP() applied to each pair."""
         # Preliminary calculations-------------------------------------------------
         # Determine largest RPZ and HPZ of the conflict pair, use lookahead of ownship
-        rpz_m = np.max(conf.rpz[[idx1, idx2]] * self.resofach)
-        hpz_m = np.max(conf.hpz[[idx1, idx2]] * self.resofacv)
+        rpz_m = np.maximum(conf.rpz[idx1] * self.resofach, conf.rpz[idx2] * self.resofach)
+        hpz_m = np.maximum(conf.hpz[idx1] * self.resofacv, conf.hpz[idx2] * self.resofacv)
         dtlook = conf.dtlookahead[idx1]
         # Convert qdr from degrees to radians
         qdr = np.radians(qdr)
 
         # Relative position vector between id1 and id2
-        drel = np.array([np.sin(qdr) * dist, \
-                        np.cos(qdr) * dist, \
-                        intruder.alt[idx2] - ownship.alt[idx1]])
+        drel = np.stack((np.sin(qdr) * dist,
+                         np.cos(qdr) * dist,
+                         intruder.alt[idx2] - ownship.alt[idx1]), axis=1)
 
         # Write velocities as vectors and find relative velocity vector
-        v1 = np.array([ownship.gseast[idx1], ownship.gsnorth[idx1], ownship.vs[idx1]])
-        v2 = np.array([intruder.gseast[idx2], intruder.gsnorth[idx2], intruder.vs[idx2]])
+        v1 = np.stack((ownship.gseast[idx1], ownship.gsnorth[idx1], ownship.vs[idx1]), axis=1)
+        v2 = np.stack((intruder.gseast[idx2], intruder.gsnorth[idx2], intruder.vs[idx2]), axis=1)
         vrel = v2 - v1
 
+        # Both branches of the np.where's below are evaluated for all pairs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Horizontal resolution------------------------------------------------
 
-        # Horizontal resolution----------------------------------------------------
-
-        # Find horizontal distance at the tcpa (min horizontal distance)
-        dcpa  = drel + vrel*tcpa
-        dabsH = np.sqrt(dcpa[0] * dcpa[0] + dcpa[1] * dcpa[1])
+            # Find horizontal distance at the tcpa (min horizontal distance)
+            dcpa  = drel + vrel * tcpa[:, np.newaxis]
+            dabsH = np.sqrt(dcpa[:, 0] * dcpa[:, 0] + dcpa[:, 1] * dcpa[:, 1])
 
-        # Compute horizontal intrusion
-        iH = rpz_m - dabsH
+            # Compute horizontal intrusion
+            iH = rpz_m - dabsH
 
-        # Exception handlers for head-on conflicts
-        # This is done to prevent division by zero in the next step
-        if dabsH <= 10.:
-            dabsH = 10.
-            dcpa[0] = drel[1] / dist * dabsH
-            dcpa[1] = -drel[0] / dist * dabsH
+            # Exception handlers for head-on conflicts
+            # This is done to prevent division by zero in the next step
+            headon = dabsH <= 10.
+            dabsH = np.where(headon, 10., dabsH)
+            dcpa[headon, 0] = drel[headon, 1] / dist[headon] * 10.
+            dcpa[headon, 1] = -drel[headon, 0] / dist[headon] * 10.
 
-        # If intruder is outside the ownship PZ, then apply extra factor
-        # to make sure that resolution does not graze IPZ
-        if rpz_m < dist and dabsH < dist:
-            # Compute the resolution velocity vector in horizontal direction.
+            # If intruder is outside the ownship PZ, then apply extra factor
+            # to make sure that resolution does not graze IPZ
+            outside = np.logical_and(rpz_m < dist, dabsH < dist)
+            erratum = np.cos(np.arcsin(rpz_m / dist) - np.arcsin(dabsH / dist))
             # abs(tcpa) because it bcomes negative during intrusion.
-            erratum = np.cos(np.arcsin(rpz_m / dist)-np.arcsin(dabsH / dist))
-            dv1 = ((rpz_m / erratum - dabsH) * dcpa[0]) / (abs(tcpa) * dabsH)
-            dv2 = ((rpz_m / erratum - dabsH) * dcpa[1]) / (abs(tcpa) * dabsH)
-        else:
-            dv1 = (iH * dcpa[0]) / (abs(tcpa) * dabsH)
-            dv2 = (iH * dcpa[1]) / (abs(tcpa) * dabsH)
-
-        # Vertical resolution------------------------------------------------------
+            iH = np.where(outside, rpz_m / erratum - dabsH, iH)
+            dv1 = (iH * dcpa[:, 0]) / (np.abs(tcpa) * dabsH)
+            dv2 = (iH * dcpa[:, 1]) / (np.abs(tcpa) * dabsH)
 
-        # Compute the  vertical intrusion
-        # Amount of vertical intrusion dependent on vertical relative velocity
-        iV = hpz_m if abs(vrel[2]) > 0.0 else hpz_m - abs(drel[2])
+            # Vertical resolution--------------------------------------------------
 
-        # Get the time to solve the conflict vertically - tsolveV
-        tsolV = abs(drel[2] / vrel[2]) if abs(vrel[2]) > 0.0 else tLOS
+            # Compute the  vertical intrusion
+            # Amount of vertical intrusion dependent on vertical relative velocity
+            vertmove = np.abs(vrel[:, 2]) > 0.0
+            iV = np.where(vertmove, hpz_m, hpz_m - np.abs(drel[:, 2]))
 
-        # If the time to solve the conflict vertically is longer than the look-ahead time,
-        # because the the relative vertical speed is very small, then solve the intrusion
-        # within tinconf
-        if tsolV > dtlook:
-            tsolV = tLOS
-            iV    = hpz_m
+            # Get the time to solve the conflict vertically - tsolveV
+            tsolV = np.where(vertmove, np.abs(drel[:, 2] / vrel[:, 2]), tLOS)
 
-        # Compute the resolution velocity vector in the vertical direction
-        # The direction of the vertical resolution is such that the aircraft with
-        # higher climb/decent rate reduces their climb/decent rate
-        dv3 = np.where(abs(vrel[2]) > 0.0, (iV / tsolV) * (-vrel[2] / abs(vrel[2])), (iV / tsolV))
-
-        # It is necessary to cap dv3 to prevent that a vertical conflict
-        # is solved in 1 timestep, leading to a vertical separation that is too
-        # high (high vs assumed in traf). If vertical dynamics are included to
-        # aircraft  model in traffic.py, the below three lines should be deleted.
-        #    mindv3 = -400*fpm# ~ 2.016 [m/s]
-        #    maxdv3 = 400*fpm
-        #    dv3 = np.maximum(mindv3,np.minimum(maxdv3,dv3))
+            # If the time to solve the conflict vertically is longer than the look-ahead time,
+            # because the the relative vertical speed is very small, then solve the intrusion
+            # within tinconf
+            slow = tsolV > dtlook
+            tsolV = np.where(slow, tLOS, tsolV)
+            iV = np.where(slow, hpz_m, iV)
 
+            # Compute the resolution velocity vector in the vertical direction
+            # The direction of the vertical resolution is such that the aircraft with
+            # higher climb/decent rate reduces their climb/decent rate
+            dv3 = np.where(vertmove, (iV / tsolV) * (-vrel[:, 2] / np.abs(vrel[:, 2])), (iV / tsolV))
 
         # Combine resolutions------------------------------------------------------
-
-        # combine the dv components
-        dv = np.array([dv1, dv2, dv3])
-
-        return dv, tsolV
+        return np.stack((dv1, dv2, dv3), axis=1), tsolV
@@ -7,98 +7,144 @@ from bluesky.traffic.asas import ConflictDetection
 
 
 class StateBased(ConflictDetection):
+    def __init__(self):
+        super().__init__()
+        # Scratch matrices, reused between detection steps
+        self.workspace = geo.Workspace()
+
+    def reset(self):
+        super().reset()
+        self.workspace.clear()
+
     def detect(self, ownship, intruder, rpz, hpz, dtlookahead):
         ''' Conflict detection between ownship (traf) and intruder (traf/adsb).'''
-        # Identity matrix of order ntraf: avoid ownship-ownship detected conflicts
-        I = np.eye(ownship.ntraf)
+        # All ntraf x ntraf matrices are computed in place, in scratch
+        # matrices from the workspace when available. Element [i, j] is
+        # evaluated from the perspective of ownship i and intruder j
+        ws = getattr(self, 'workspace', None)
+        n = ownship.ntraf
+        shape = (n, n)
+
+        def mat(name, dtype=np.float64):
+            return np.empty(shape, dtype) if ws is None else ws.get(name, shape, dtype)
+
+        # Diagonal of ntraf x ntraf matrices: avoid ownship-ownship detected conflicts
+        diag = slice(None, None, n + 1)
 
         # Horizontal conflict ------------------------------------------------------
 
         # qdrlst is for [i,j] qdr from i to j, from perception of ADSB and own coordinates
-        qdr, dist = geo.kwikqdrdist_matrix(np.asmatrix(ownship.lat), np.asmatrix(ownship.lon),
-                                    np.asmatrix(intruder.lat), np.asmatrix(intruder.lon))
+        qdr, dist = geo.kwikqdrdist_outer(ownship.lat, ownship.lon, intruder.lat, intruder.lon,
+                                          qdr=mat('qdr'), dist=mat('dist'), ws=ws)
 
-        # Convert back to array to allow element-wise array multiplications later on
         # Convert to meters and add large value to own/own pairs
-        qdr = np.asarray(qdr)
-        dist = np.asarray(dist) * nm + 1e9 * I
+        dist *= nm
+        dist.reshape(-1)[diag] += 1e9
 
         # Calculate horizontal closest point of approach (CPA)
-        qdrrad = np.radians(qdr)
-        dx = dist * np.sin(qdrrad)  # is pos j rel to i
-        dy = dist * np.cos(qdrrad)  # is pos j rel to i
+        qdrrad = np.radians(qdr, out=mat('dlat'))
+        dx = np.sin(qdrrad, out=mat('dlon'))
+        dx *= dist  # is pos j rel to i
+        dy = np.cos(qdrrad, out=qdrrad)
+        dy *= dist  # is pos j rel to i
 
         # Ownship track angle and speed
         owntrkrad = np.radians(ownship.trk)
-        ownu = ownship.gs * np.sin(owntrkrad).reshape((1, ownship.ntraf))  # m/s
-        ownv = ownship.gs * np.cos(owntrkrad).reshape((1, ownship.ntraf))  # m/s
+        ownu = ownship.gs * np.sin(owntrkrad)  # m/s
+        ownv = ownship.gs * np.cos(owntrkrad)  # m/s
 
         # Intruder track angle and speed
         inttrkrad = np.radians(intruder.trk)
-        intu = intruder.gs * np.sin(inttrkrad).reshape((1, ownship.ntraf))  # m/s
-        intv = intruder.gs * np.cos(inttrkrad).reshape((1, ownship.ntraf))  # m/s
-
-        du = ownu - intu.T  # Speed du[i,j] is perceived eastern speed of i to j
-        dv = ownv - intv.T  # Speed dv[i,j] is perceived northern speed of i to j
-
-        dv2 = du * du + dv * dv
-        dv2 = np.where(np.abs(dv2) < 1e-6, 1e-6, dv2)  # limit lower absolute value
-        vrel = np.sqrt(dv2)
-
-        tcpa = -(du * dx + dv * dy) / dv2 + 1e9 * I
+        intu = intruder.gs * np.sin(inttrkrad)  # m/s
+        intv = intruder.gs * np.cos(inttrkrad)  # m/s
+
+        # Speed du[i,j] is perceived eastern speed of i to j
+        du = np.subtract(ownu, intu[:, np.newaxis], out=mat('cavelat'))
+        # Speed dv[i,j] is perceived northern speed of i to j
+        dv = np.subtract(ownv, intv[:, np.newaxis], out=mat('tmp'))
+
+        dv2 = np.multiply(du, du, out=mat('dv2'))
+        tmp = np.multiply(dv, dv, out=mat('e'))
+        dv2 += tmp
+        np.maximum(dv2, 1e-6, out=dv2)  # limit lower absolute value
+
+        tcpa = np.multiply(du, dx, out=mat('tcpa'))
+        tmp = np.multiply(dv, dy, out=tmp)
+        tcpa += tmp
+        np.negative(tcpa, out=tcpa)
+        tcpa /= dv2
+        tcpa.reshape(-1)[diag] += 1e9
 
         # Calculate distance^2 at CPA (minimum distance^2)
-        dcpa2 = np.abs(dist * dist - tcpa * tcpa * dv2)
+        dcpa2 = np.multiply(dist, dist, out=mat('dcpa2'))
+        tmp = np.multiply(tcpa, tcpa, out=tmp)
+        tmp *= dv2
+        dcpa2 -= tmp
+        np.abs(dcpa2, out=dcpa2)
 
         # Check for horizontal conflict
         # RPZ can differ per aircraft, get the largest value per aircraft pair
-        rpz = np.asarray(np.maximum(np.asmatrix(rpz), np.asmatrix(rpz).transpose()))
-        R2 = rpz * rpz
-        swhorconf = dcpa2 < R2  # conflict or not
+        rpz = np.maximum(rpz, rpz[:, np.newaxis], out=mat('pz'))
+        swlos = np.less(dist, rpz, out=mat('los', bool))
+        R2 = np.multiply(rpz, rpz, out=rpz)
+        swhorconf = np.less(dcpa2, R2, out=mat('swhorconf', bool))  # conflict or not
+        noconf = np.logical_not(swhorconf, out=mat('noconf', bool))
 
         # Calculate times of entering and leaving horizontal conflict
-        dxinhor = np.sqrt(np.maximum(0., R2 - dcpa2))  # half the distance travelled inzide zone
-        dtinhor = dxinhor / vrel
+        dtinhor = np.subtract(R2, dcpa2, out=R2)
+        np.maximum(0., dtinhor, out=dtinhor)
+        np.sqrt(dtinhor, out=dtinhor)  # half the distance travelled inzide zone
+        vrel = np.sqrt(dv2, out=dv2)
+        dtinhor /= vrel
 
-        tinhor = np.where(swhorconf, tcpa - dtinhor, 1e8)  # Set very large if no conf
-        touthor = np.where(swhorconf, tcpa + dtinhor, -1e8)  # set very large if no conf
+        tinhor = np.subtract(tcpa, dtinhor, out=mat('cavelat'))
+        np.copyto(tinhor, 1e8, where=noconf)  # Set very large if no conf
+        touthor = np.add(tcpa, dtinhor, out=mat('tmp'))
+        np.copyto(touthor, -1e8, where=noconf)  # set very large if no conf
 
         # Vertical conflict --------------------------------------------------------
 
         # Vertical crossing of disk (-dh,+dh)
-        dalt = ownship.alt.reshape((1, ownship.ntraf)) - \
-            intruder.alt.reshape((1, ownship.ntraf)).T  + 1e9 * I
+        dalt = np.subtract(ownship.alt, intruder.alt[:, np.newaxis], out=vrel)
+        dalt.reshape(-1)[diag] += 1e9
 
-        dvs = ownship.vs.reshape(1, ownship.ntraf) - \
-            intruder.vs.reshape(1, ownship.ntraf).T
-        dvs = np.where(np.abs(dvs) < 1e-6, 1e-6, dvs)  # prevent division by zero
+        dvs = np.subtract(ownship.vs, intruder.vs[:, np.newaxis], out=mat('e'))
+        small = np.less(np.abs(dvs, out=mat('dlat')), 1e-6, out=noconf)
+        np.copyto(dvs, 1e-6, where=small)  # prevent division by zero
+        np.negative(dvs, out=dvs)
 
         # Check for passing through each others zone
         # hPZ can differ per aircraft, get the largest value per aircraft pair
-        hpz = np.asarray(np.maximum(np.asmatrix(hpz), np.asmatrix(hpz).transpose()))
-        tcrosshi = (dalt + hpz) / -dvs
-        tcrosslo = (dalt - hpz) / -dvs
-        tinver = np.minimum(tcrosshi, tcrosslo)
-        toutver = np.maximum(tcrosshi, tcrosslo)
+        hpz = np.maximum(hpz, hpz[:, np.newaxis], out=dtinhor)
+        # Loss of separation: within both the horizontal and vertical protected zone
+        swlos &= np.less(np.abs(dalt, out=mat('dlat')), hpz, out=noconf)
+        tcrosshi = np.add(dalt, hpz, out=mat('dlat'))
+        tcrosshi /= dvs
+        tcrosslo = np.subtract(dalt, hpz, out=mat('dlon'))
+        tcrosslo /= dvs
+        tinver = np.minimum(tcrosshi, tcrosslo, out=dvs)
+        toutver = np.maximum(tcrosshi, tcrosslo, out=tcrosshi)
 
         # Combine vertical and horizontal conflict----------------------------------
-        tinconf = np.maximum(tinver, tinhor)
-        toutconf = np.minimum(toutver, touthor)
+        tinconf = np.maximum(tinver, tinhor, out=tinhor)
+        toutconf = np.minimum(toutver, touthor, out=touthor)
 
-        swconfl = np.array(swhorconf * (tinconf <= toutconf) * (toutconf > 0.0) *
-                           np.asarray(tinconf < np.asmatrix(dtlookahead).T) * (1.0 - I), dtype=bool)
+        swconfl = swhorconf
+        swconfl &= np.less_equal(tinconf, toutconf, out=noconf)
+        swconfl &= np.greater(toutconf, 0.0, out=noconf)
+        swconfl &= np.less(tinconf, np.reshape(dtlookahead, (n, 1)), out=noconf)
+        swconfl.reshape(-1)[diag] = False
 
         # --------------------------------------------------------------------------
         # Update conflict lists
         # --------------------------------------------------------------------------
         # Ownship conflict flag and max tCPA
         inconf = np.any(swconfl, 1)
-        tcpamax = np.max(tcpa * swconfl, 1)
+        tcpamax = np.max(np.multiply(tcpa, swconfl, out=mat('dlon')), 1)
 
-        # Select conflicting pairs: each a/c gets their own record
-        confpairs = [(ownship.id[i], ownship.id[j]) for i, j in zip(*np.where(swconfl))]
-        swlos = (dist < rpz) * (np.abs(dalt) < hpz)
-        lospairs = [(ownship.id[i], ownship.id[j]) for i, j in zip(*np.where(swlos))]
+        # Select conflicting pairs: each a/c gets their own (ownship, intruder) record
+        confpairs = np.argwhere(swconfl).astype(np.int32)
+        lospairs = np.argwhere(swlos).astype(np.int32)
 
         return confpairs, lospairs, inconf, tcpamax, \
             qdr[swconfl], dist[swconfl], np.sqrt(dcpa2[swconfl]), \
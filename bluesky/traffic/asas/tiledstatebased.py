@@ -0,0 +1,122 @@
+''' Multi-threaded, tiled state-based conflict detection. '''
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import bluesky as bs
+from bluesky import stack
+from bluesky.traffic.asas.statebased import StateBased
+from bluesky.traffic.asas.gridstatebased import candidate_pairs, pairconflicts, collectconflicts
+
+
+bs.settings.set_variable_defaults(asas_cdblocksize=500000, asas_cdthreads=0)
+
+
+def tiles(ntraf, nint, blocksize):
+    ''' Generate (i, j) index arrays of blocks of ownship rows against all
+        intruders, with at most about blocksize pairs per block. '''
+    rows = max(1, blocksize // max(1, nint))
+    for start in range(0, ntraf, rows):
+        stop = min(ntraf, start + rows)
+        i = np.repeat(np.arange(start, stop), nint)
+        j = np.tile(np.arange(nint), stop - start)
+        keep = i != j
+        yield i[keep], j[keep]
+
+
+def candidate_tiles(i, j, blocksize):
+    ''' Split broad phase candidate pairs in row-major order into blocks
+        of at most blocksize pairs. '''
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    for start in range(0, len(i), blocksize):
+        yield i[start:start + blocksize], j[start:start + blocksize]
+
+
+class TiledStateBased(StateBased):
+    ''' State-based conflict detection that evaluates the aircraft pairs in
+        blocks of bounded size, in parallel on a pool of threads. Blocks
+        consist of either the candidate pairs of the grid broad phase, or
+        of ownship rows against all intruders. Gives the same results as
+        StateBased. '''
+    def __init__(self):
+        super().__init__()
+        # [-] Maximum number of aircraft pairs evaluated per block
+        self.blocksize = bs.settings.asas_cdblocksize
+        # [-] Number of detection threads, 0 means one per cpu core
+        self.nthreads = bs.settings.asas_cdthreads
+        # [-] Switch to use the grid broad phase to select candidate pairs
+        self.swbroadphase = True
+        self.pool = None
+        self.poolsize = 0
+
+    def reset(self):
+        super().reset()
+        self.blocksize = bs.settings.asas_cdblocksize
+        self.nthreads = bs.settings.asas_cdthreads
+        self.swbroadphase = True
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.pool = None
+        self.poolsize = 0
+
+    def getpool(self):
+        ''' Return the thread pool, (re)creating it when the number of
+            threads has changed. '''
+        nthreads = self.nthreads or os.cpu_count() or 1
+        if self.pool is None or self.poolsize != nthreads:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = ThreadPoolExecutor(nthreads, thread_name_prefix='cd')
+            self.poolsize = nthreads
+        return self.pool
+
+    @stack.command(name='CDTILES')
+    def settiles(self, blocksize: int = None, nthreads: int = None, broadphase: 'onoff' = None):
+        ''' Set the maximum number of aircraft pairs per detection block,
+            the number of detection threads (0 = one per core), and whether
+            the grid broad phase is used. '''
+        if blocksize is None:
+            return True, 'CDTILES [BLOCKSIZE] [NTHREADS] [BROADPHASE ON/OFF]' + \
+                f'\nCurrent block size is {self.blocksize} pairs, using ' + \
+                f'{self.nthreads or os.cpu_count()} threads, broad phase is ' + \
+                ('ON' if self.swbroadphase else 'OFF')
+        if blocksize < 1 or (nthreads is not None and nthreads < 0):
+            return False, 'CDTILES: block size should be at least 1, number of threads at least 0'
+        self.blocksize = blocksize
+        if nthreads is not None:
+            self.nthreads = nthreads
+        if broadphase is not None:
+            self.swbroadphase = broadphase
+        return True
+
+    def detect(self, ownship, intruder, rpz, hpz, dtlookahead):
+        ''' Conflict detection between ownship (traf) and intruder (traf/adsb).'''
+        if ownship.ntraf == 0:
+            return super().detect(ownship, intruder, rpz, hpz, dtlookahead)
+        pairs = candidate_pairs(ownship, intruder, rpz, hpz, dtlookahead) \
+            if self.swbroadphase else None
+        if pairs is None:
+            blocks = tiles(ownship.ntraf, intruder.ntraf, self.blocksize)
+        else:
+            blocks = candidate_tiles(*pairs, self.blocksize)
+
+        def detectblock(block):
+            return pairconflicts(ownship, intruder, rpz, hpz, dtlookahead, *block)
+
+        # Blocks are submitted as threads become available, so that only a
+        # few blocks are in memory at the same time. Results are collected
+        # in block order, which keeps the pairs in row-major order.
+        pool = self.getpool()
+        pending = deque()
+        results = []
+        for block in blocks:
+            if len(pending) >= 2 * self.poolsize:
+                results.append(pending.popleft().result())
+            pending.append(pool.submit(detectblock, block))
+        results.extend(future.result() for future in pending)
+        if not results:
+            empty = np.array([], dtype=np.int64)
+            results.append(detectblock((empty, empty)))
+        return collectconflicts(ownship.ntraf,
+            *(np.concatenate(field) for field in zip(*results)))
@@ -8,10 +8,11 @@ except ImportError:
     from collections import Collection
 import bluesky as bs
 from bluesky import stack
+from bluesky.stack import recorder
 from bluesky.tools import geo
 from bluesky.tools.misc import degto180
 from bluesky.tools.position import txt2pos
-from bluesky.tools.aero import ft, nm, fpm, vcasormach2tas, vcas2tas, tas2cas, cas2tas, g0
+from bluesky.tools.aero import ft, kts, nm, fpm, vcasormach2tas, vcas2tas, tas2cas, cas2tas, g0
 from bluesky.core import Entity, timed_function
 from .route import Route
 
@@ -738,6 +739,45 @@ class Autopilot(Entity, replaceable=True):
         bs.traf.swvnavspd[idx]   = False
         return True
 
+    def set_targets(self, idx, hdg=None, casmach=None, alt=None):
+        ''' Select autopilot targets for one or more aircraft at once.
+
+            Array equivalent of the HDG, SPD and ALT stack commands, for
+            plugins that control many aircraft every update. Targets are
+            applied directly, without formatting and parsing stack text.
+            When SAVEIC recording is on, the equivalent commands are still
+            written to the scenario file.
+
+            Arguments:
+            - idx: aircraft index, or array of indices
+            - hdg: selected heading(s) [deg, true]
+            - casmach: selected speed(s) [m/s CAS, or Mach]
+            - alt: selected altitude(s) [m]
+        '''
+        idx = np.atleast_1d(idx)
+        if hdg is not None:
+            hdg = np.broadcast_to(hdg, idx.shape)
+            self.selhdgcmd(idx, hdg)
+        if casmach is not None:
+            casmach = np.broadcast_to(casmach, idx.shape)
+            self.selspdcmd(idx, casmach)
+        if alt is not None:
+            alt = np.broadcast_to(alt, idx.shape)
+            self.selaltcmd(idx, alt)
+
+        # Only construct command text when a recording is running
+        if recorder.savefile is not None:
+            for i, acidx in enumerate(idx):
+                acid = bs.traf.id[acidx]
+                if hdg is not None:
+                    recorder.savecmd('HDG', f'HDG {acid} {hdg[i]}')
+                if casmach is not None:
+                    spd = casmach[i] if 0.1 < casmach[i] < 1.0 else casmach[i] / kts
+                    recorder.savecmd('SPD', f'SPD {acid} {spd}')
+                if alt is not None:
+                    recorder.savecmd('ALT', f'ALT {acid} {alt[i] / ft}')
+        return True
+
     @stack.command(name='DEST')
     def setdest(self, acidx: 'acid', wpname:'wpt' = None):
         ''' DEST acid, latlon/airport
@@ -1424,8 +1424,8 @@ class Metric():
             if bs.traf.selvs[i] <=0 and bs.traf.selspd[i] < 10.:
                 deleteAC.append(bs.traf.id[i])
 
-        for i in range(0,len(deleteAC)):
-            bs.traf.delete(deleteAC[i])
+        if deleteAC:
+            bs.traf.delete(bs.traf.id2idx(deleteAC))
 
         # Heartbeat for test
         self.write(bs.sim.simt,"NTRAF;"+str(bs.traf.ntraf))
@@ -54,10 +54,22 @@ class OpenAP(PerfBase):
             self.mmo = np.array([])
 
     def create(self, n=1):
-        # cautious! considering multiple created aircraft with same type
         super().create(n)
 
-        actype = bs.traf.type[-1].upper()
+        # Initialize the coefficients once for each group of aircraft with
+        # the same type, instead of for each aircraft
+        actypes = np.array([actype.upper() for actype in bs.traf.type[-n:]])
+        start = len(self.actype) - n
+        for actype in np.unique(actypes):
+            self.settype(start + np.flatnonzero(actypes == actype), actype)
+
+        # Update envelope speed limits
+        mask = np.zeros_like(self.actype, dtype=bool)
+        mask[-n:] = True
+        self.vmin[-n:], self.vmax[-n:] = self._construct_v_limits(mask)
+
+    def settype(self, idx, actype):
+        """Initialize the performance parameters of aircraft idx of type actype"""
 
         # Check synonym file if not in open ap actypes
         if (actype not in self.coeff.actypes_rotor) and (
@@ -72,13 +84,13 @@ class OpenAP(PerfBase):
         # initialize aircraft / engine performance parameters
         # check fixwing or rotor, default to fixwing
         if actype in self.coeff.actypes_rotor:
-            self.lifttype[-n:] = coeff.LIFT_ROTOR
-            self.mass[-n:] = 0.5 * (
+            self.lifttype[idx] = coeff.LIFT_ROTOR
+            self.mass[idx] = 0.5 * (
                 self.coeff.acs_rotor[actype]["oew"]
                 + self.coeff.acs_rotor[actype]["mtow"]
             )
-            self.engnum[-n:] = int(self.coeff.acs_rotor[actype]["n_engines"])
-            self.engpower[-n:] = self.coeff.acs_rotor[actype]["engines"][0][1]
+            self.engnum[idx] = int(self.coeff.acs_rotor[actype]["n_engines"])
+            self.engpower[idx] = self.coeff.acs_rotor[actype]["engines"][0][1]
 
         else:
             # convert to known aircraft type
@@ -95,84 +107,79 @@ class OpenAP(PerfBase):
                 e["ff_idl"], e["ff_app"], e["ff_co"], e["ff_to"]
             )
 
-            self.lifttype[-n:] = coeff.LIFT_FIXWING
+            self.lifttype[idx] = coeff.LIFT_FIXWING
 
-            self.Sref[-n:] = self.coeff.acs_fixwing[actype]["wa"]
-            self.mass[-n:] = 0.5 * (
+            self.Sref[idx] = self.coeff.acs_fixwing[actype]["wa"]
+            self.mass[idx] = 0.5 * (
                 self.coeff.acs_fixwing[actype]["oew"]
                 + self.coeff.acs_fixwing[actype]["mtow"]
             )
 
-            self.engnum[-n:] = int(self.coeff.acs_fixwing[actype]["n_engines"])
+            self.engnum[idx] = int(self.coeff.acs_fixwing[actype]["n_engines"])
 
-            self.ff_coeff_a[-n:] = coeff_a
-            self.ff_coeff_b[-n:] = coeff_b
-            self.ff_coeff_c[-n:] = coeff_c
+            self.ff_coeff_a[idx] = coeff_a
+            self.ff_coeff_b[idx] = coeff_b
+            self.ff_coeff_c[idx] = coeff_c
 
             all_ac_engs = list(self.coeff.acs_fixwing[actype]["engines"].keys())
-            self.engthrmax[-n:] = self.coeff.acs_fixwing[actype]["engines"][
+            self.engthrmax[idx] = self.coeff.acs_fixwing[actype]["engines"][
                 all_ac_engs[0]
             ]["thr"]
-            self.engbpr[-n:] = self.coeff.acs_fixwing[actype]["engines"][
+            self.engbpr[idx] = self.coeff.acs_fixwing[actype]["engines"][
                 all_ac_engs[0]
             ]["bpr"]
 
         # init type specific coefficients for flight envelops
         if actype in self.coeff.limits_rotor.keys():  # rotorcraft
-            self.vmin[-n:] = self.coeff.limits_rotor[actype]["vmin"]
-            self.vmax[-n:] = self.coeff.limits_rotor[actype]["vmax"]
-            self.vsmin[-n:] = self.coeff.limits_rotor[actype]["vsmin"]
-            self.vsmax[-n:] = self.coeff.limits_rotor[actype]["vsmax"]
-            self.hmax[-n:] = self.coeff.limits_rotor[actype]["hmax"]
-
-            self.vsmin[-n:] = self.coeff.limits_rotor[actype]["vsmin"]
-            self.vsmax[-n:] = self.coeff.limits_rotor[actype]["vsmax"]
-            self.hmax[-n:] = self.coeff.limits_rotor[actype]["hmax"]
-
-            self.cd0_clean[-n:] = np.nan
-            self.k_clean[-n:] = np.nan
-            self.cd0_to[-n:] = np.nan
-            self.k_to[-n:] = np.nan
-            self.cd0_ld[-n:] = np.nan
-            self.k_ld[-n:] = np.nan
-            self.delta_cd_gear[-n:] = np.nan
+            self.vmin[idx] = self.coeff.limits_rotor[actype]["vmin"]
+            self.vmax[idx] = self.coeff.limits_rotor[actype]["vmax"]
+            self.vsmin[idx] = self.coeff.limits_rotor[actype]["vsmin"]
+            self.vsmax[idx] = self.coeff.limits_rotor[actype]["vsmax"]
+            self.hmax[idx] = self.coeff.limits_rotor[actype]["hmax"]
+
+            self.vsmin[idx] = self.coeff.limits_rotor[actype]["vsmin"]
+            self.vsmax[idx] = self.coeff.limits_rotor[actype]["vsmax"]
+            self.hmax[idx] = self.coeff.limits_rotor[actype]["hmax"]
+
+            self.cd0_clean[idx] = np.nan
+            self.k_clean[idx] = np.nan
+            self.cd0_to[idx] = np.nan
+            self.k_to[idx] = np.nan
+            self.cd0_ld[idx] = np.nan
+            self.k_ld[idx] = np.nan
+            self.delta_cd_gear[idx] = np.nan
 
         else:
             if actype not in self.coeff.limits_fixwing.keys():
                 actype = "B744"
 
-            self.vminic[-n:] = self.coeff.limits_fixwing[actype]["vminic"]
-            self.vminer[-n:] = self.coeff.limits_fixwing[actype]["vminer"]
-            self.vminap[-n:] = self.coeff.limits_fixwing[actype]["vminap"]
-            self.vmaxic[-n:] = self.coeff.limits_fixwing[actype]["vmaxic"]
-            self.vmaxer[-n:] = self.coeff.limits_fixwing[actype]["vmaxer"]
-            self.vmaxap[-n:] = self.coeff.limits_fixwing[actype]["vmaxap"]
-
-            self.vsmin[-n:] = self.coeff.limits_fixwing[actype]["vsmin"]
-            self.vsmax[-n:] = self.coeff.limits_fixwing[actype]["vsmax"]
-            self.hmax[-n:] = self.coeff.limits_fixwing[actype]["hmax"]
-            self.axmax[-n:] = self.coeff.limits_fixwing[actype]["axmax"]
-            self.vminto[-n:] = self.coeff.limits_fixwing[actype]["vminto"]
-            self.hcross[-n:] = self.coeff.limits_fixwing[actype]["crosscl"]
-            self.mmo[-n:] = self.coeff.limits_fixwing[actype]["mmo"]
-
-            self.cd0_clean[-n:] = self.coeff.dragpolar_fixwing[actype]["cd0_clean"]
-            self.k_clean[-n:] = self.coeff.dragpolar_fixwing[actype]["k_clean"]
-            self.cd0_to[-n:] = self.coeff.dragpolar_fixwing[actype]["cd0_to"]
-            self.k_to[-n:] = self.coeff.dragpolar_fixwing[actype]["k_to"]
-            self.cd0_ld[-n:] = self.coeff.dragpolar_fixwing[actype]["cd0_ld"]
-            self.k_ld[-n:] = self.coeff.dragpolar_fixwing[actype]["k_ld"]
-            self.delta_cd_gear[-n:] = self.coeff.dragpolar_fixwing[actype][
+            self.vminic[idx] = self.coeff.limits_fixwing[actype]["vminic"]
+            self.vminer[idx] = self.coeff.limits_fixwing[actype]["vminer"]
+            self.vminap[idx] = self.coeff.limits_fixwing[actype]["vminap"]
+            self.vmaxic[idx] = self.coeff.limits_fixwing[actype]["vmaxic"]
+            self.vmaxer[idx] = self.coeff.limits_fixwing[actype]["vmaxer"]
+            self.vmaxap[idx] = self.coeff.limits_fixwing[actype]["vmaxap"]
+
+            self.vsmin[idx] = self.coeff.limits_fixwing[actype]["vsmin"]
+            self.vsmax[idx] = self.coeff.limits_fixwing[actype]["vsmax"]
+            self.hmax[idx] = self.coeff.limits_fixwing[actype]["hmax"]
+            self.axmax[idx] = self.coeff.limits_fixwing[actype]["axmax"]
+            self.vminto[idx] = self.coeff.limits_fixwing[actype]["vminto"]
+            self.hcross[idx] = self.coeff.limits_fixwing[actype]["crosscl"]
+            self.mmo[idx] = self.coeff.limits_fixwing[actype]["mmo"]
+
+            self.cd0_clean[idx] = self.coeff.dragpolar_fixwing[actype]["cd0_clean"]
+            self.k_clean[idx] = self.coeff.dragpolar_fixwing[actype]["k_clean"]
+            self.cd0_to[idx] = self.coeff.dragpolar_fixwing[actype]["cd0_to"]
+            self.k_to[idx] = self.coeff.dragpolar_fixwing[actype]["k_to"]
+            self.cd0_ld[idx] = self.coeff.dragpolar_fixwing[actype]["cd0_ld"]
+            self.k_ld[idx] = self.coeff.dragpolar_fixwing[actype]["k_ld"]
+            self.delta_cd_gear[idx] = self.coeff.dragpolar_fixwing[actype][
                 "delta_cd_gear"
             ]
 
         # append update actypes, after removing unknown types
-        self.actype[-n:] = [actype] * n
-
-        # Update envelope speed limits
-        mask = np.zeros_like(self.actype, dtype=bool)
-        mask[-n:] = True
-        self.vmin[-n:], self.vmax[-n:] = self._construct_v_limits(mask)
+        self.actype[idx] = actype
 
     def update(self, dt):
         """Periodic update function for performance calculations."""
@@ -1,16 +1,11 @@
 """ BlueSky traffic implementation."""
 from __future__ import print_function
-try:
-    from collections.abc import Collection
-except ImportError:
-    # In python <3.3 collections.abc doesn't exist
-    from collections import Collection
 from math import *
 from random import randint
 import numpy as np
 
 import bluesky as bs
-from bluesky.core import Entity, timed_function
+from bluesky.core import Entity, Signal, timed_function
 from bluesky.stack import refdata
 from bluesky.stack.recorder import savecmd
 from bluesky.tools import geo
@@ -34,6 +29,10 @@ from .performance.perfbase import PerfBase
 # Register settings defaults
 bs.settings.set_variable_defaults(performance_model='openap', asas_dt=1.0)
 
+# Emitted after aircraft are deleted, with the sorted indices of the deleted
+# aircraft, and the new index of each old index (-1 for deleted aircraft)
+aircraft_deleted = Signal('aircraft_deleted')
+
 # if bs.settings.performance_model == 'bada':
 #     try:
 #         print('Using BADA Performance model')
@@ -62,6 +61,7 @@ class Traffic(Entity):
         deletall()           : delete all traffic
         update(sim)          : do a numerical integration step
         id2idx(name)         : return index in traffic database of given call sign
+        uid2idx(uid)         : return index in traffic database of given unique id
         engchange(i,engtype) : change engine type of an aircraft
         setnoise(A)          : Add turbulence
     Members: see create
@@ -76,6 +76,19 @@ class Traffic(Entity):
 
         self.ntraf = 0
 
+        # Next unique aircraft id. Uids are never reused, and because new
+        # aircraft are appended and deletion keeps the order, traf.uid is
+        # always sorted
+        self.nextuid = 0
+
+        # Uids of the aircraft with each callsign, in order of creation.
+        # Callsigns are normally unique, but creation of lists of aircraft
+        # does not check this. Lookup of a callsign returns the first one.
+        self.idmap = dict()
+        # Sorted callsigns and their indices, for lookup of arrays of
+        # callsigns. Built when needed, None when outdated
+        self.idsorted = None
+
         self.cond = Condition()  # Conditional commands list
         self.wind = WindSim()
         self.turbulence = Turbulence()
@@ -84,10 +97,18 @@ class Traffic(Entity):
         # Default commands issued for an aircraft after creation
         self.crecmdlist = []
 
+        # Aircraft of CRE commands that still have to be created, by callsign.
+        # The stack creates consecutive CRE commands as one batch
+        self.crebatch = dict()
+
+        # Uids of the aircraft that are deleted as one batch by flushdelete
+        self.deluids = []
+
         with self.settrafarrays():
             # Aircraft Info
             self.id      = []  # identifier (string)
             self.type    = []  # aircaft type (string)
+            self.uid     = np.array([], dtype=np.int64)  # unique id, survives deletes of other aircraft
 
             # Positions
             self.lat     = np.array([])  # latitude [deg]
@@ -165,6 +186,11 @@ class Traffic(Entity):
         ''' Clear all traffic data upon simulation reset. '''
         # Some child reset functions depend on a correct value of self.ntraf
         self.ntraf = 0
+        self.nextuid = 0
+        self.idmap = dict()
+        self.idsorted = None
+        self.crebatch = dict()
+        self.deluids = []
         # This ensures that the traffic arrays (which size is dynamic)
         # are all reset as well, so all lat,lon,sdp etc but also objects adsb
         super().reset()
@@ -203,13 +229,18 @@ class Traffic(Entity):
 
 
     def cre(self, acid, actype="B744", aclat=52., aclon=4., achdg=None, acalt=0, acspd=0):
-        """ Create one or more aircraft. """
+        """ Create one or more aircraft.
+
+            To create n aircraft at once, acid is a list of n callsigns, and
+            the other arguments can be lists or arrays of n values, or single
+            values for all aircraft. All children are extended once for the
+            whole batch. """
         # Determine number of aircraft to create from array length of acid
         n = 1 if isinstance(acid, str) else len(acid)
 
         if isinstance(acid, str):
             # Check if not already exist
-            if self.id.count(acid.upper()) > 0:
+            if acid.upper() in self.idmap:
                 return False, acid + " already exists."  # already exists do nothing
             acid = n * [acid]
 
@@ -220,21 +251,25 @@ class Traffic(Entity):
         if isinstance(actype, str):
             actype = n * [actype]
 
-        if isinstance(aclat, (float, int)):
-            aclat = np.array(n * [aclat])
-
-        if isinstance(aclon, (float, int)):
-            aclon = np.array(n * [aclon])
+        aclat = np.full(n, aclat, dtype=float)
+        aclon = np.full(n, aclon, dtype=float)
 
         # Limit longitude to [-180.0, 180.0]
         aclon[aclon > 180.0] -= 360.0
         aclon[aclon < -180.0] += 360.0
 
-        achdg = (refdata.hdg or 0.0) if achdg is None else achdg
+        achdg = np.full(n, (refdata.hdg or 0.0) if achdg is None else achdg, dtype=float)
+        acalt = np.full(n, acalt, dtype=float)
+        acspd = np.full(n, acspd, dtype=float)
 
         # Aircraft Info
         self.id[-n:]   = acid
         self.type[-n:] = actype
+        self.uid[-n:]  = np.arange(self.nextuid, self.nextuid + n)
+        for acidi, uid in zip(acid, range(self.nextuid, self.nextuid + n)):
+            self.idmap.setdefault(acidi, []).append(uid)
+        self.idsorted = None
+        self.nextuid  += n
 
         # Positions
         self.lat[-n:]  = aclat
@@ -303,6 +338,24 @@ class Traffic(Entity):
 
         return True
 
+    def addcre(self, acid, actype="B744", aclat=52., aclon=4., achdg=None, acalt=0, acspd=0):
+        """ CRE command: add an aircraft to the batch that is created by
+            flushcre, before the stack processes the next other command. """
+        if acid.upper() in self.idmap or acid.upper() in self.crebatch:
+            return False, acid + " already exists."
+        achdg = (refdata.hdg or 0.0) if achdg is None else achdg
+        self.crebatch[acid.upper()] = (actype, aclat, aclon, achdg, acalt, acspd)
+        return True
+
+    def flushcre(self):
+        """ Create the batch of aircraft of the CRE commands so far. """
+        if not self.crebatch:
+            return
+        acid = list(self.crebatch)
+        actype, aclat, aclon, achdg, acalt, acspd = zip(*self.crebatch.values())
+        self.crebatch = dict()
+        self.cre(acid, list(actype), aclat, aclon, achdg, acalt, acspd)
+
     def creconfs(self, acid, actype, targetidx, dpsi, dcpa, tlosh, dH=None, tlosv=None, spd=None):
         ''' Create an aircraft in conflict with target aircraft.
 
@@ -378,19 +431,61 @@ class Traffic(Entity):
         self.vs[-1] = acvs
 
     def delete(self, idx):
-        """Delete an aircraft"""
-        # If this is a multiple delete, sort first for list delete
-        # (which will use list in reverse order to avoid index confusion)
-        if isinstance(idx, Collection):
-            idx = np.sort(idx)
+        """Delete an aircraft, or a list or array of aircraft at once"""
+        # Sorted and unique indices, so that all traffic arrays and lists
+        # are compacted once
+        idx = self._delindices(idx)
+
+        # Remove the deleted aircraft from the callsign map
+        for i in idx:
+            uids = self.idmap[self.id[i]]
+            uids.remove(self.uid[i])
+            if not uids:
+                del self.idmap[self.id[i]]
+        self.idsorted = None
+
+        keep = np.ones(self.ntraf, dtype=bool)
+        keep[idx] = False
 
         # Call the actual delete function
         super().delete(idx)
 
         # Update number of aircraft
         self.ntraf = len(self.lat)
+
+        # Notify the subscribers that hold aircraft indices
+        if aircraft_deleted.get_subs():
+            aircraft_deleted.emit(idx, np.where(keep, np.cumsum(keep) - 1, -1))
         return True
 
+    def deferdelete(self, idx):
+        """ DEL command: mark aircraft for deletion by flushdelete, at the end
+            of the timestep or before the stack processes the next other
+            command. Until then, the indices of all aircraft remain valid. """
+        self.deluids.extend(self.uid[self._delindices(idx)])
+        return True
+
+    def _delindices(self, idx):
+        """ Return the sorted, unique indices of the aircraft idx to delete.
+            Negative indices are rejected instead of counting from the end,
+            because id2idx returns -1 for aircraft that do not exist. """
+        idx = np.unique(np.atleast_1d(idx).astype(np.int64))
+        if len(idx) > 0 and (idx[0] < 0 or idx[-1] >= self.ntraf):
+            raise IndexError(f'Cannot delete aircraft index {idx[0] if idx[0] < 0 else idx[-1]}, '
+                             f'indices should be between 0 and {self.ntraf - 1}')
+        return idx
+
+    def flushdelete(self):
+        """ Delete the aircraft marked by deferdelete as one batch. """
+        if not self.deluids:
+            return
+        idx = self.uid2idx(self.deluids)
+        self.deluids = []
+        # Aircraft can already have been deleted directly
+        idx = idx[idx >= 0]
+        if len(idx) > 0:
+            self.delete(idx)
+
     def update(self):
         # Update only if there is traffic ---------------------
         if self.ntraf == 0:
@@ -431,9 +526,9 @@ class Traffic(Entity):
 
     @timed_function(name='asas', dt=bs.settings.asas_dt, manual=True)
     def update_asas(self):
-        # Conflict detection and resolution
-        self.cd.update(self, self)
-        self.cr.update(self.cd, self, self)
+        # Conflict detection and resolution, with the ADS-B data of the intruders
+        self.cd.update(self, self.adsb)
+        self.cr.update(self.cd, self, self.adsb)
 
     def update_airspeed(self):
         # Compute horizontal acceleration
@@ -510,22 +605,58 @@ class Traffic(Entity):
         self.lon = self.lon + np.degrees(bs.sim.simdt * self.gseast / self.coslat / Rearth)
         self.distflown += self.gs * bs.sim.simdt
 
+    def uid2idx(self, uid):
+        """Find the indices of aircraft uids, -1 for aircraft that no longer exist"""
+        uid = np.asarray(uid)
+        idx = np.minimum(np.searchsorted(self.uid, uid), max(self.ntraf - 1, 0))
+        found = self.uid[idx] == uid if self.ntraf else np.zeros(uid.shape, dtype=bool)
+        return np.where(found, idx, -1)
+
     def id2idx(self, acid):
-        """Find index of aircraft id"""
+        """Find index of aircraft id, -1 for ids that don't exist"""
+        if isinstance(acid, np.ndarray):
+            # Vectorized lookup of a numpy array of id's in the sorted ids
+            if self.idsorted is None:
+                order = np.argsort(np.array(self.id, dtype=str), kind='stable')
+                self.idsorted = np.array(self.id, dtype=str)[order], order
+            ids, order = self.idsorted
+            pos = np.minimum(np.searchsorted(ids, acid), max(self.ntraf - 1, 0))
+            found = ids[pos] == acid if self.ntraf else np.zeros(acid.shape, dtype=bool)
+            return np.where(found, order[pos] if self.ntraf else 0, -1)
+
         if not isinstance(acid, str):
             # id2idx is called for multiple id's
-            # Fast way of finding indices of all ACID's in a given list
-            tmp = dict((v, i) for i, v in enumerate(self.id))
-            return [tmp.get(acidi, -1) for acidi in acid]
-        else:
-             # Catch last created id (* or # symbol)
-            if acid in ('#', '*'):
-                return self.ntraf - 1
-
-            try:
-                return self.id.index(acid.upper())
-            except:
-                return -1
+            return [self._idx_of(acidi) for acidi in acid]
+
+        # Catch last created id (* or # symbol)
+        if acid in ('#', '*'):
+            return self.ntraf - 1
+        return self._idx_of(acid.upper())
+
+    def _idx_of(self, acid):
+        """Find index of a single aircraft id, without conversion to upper case"""
+        uids = self.idmap.get(acid)
+        # Uids are sorted, so the index follows from a binary search
+        return -1 if uids is None else int(np.searchsorted(self.uid, uids[0]))
+
+    def rename(self, idx, newid):
+        """Rename an aircraft"""
+        if not isinstance(idx, (int, np.integer)):
+            return False, "RENAME: only a single aircraft can be renamed"
+        if newid in self.idmap:
+            return False, newid + " already exists."
+        oldid = self.id[idx]
+        uids = self.idmap[oldid]
+        uids.remove(self.uid[idx])
+        if not uids:
+            del self.idmap[oldid]
+        self.idmap[newid] = [int(self.uid[idx])]
+        self.id[idx] = newid
+        self.idsorted = None
+
+        # Conditional commands are stored by callsign
+        self.cond.renameac(oldid, newid)
+        return True
 
     def setnoise(self, noise=None):
         """Noise (turbulence, ADBS-transmission noise, ADSB-truncated effect)"""
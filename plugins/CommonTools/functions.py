@@ -1,5 +1,14 @@
 import numpy as np
 
+def bound_angle_positive_negative_180(angle_deg):
+    """
+    angle_deg: angle or array of angles, in degrees, within [-540, 540]
+
+    Returns the angles mapped to the interval [-180,180], in degrees
+    """
+    return np.where(angle_deg > 180, angle_deg - 360,
+                    np.where(angle_deg < -180, angle_deg + 360, angle_deg))
+
 def get_point_at_distance(lat1, lon1, d, bearing, R=6371):
     """
     lat: latitude of the reference point, in degrees
@@ -0,0 +1,147 @@
+from typing import Dict, Tuple
+from pathlib import Path
+import json
+import numpy as np
+
+class MemmapReplayBuffer:
+    """ Disk-backed replay buffer with the same interface as ReplayBuffer
+
+    All storage lives in np.memmap backed .npy files inside directory, so
+    the buffer size is bounded by disk instead of RAM. Observations are
+    stored once as a ring of frames: consecutive steps of an episode occupy
+    consecutive frames, and the next_obs of a transition is the frame
+    following its obs frame. A new episode is started whenever the stored
+    obs does not match the next_obs of the previous transition (or that
+    transition was done), which costs one extra frame per episode.
+
+    checkpoint() flushes the files and writes the pointers to state.json;
+    constructing the buffer again with resume=True reopens the files in
+    place, without pickling.
+    """
+
+    def __init__(self,
+                 obs_dim: int,
+                 action_dim: int,
+                 n_agents: int,
+                 size: int,
+                 directory: str,
+                 batch_size: int = 1024,
+                 frame_size: int = None,
+                 resume: bool = False):
+        """
+        Parameters
+        __________
+        obs_dim, action_dim, n_agents: int
+            shape of a single transition
+        size: int
+            maximum number of stored transitions
+        directory: str
+            folder holding the memory mapped files
+        batch_size: int
+            number of transitions returned by sample_batch
+        frame_size: int
+            number of observation frames in the ring, defaults to
+            size + size // 10 + 2 (episodes of at least 10 steps). When the
+            ring wraps, the oldest transitions are evicted.
+        resume: bool
+            reopen an existing buffer from directory
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size, self.batch_size = size, batch_size
+        self.frame_size = frame_size or size + size // 10 + 2
+        if self.frame_size < 2:
+            raise ValueError('MemmapReplayBuffer needs room for at least two frames')
+
+        shapes = dict(frames = ((self.frame_size, n_agents, obs_dim), np.float32),
+                      acts = ((size, n_agents, action_dim), np.float32),
+                      rews = ((size, n_agents), np.float32),
+                      done = ((size,), np.float32),
+                      obs_idx = ((size,), np.int64))
+
+        state_file = self.directory / 'state.json'
+        if resume and state_file.exists():
+            state = json.loads(state_file.read_text())
+            self.ptr, self.size = state['ptr'], state['size']
+            self.frame_ptr, self.new_episode = state['frame_ptr'], state['new_episode']
+            mode = 'r+'
+        else:
+            self.ptr, self.size = 0, 0
+            self.frame_ptr, self.new_episode = 0, True
+            mode = 'w+'
+
+        for name, (shape, dtype) in shapes.items():
+            fname = self.directory / f'{name}.npy'
+            if mode == 'r+':
+                buf = np.load(fname, mmap_mode='r+')
+                if buf.shape != shape or buf.dtype != dtype:
+                    raise ValueError(f'{fname} does not match the buffer dimensions')
+            else:
+                buf = np.lib.format.open_memmap(fname, mode='w+', dtype=dtype, shape=shape)
+            setattr(self, f'{name}_buf', buf)
+
+    def _first(self) -> int:
+        """ Index of the oldest stored transition """
+        return (self.ptr - self.size) % self.max_size
+
+    def _write_frame(self, obs: np.ndarray) -> int:
+        """ Write obs to the next frame of the ring, evicting the oldest
+        transitions that still refer to that frame """
+        frame = self.frame_ptr
+        while self.size > 0:
+            first_obs = self.obs_idx_buf[self._first()]
+            if frame != first_obs and frame != (first_obs + 1) % self.frame_size:
+                break
+            self.size -= 1
+        self.frames_buf[frame] = obs
+        self.frame_ptr = (frame + 1) % self.frame_size
+        return frame
+
+    def store(
+        self,
+        obs: np.ndarray,
+        act: np.ndarray,
+        rew: np.ndarray,
+        next_obs: np.ndarray,
+        done: bool,
+    ) -> Tuple[np.ndarray, np.ndarray, float, np.ndarray, bool]:
+        """ Store transition """
+        last_frame = (self.frame_ptr - 1) % self.frame_size
+        if self.new_episode or not np.array_equal(self.frames_buf[last_frame], obs):
+            last_frame = self._write_frame(obs)
+
+        # The transition slot is reused, drop the oldest one before the frame
+        # write so eviction only considers transitions that remain
+        if self.size == self.max_size:
+            self.size -= 1
+        self._write_frame(next_obs)
+
+        self.obs_idx_buf[self.ptr] = last_frame
+        self.acts_buf[self.ptr] = act
+        self.rews_buf[self.ptr] = rew
+        self.done_buf[self.ptr] = done
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size += 1
+        self.new_episode = bool(done)
+
+    def sample_batch(self, batch_size: int = None) -> Dict[str, np.ndarray]:
+        """ Sample from storage, batch_size defaults to self.batch_size """
+        idx = np.random.choice(self.size, size=batch_size or self.batch_size, replace=False)
+        idx = (self._first() + idx) % self.max_size
+        obs_idx = self.obs_idx_buf[idx]
+        return dict(obs = self.frames_buf[obs_idx],
+            next_obs = self.frames_buf[(obs_idx + 1) % self.frame_size],
+            acts = self.acts_buf[idx],
+            rews = self.rews_buf[idx],
+            done = self.done_buf[idx])
+
+    def checkpoint(self) -> None:
+        """ Flush the memory mapped files and store the buffer pointers """
+        for name in ('frames', 'acts', 'rews', 'done', 'obs_idx'):
+            getattr(self, f'{name}_buf').flush()
+        state = dict(ptr = self.ptr, size = self.size,
+                     frame_ptr = self.frame_ptr, new_episode = self.new_episode)
+        (self.directory / 'state.json').write_text(json.dumps(state))
+
+    def __len__(self) -> int:
+        return self.size
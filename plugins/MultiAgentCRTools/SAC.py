@@ -3,6 +3,10 @@ import torch.nn.functional as F
 import torch.optim as optim
 
 from typing import Tuple, Optional, List
+from collections import deque
+import copy
+import threading
+import time
 import numpy as np
 
 from plugins.MultiAgentCRTools.actor import Actor
@@ -23,7 +27,12 @@ class SAC():
                  gamma: float = 0.995,
                  tau: float = 5e-3,
                  policy_update_freq: int = 10,
-                 initial_random_steps: int = 0):
+                 initial_random_steps: int = 0,
+                 gradient_steps: int = 1,
+                 loss_history: int = 10000,
+                 async_learner: bool = False,
+                 learner_steps_per_env_step: float = None,
+                 weight_sync_interval: int = None):
 
         self.gamma = gamma
         self.tau = tau
@@ -42,9 +51,9 @@ class SAC():
         self.log_alpha = torch.zeros(1, requires_grad=True, device=self.device)
         self.alpha_optimizer = optim.Adam([self.log_alpha], lr=alpha_lr)
 
-        self.qf1_lossarr = np.array([])
-        self.qf2_lossarr = np.array([])
-
+        self.gradient_steps = gradient_steps
+        self.qf1_loss = LossHistory(loss_history)
+        self.qf2_loss = LossHistory(loss_history)
 
         self.policy_update_freq = policy_update_freq
 
@@ -58,18 +67,44 @@ class SAC():
     
         self.hard_update(self.critic_q_target, self.critic_q)
 
+        # Asynchronous learner mode: store_transition only queues transitions,
+        # a background thread moves them into the buffer and calls update_model
+        # up to learner_steps_per_env_step times per transition (default: the
+        # synchronous rate). Actions come from a copy of the actor that pulls
+        # the latest published weights every weight_sync_interval steps.
+        self.async_learner = async_learner
+        self.policy = copy.deepcopy(self.actor) if async_learner else self.actor
+        self.learner_steps_per_env_step = (1 / policy_update_freq if learner_steps_per_env_step is None
+                                           else learner_steps_per_env_step)
+        self.weight_sync_interval = weight_sync_interval or policy_update_freq
+        self.learner_updates = 0
+        self._transitions = deque()
+        self._stored = deque()
+        self._env_steps = 0
+        self._snapshot = (0, None)
+        self._synced_version = 0
+        self._learner = None
+        self._stop_learner = threading.Event()
+
     def get_action(self, observation: np.ndarray) -> np.ndarray:
         if self.total_steps < self.initial_random_steps and not self.test:
             action = np.random.standard_normal((len(observation),self.action_dim)) * 0.33
         else:
-            action = self.actor(torch.FloatTensor(np.array([observation])).to(self.device))[0].detach().cpu().numpy()
+            action = self.policy(torch.FloatTensor(np.array([observation])).to(self.device))[0].detach().cpu().numpy()
             action = np.array(action[0])
             action = np.clip(action, -1, 1)
         
         self.total_steps += 1
+        if self.async_learner and self.total_steps % self.weight_sync_interval == 0:
+            self.sync_weights()
         return action
 
     def store_transition(self,observation,action,new_observation,reward,done) -> None:
+        if self.async_learner:
+            if not self.test:
+                self._transitions.append((observation, action, reward, new_observation, False))
+                self.start_learner()
+            return
         if not self.test:
             done = False
             transition = [observation, action, reward, new_observation, done]
@@ -80,20 +115,91 @@ class SAC():
             not self.test):
                 self.update_model()
 
+    def transitions_stored(self, steps: int = 1) -> None:
+        """ Async mode: pass steps environment steps to the learner whose
+        transitions were written into the buffer directly, e.g. by the
+        workers of a VectorRollout """
+        if not self.test:
+            self._stored.append(steps)
+            self.start_learner()
+
     def new_episode(self, test: bool) -> None:
         self.test = test
 
-    def update_model(self):
-        # Sample a batch from memory
+    def start_learner(self) -> None:
+        """ Start the background learner thread, if not running yet """
+        if self._learner is None:
+            self._stop_learner.clear()
+            self._learner = threading.Thread(target=self._learner_loop, daemon=True)
+            self._learner.start()
+
+    def stop_learner(self) -> None:
+        """ Stop the background learner thread and wait for it to finish """
+        if self._learner is not None:
+            self._stop_learner.set()
+            self._learner.join()
+            self._learner = None
+
+    def sync_weights(self) -> None:
+        """ Load the most recent actor weights published by the learner
+        into the acting policy """
+        version, snapshot = self._snapshot
+        if version != self._synced_version:
+            self.policy.load_state_dict(snapshot)
+            self._synced_version = version
+
+    def _learner_loop(self) -> None:
+        while not self._stop_learner.is_set():
+            # deque.append/popleft are atomic, the actor side never waits
+            while self._transitions:
+                self.buffer.store(*self._transitions.popleft())
+                self._env_steps += 1
+            while self._stored:
+                self._env_steps += self._stored.popleft()
+
+            if (len(self.buffer) > self.buffer.batch_size and
+                self._env_steps > self.initial_random_steps and
+                self.learner_updates < self._env_steps * self.learner_steps_per_env_step):
+                    self.update_model(update_policy=True)
+                    self.learner_updates += 1
+                    # Publish a copy, the actor picks it up at its next sync
+                    self._snapshot = (self.learner_updates,
+                                      {k: v.detach().clone() for k, v in self.actor.state_dict().items()})
+            else:
+                time.sleep(1e-3)
+
+    @property
+    def qf1_lossarr(self) -> np.ndarray:
+        return self.qf1_loss.values()
+
+    @property
+    def qf2_lossarr(self) -> np.ndarray:
+        return self.qf2_loss.values()
+
+    def update_model(self, update_policy: bool = None):
+        # Sample one super-batch for all gradient steps, the sampled arrays
+        # are fresh float32 arrays so torch.from_numpy shares their memory
         device = self.device
-
-        samples = self.buffer.sample_batch()
-        state = torch.FloatTensor(samples["obs"]).to(device)
-        next_state = torch.FloatTensor(samples["next_obs"]).to(device)
-        action = torch.FloatTensor(samples["acts"]).to(device)
-        reward = torch.FloatTensor(samples["rews"]).to(device)
-        done = torch.FloatTensor(samples["done"].reshape(-1, 1)).to(device)
-
+        batch_size = self.buffer.batch_size
+        steps = max(1, min(self.gradient_steps, len(self.buffer) // batch_size))
+
+        samples = self.buffer.sample_batch(batch_size * steps)
+        state = torch.from_numpy(samples["obs"]).to(device)
+        next_state = torch.from_numpy(samples["next_obs"]).to(device)
+        action = torch.from_numpy(samples["acts"]).to(device)
+        reward = torch.from_numpy(samples["rews"]).to(device)
+        done = torch.from_numpy(samples["done"].reshape(-1, 1)).to(device)
+
+        if update_policy is None:
+            update_policy = self.total_steps % self.policy_update_freq == 0
+
+        for i in range(steps):
+            batch = slice(i * batch_size, (i + 1) * batch_size)
+            losses = self._update_step(state[batch], next_state[batch], action[batch],
+                                       reward[batch], done[batch], update_policy)
+        return losses
+
+    def _update_step(self, state, next_state, action, reward, done, update_policy):
         b,n = reward.size()
         reward = reward.view(b,n,1)
 
@@ -114,8 +220,8 @@ class SAC():
         qf2_loss = F.mse_loss(qf2, next_q_value)  # JQ = 𝔼(st,at)~D[0.5(Q1(st,at) - r(st,at) - γ(𝔼st+1~p[V(st+1)]))^2]
         qf_loss = qf1_loss + qf2_loss
 
-        self.qf1_lossarr = np.append(self.qf1_lossarr,qf1_loss.detach().cpu().numpy())
-        self.qf2_lossarr = np.append(self.qf2_lossarr,qf2_loss.detach().cpu().numpy())
+        self.qf1_loss.append(qf1_loss.item())
+        self.qf2_loss.append(qf2_loss.item())
 
         self.critic_optim.zero_grad()
         qf_loss.backward()
@@ -128,7 +234,7 @@ class SAC():
         qf2_pi = qf_pi[:,:,1]
         min_qf_pi = torch.min(qf1_pi, qf2_pi)
 
-        if self.total_steps % self.policy_update_freq == 0:
+        if update_policy:
             policy_loss = ((alpha * log_pi.flatten(start_dim=-2,end_dim=-1)) - min_qf_pi).mean() # Jπ = 𝔼st∼D,εt∼N[α * logπ(f(εt;st)|st) − Q(st,f(εt;st))]
 
             self.actor_optimizer.zero_grad()
@@ -157,4 +263,34 @@ class SAC():
 
     def hard_update(self, target, source):
         for target_param, param in zip(target.parameters(), source.parameters()):
-            target_param.data.copy_(param.data)
\ No newline at end of file
+            target_param.data.copy_(param.data)
+
+class LossHistory():
+    """ Fixed size ring buffer of the most recent loss values, together with
+    running aggregates over the complete training run """
+
+    def __init__(self, size: int = 10000):
+        self.buf = np.zeros(size, dtype=np.float64)
+        self.ptr, self.size = 0, 0
+        self.count, self.total = 0, 0.0
+
+    def append(self, value: float) -> None:
+        self.buf[self.ptr] = value
+        self.ptr = (self.ptr + 1) % len(self.buf)
+        self.size = min(self.size + 1, len(self.buf))
+        self.count += 1
+        self.total += value
+
+    @property
+    def mean(self) -> float:
+        """ Mean over all values since the start of training """
+        return self.total / max(self.count, 1)
+
+    def values(self) -> np.ndarray:
+        """ The stored values from oldest to newest """
+        if self.size < len(self.buf):
+            return self.buf[:self.size].copy()
+        return np.roll(self.buf, -self.ptr)
+
+    def __len__(self) -> int:
+        return self.size
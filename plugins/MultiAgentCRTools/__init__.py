@@ -1,4 +1,5 @@
 # from plugins.MultiAgentCRTools import SAC
 from plugins.MultiAgentCRTools import actor
 from plugins.MultiAgentCRTools import constants
-from plugins.MultiAgentCRTools import functions
\ No newline at end of file
+from plugins.MultiAgentCRTools import functions
+from plugins.MultiAgentCRTools import observation
@@ -0,0 +1,118 @@
+import numpy as np
+
+from plugins.CommonTools.functions import bound_angle_positive_negative_180
+from plugins.MultiAgentCRTools import constants, functions
+
+class ObservationBuilder:
+    """ Builds the normalized observation vectors of all agents at once
+
+    Every row of the returned array is the concatenation of
+    [cos(drift), sin(drift), airspeed, x_r, y_r, vx_r, vy_r, cos(track),
+    sin(track), distances] where the relative features hold the
+    num_ac_state nearest intruders, sorted by distance. When fewer than
+    num_ac_state intruders exist the remaining slots are left at zero.
+
+    The output and scratch buffers are preallocated and only grow when the
+    number of aircraft exceeds the current capacity. The array returned by
+    build() is a view on the internal buffer and is overwritten on the next
+    call.
+    """
+
+    def __init__(self,
+                 num_ac_state: int = constants.NUM_AC_STATE,
+                 center: np.array = constants.CENTER):
+        self.num_ac_state = num_ac_state
+        self.center = center
+        self.obs_dim = 3 + 7 * num_ac_state
+
+        self._capacity = 0
+        self._reserve(16)
+
+    def _reserve(self, n: int) -> None:
+        """ Make sure the buffers can hold at least n aircraft """
+        if n <= self._capacity:
+            return
+        self._capacity = max(n, 2 * self._capacity)
+        cap = self._capacity
+        self._obs = np.zeros((cap, self.obs_dim))
+        self._dx = np.empty((cap, cap))
+        self._dy = np.empty((cap, cap))
+        self._dist = np.empty((cap, cap))
+
+    def build(self,
+              lat: np.array,
+              lon: np.array,
+              hdg: np.array,
+              gs: np.array,
+              tas: np.array,
+              target_hdg: np.array) -> np.array:
+        """ Construct the (n_agents x obs_dim) observation array
+        Parameters
+        __________
+        lat, lon: np.array
+            aircraft positions (in degrees)
+        hdg, target_hdg: np.array
+            current and target heading (in degrees)
+        gs, tas: np.array
+            ground speed and true airspeed (in m/s)
+
+        Returns
+        __________
+        obs: np.array
+            normalized observation of every aircraft, one row per aircraft
+        """
+        n = len(lat)
+        self._reserve(n)
+        k = self.num_ac_state
+        obs = self._obs[:n]
+        obs.fill(0.0)
+
+        # Drift of agent aircraft, bounded to [-180, 180]
+        drift = bound_angle_positive_negative_180(hdg - target_hdg)
+        obs[:, 0] = np.cos(np.deg2rad(drift))
+        obs[:, 1] = np.sin(np.deg2rad(drift))
+        obs[:, 2] = (tas - 150) / 6
+
+        # Two-step conversion lat/long -> NM -> m, for all aircraft at once
+        x, y = functions.latlong_to_nm(self.center, np.array([lat, lon])) * constants.NM2KM * 1000
+
+        nint = min(k, n - 1)
+        if nint <= 0:
+            return obs
+
+        # Pairwise distances, written into the preallocated scratch buffers
+        dx = np.subtract(x[np.newaxis, :], x[:, np.newaxis], out=self._dx[:n, :n])
+        dy = np.subtract(y[np.newaxis, :], y[:, np.newaxis], out=self._dy[:n, :n])
+        dist = self._dist[:n, :n]
+        np.multiply(dx, dx, out=dist)
+        dist += dy * dy
+        np.sqrt(dist, out=dist)
+        np.fill_diagonal(dist, np.inf)
+
+        # Select the nearest intruders, then order only those by distance
+        nearest = np.argpartition(dist, nint - 1, axis=1)[:, :nint]
+        int_dist = np.take_along_axis(dist, nearest, axis=1)
+        order = np.argsort(int_dist, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        int_dist = np.take_along_axis(int_dist, order, axis=1)
+
+        # Intruder relative position and velocity
+        vx = np.cos(np.deg2rad(hdg)) * gs
+        vy = np.sin(np.deg2rad(hdg)) * gs
+        x_r = np.take_along_axis(dx, nearest, axis=1)
+        y_r = np.take_along_axis(dy, nearest, axis=1)
+        vx_r = vx[nearest] - vx[:, np.newaxis]
+        vy_r = vy[nearest] - vy[:, np.newaxis]
+        track = np.arctan2(vy_r, vx_r)
+
+        for i, feature in enumerate((x_r / 13000,
+                                     y_r / 13000,
+                                     vx_r / 32,
+                                     vy_r / 66,
+                                     np.cos(track),
+                                     np.sin(track),
+                                     (int_dist - 50000.) / 15000.)):
+            start = 3 + i * k
+            obs[:, start:start + nint] = feature
+
+        return obs
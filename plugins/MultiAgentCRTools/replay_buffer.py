@@ -2,6 +2,8 @@ from typing import Dict, List, Deque, Tuple
 from collections import deque
 import numpy as np
 
+from plugins.CommonTools.replay_buffer import MemmapReplayBuffer
+
 class ReplayBuffer:
 
     def __init__(self, obs_dim: int, action_dim: int, n_agents: int, size: int, batch_size: int = 1024):
@@ -30,9 +32,9 @@ class ReplayBuffer:
         self.ptr = (self.ptr + 1) % self.max_size
         self.size = min(self.size + 1, self.max_size)
 
-    def sample_batch(self) -> Dict[str, np.ndarray]:
-        """ Sample from storage"""
-        idx = np.random.choice(self.size, size=self.batch_size, replace=False)
+    def sample_batch(self, batch_size: int = None) -> Dict[str, np.ndarray]:
+        """ Sample from storage, batch_size defaults to self.batch_size """
+        idx = np.random.choice(self.size, size=batch_size or self.batch_size, replace=False)
         return dict(obs = self.obs_buf[idx],
             next_obs = self.next_obs_buf[idx],
             acts = self.acts_buf[idx],
@@ -40,4 +42,4 @@ class ReplayBuffer:
             done = self.done_buf[idx])
     
     def __len__(self) -> int:
-        return self.size
\ No newline at end of file
+        return self.size
@@ -0,0 +1,360 @@
+""" Vectorized sample collection over several independent BlueSky simulations.
+
+Every simulation runs in its own detached-mode BlueSky process. The workers
+share one observation and one action array with the learner, so every
+VectorRollout.step() is a single batched actor forward pass over all
+environments and agents. Transitions are written by the workers directly
+into a SharedReplayBuffer, which the learner samples from.
+
+Example:
+
+    buffer = SharedReplayBuffer(obs_dim, action_dim, n_agents, size=int(1e6))
+    env_fn = functools.partial(BlueSkyEnv, n_agents=n_agents, scenario=scenario,
+                               reward_fn=reward_fn)
+    with VectorRollout(env_fn, num_envs=8, n_agents=n_agents, obs_dim=obs_dim,
+                       action_dim=action_dim, buffer=buffer) as rollout:
+        rollout.run(model, steps=100000)
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Callable, Tuple
+
+import numpy as np
+import torch
+
+from bluesky.core import TrafficArrays
+import plugins.CommonTools.functions as fn
+from plugins.MultiAgentCRTools import constants
+from plugins.MultiAgentCRTools.observation import ObservationBuilder
+from plugins.MultiAgentCRTools.replay_buffer import ReplayBuffer
+
+
+def _shared_array(shape, dtype, name=None):
+    """ Create (name=None) or attach to a shared memory block and return it
+    together with an array view on it """
+    dtype = np.dtype(dtype)
+    if name is None:
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+class SharedReplayBuffer(ReplayBuffer):
+    """ ReplayBuffer with its storage and pointers in shared memory
+
+    The buffer can be passed to worker processes, which attach to the same
+    memory blocks, so transitions stored by any process are visible to all
+    of them. store() is serialized with a lock. The process that created the
+    buffer owns the memory and should call close() when done.
+    """
+
+    _fields = dict(obs_buf='obs', next_obs_buf='obs', rews_buf='rews',
+                   acts_buf='acts', done_buf='done', _pointers='pointers')
+
+    def __init__(self, obs_dim: int, action_dim: int, n_agents: int, size: int, batch_size: int = 1024):
+        self.max_size, self.batch_size = size, batch_size
+        self._shapes = dict(obs=((size, n_agents, obs_dim), np.float32),
+                            rews=((size, n_agents), np.float32),
+                            acts=((size, n_agents, action_dim), np.float32),
+                            done=((size,), np.float32),
+                            pointers=((2,), np.int64))
+        self._lock = mp.get_context('spawn').Lock()
+        self._owner = True
+        self._attach({})
+
+    def _attach(self, names):
+        self._shm = {}
+        for field, kind in self._fields.items():
+            shape, dtype = self._shapes[kind]
+            self._shm[field], array = _shared_array(shape, dtype, names.get(field))
+            if field not in names:
+                array.fill(0)
+            setattr(self, field, array)
+
+    @property
+    def ptr(self) -> int:
+        return int(self._pointers[0])
+
+    @ptr.setter
+    def ptr(self, value: int):
+        self._pointers[0] = value
+
+    @property
+    def size(self) -> int:
+        return int(self._pointers[1])
+
+    @size.setter
+    def size(self, value: int):
+        self._pointers[1] = value
+
+    def store(self, *transition) -> None:
+        """ Store transition """
+        with self._lock:
+            super().store(*transition)
+
+    def sample_batch(self, batch_size: int = None):
+        """ Sample from storage, batch_size defaults to self.batch_size """
+        with self._lock:
+            return super().sample_batch(batch_size)
+
+    def close(self) -> None:
+        """ Release the shared memory, the owner also frees it """
+        for shm in self._shm.values():
+            shm.close()
+            if self._owner:
+                shm.unlink()
+        self._shm = {}
+
+    def __getstate__(self):
+        state = {k: v for k, v in self.__dict__.items()
+                 if k != '_shm' and k not in self._fields}
+        state['_names'] = {field: shm.name for field, shm in self._shm.items()}
+        return state
+
+    def __setstate__(self, state):
+        names = state.pop('_names')
+        self.__dict__.update(state)
+        self._owner = False
+        self._attach(names)
+
+
+class TargetHeading(TrafficArrays):
+    """ Target heading of every aircraft: its heading at creation """
+
+    def __init__(self):
+        super().__init__()
+        with self.settrafarrays():
+            self.hdg = np.array([])
+
+    def create(self, n=1):
+        super().create(n)
+        self.hdg[-n:] = self._parent.hdg[-n:]
+
+
+class BlueSkyEnv:
+    """ Multi-agent conflict resolution on one detached BlueSky simulation
+
+    Each step applies the heading and speed actions of all agents, runs the
+    simulation for constants.TIMESTEP seconds and returns the observation,
+    reward and done flag. The number of agents is fixed at n_agents: rows
+    of aircraft that are missing are zero, extra aircraft are ignored.
+    """
+
+    def __init__(self,
+                 n_agents: int,
+                 scenario: Callable,
+                 reward_fn: Callable,
+                 episode_length: int = 100,
+                 seed: int = None,
+                 **init_kwargs):
+        """
+        Parameters
+        __________
+        n_agents: int
+            number of agents in every transition
+        scenario: Callable
+            scenario(n_agents, rng) creates the traffic of a new episode
+        reward_fn: Callable
+            reward_fn(obs) returns the reward of every agent
+        episode_length: int
+            number of steps after which an episode is done
+        init_kwargs:
+            passed on to bluesky.init()
+        """
+        import bluesky as bs
+        if bs.sim is None:
+            bs.init(mode='sim', detached=True, **init_kwargs)
+        self.bs = bs
+        self.n_agents = n_agents
+        self.episode_length = episode_length
+        self.scenario = scenario
+        self.reward_fn = reward_fn
+        self.rng = np.random.default_rng(seed)
+        # Created and deleted together with the aircraft
+        self.target = TargetHeading()
+        self.obs_builder = ObservationBuilder()
+        self.obs_dim = self.obs_builder.obs_dim
+        self.obs = np.zeros((n_agents, self.obs_dim), dtype=np.float32)
+        self.steps = 0
+
+    def reset(self) -> np.ndarray:
+        self.bs.sim.reset()
+        self.scenario(self.n_agents, self.rng)
+        # Also run when the scenario creates no traffic
+        self.bs.sim.op()
+        self.steps = 0
+        return self._get_obs()
+
+    def step(self, action: np.ndarray) -> Tuple[np.ndarray, np.ndarray, bool]:
+        traf, sim = self.bs.traf, self.bs.sim
+        n = min(traf.ntraf, self.n_agents)
+        if n > 0:
+            idx = np.arange(n)
+            dh = action[:n, 0] * constants.D_HEADING
+            dv = action[:n, 1] * constants.D_VELOCITY
+            heading_new = fn.bound_angle_positive_negative_180(traf.hdg[idx] + dh)
+            speed_new = traf.cas[idx] + dv
+            traf.ap.set_targets(idx, hdg=heading_new, casmach=speed_new)
+
+        # The number of steps is bounded, time does not advance when the
+        # simulation is held
+        t_end = sim.simt + constants.TIMESTEP
+        for _ in range(int(np.ceil(constants.TIMESTEP / sim.simdt))):
+            if sim.simt >= t_end - 1e-6:
+                break
+            sim.step()
+
+        self.steps += 1
+        obs = self._get_obs()
+        reward = self.reward_fn(obs)
+        return obs, reward, self.steps >= self.episode_length
+
+    def _get_obs(self) -> np.ndarray:
+        traf = self.bs.traf
+        n = min(traf.ntraf, self.n_agents)
+        self.obs.fill(0.0)
+        if traf.ntraf > 0:
+            obs = self.obs_builder.build(traf.lat, traf.lon, traf.hdg, traf.gs,
+                                         traf.tas, self.target.hdg)
+            self.obs[:n] = np.clip(obs[:n], -12, 12)
+        return self.obs.copy()
+
+
+def _worker(index, conn, env_fn, buffer, obs_name, act_name, obs_shape, act_shape):
+    """ Main loop of a rollout process, driven by commands from the learner """
+    obs_shm, obs = _shared_array(obs_shape, np.float32, obs_name)
+    act_shm, act = _shared_array(act_shape, np.float32, act_name)
+    env = env_fn(seed=index)
+    try:
+        while True:
+            cmd = conn.recv()
+            if cmd == 'reset':
+                obs[index] = env.reset()
+                conn.send(False)
+            elif cmd == 'step':
+                action = act[index].copy()
+                next_obs, reward, done = env.step(action)
+                buffer.store(obs[index], action, reward, next_obs, done)
+                obs[index] = env.reset() if done else next_obs
+                conn.send(done)
+            elif cmd == 'close':
+                break
+    finally:
+        buffer.close()
+        obs_shm.close()
+        act_shm.close()
+        conn.close()
+
+
+class VectorRollout:
+    """ Steps num_envs BlueSkyEnv instances in parallel processes
+
+    Observations of all environments are available as one
+    (num_envs, n_agents, obs_dim) array, the actions for all environments
+    are passed back in one (num_envs, n_agents, action_dim) array.
+    """
+
+    def __init__(self,
+                 env_fn: Callable,
+                 num_envs: int,
+                 n_agents: int,
+                 obs_dim: int,
+                 action_dim: int,
+                 buffer: SharedReplayBuffer):
+        """
+        Parameters
+        __________
+        env_fn: Callable
+            env_fn(seed=i) creates the environment of worker i, runs in the
+            worker process and must therefore be picklable
+        num_envs: int
+            number of simulations, typically the number of cores
+        buffer: SharedReplayBuffer
+            replay buffer that receives the transitions of all workers
+        """
+        self.num_envs, self.n_agents = num_envs, n_agents
+        self.obs_dim, self.action_dim = obs_dim, action_dim
+        self.buffer = buffer
+
+        obs_shape = (num_envs, n_agents, obs_dim)
+        act_shape = (num_envs, n_agents, action_dim)
+        self._obs_shm, self.obs = _shared_array(obs_shape, np.float32)
+        self._act_shm, self.actions = _shared_array(act_shape, np.float32)
+
+        ctx = mp.get_context('spawn')
+        self.conns, self.procs = [], []
+        for i in range(num_envs):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_worker, daemon=True,
+                               args=(i, child, env_fn, buffer, self._obs_shm.name,
+                                     self._act_shm.name, obs_shape, act_shape))
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+
+    def _broadcast(self, cmd: str) -> np.ndarray:
+        for conn in self.conns:
+            conn.send(cmd)
+        return np.array([conn.recv() for conn in self.conns])
+
+    def reset(self) -> np.ndarray:
+        """ Reset all environments, returns the observations of all agents """
+        self._broadcast('reset')
+        return self.obs
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ Apply actions in all environments, returns the next observations
+        (already reset for environments that finished) and the done flags """
+        self.actions[:] = actions
+        dones = self._broadcast('step')
+        return self.obs, dones
+
+    def run(self, model, steps: int) -> None:
+        """ Collect steps vector steps with the policy of a SAC model and
+        update the model with the same schedule as SAC.store_transition.
+        With an asynchronous learner, the vector steps are passed to the
+        learner thread instead, and the policy pulls the published weights
+        every weight_sync_interval steps """
+        shape = (self.num_envs * self.n_agents, self.obs_dim)
+        obs = self.reset()
+        for _ in range(steps):
+            if model.total_steps < model.initial_random_steps and not model.test:
+                action = np.random.standard_normal((shape[0], self.action_dim)) * 0.33
+            else:
+                # One forward pass for all agents of all environments
+                with torch.inference_mode():
+                    action, _ = model.policy(torch.from_numpy(obs.reshape(shape)).to(model.device))
+                action = action.cpu().numpy()
+            action = np.clip(action, -1, 1).reshape(self.actions.shape)
+            model.total_steps += 1
+            obs, _ = self.step(action)
+
+            if model.async_learner:
+                # The workers already stored the transitions in the buffer
+                model.transitions_stored()
+                if model.total_steps % model.weight_sync_interval == 0:
+                    model.sync_weights()
+            elif (model.total_steps % model.policy_update_freq == 0 and
+                  len(self.buffer) > self.buffer.batch_size and
+                  model.total_steps > model.initial_random_steps and
+                  not model.test):
+                    model.update_model()
+
+    def close(self) -> None:
+        for conn in self.conns:
+            conn.send('close')
+        for proc in self.procs:
+            proc.join()
+        self._obs_shm.close()
+        self._obs_shm.unlink()
+        self._act_shm.close()
+        self._act_shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -3,6 +3,8 @@ from stable_baselines3 import SAC
 import numpy as np
 import plugins.MultiAgentCRattTools as MACRT
 import torch
+from bluesky.tools.aero import kts
+import plugins.CommonTools.functions as fn
 
 def init_plugin():
     multiagentconflictresolutionattention = MultiAgentConflictResolutionAttention()
@@ -39,9 +41,7 @@ class MultiAgentConflictResolutionAttention(core.Entity):
             action = np.array(action[0].detach().numpy())
             act_array = np.clip(action, -1, 1)
 
-            for id, action in zip(traf.id,act_array[0]):
-                idx = traf.id2idx(id)
-                self._set_action(action,idx)
+            self._set_action(act_array[0], np.arange(traf.ntraf))
         else:
             pass
     
@@ -98,11 +98,9 @@ class MultiAgentConflictResolutionAttention(core.Entity):
         return observations
     
     def _set_action(self, action, idx):
-        dh = action[0] * MACRT.constants.D_HEADING
-        dv = action[1] * MACRT.constants.D_VELOCITY
-        heading_new = MACRT.functions.bound_angle_positive_negative_180(traf.hdg[idx] + dh)
+        dh = action[:,0] * MACRT.constants.D_HEADING
+        dv = action[:,1] * MACRT.constants.D_VELOCITY
+        heading_new = fn.bound_angle_positive_negative_180(traf.hdg[idx] + dh)
         speed_new = (traf.cas[idx] + dv) * MACRT.constants.MpS2Kt
 
-        id = traf.id[idx]
-        stack.stack(f"HDG {id} {heading_new}")
-        stack.stack(f"SPD {id} {speed_new}")
\ No newline at end of file
+        traf.ap.set_targets(idx, hdg=heading_new, casmach=speed_new * kts)
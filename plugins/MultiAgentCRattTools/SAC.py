@@ -5,9 +5,9 @@ import torch.optim as optim
 from typing import Tuple, Optional, List
 import numpy as np
 
-from sac_cr_att.actor import Actor
-from sac_cr_att.critic_q import Critic_Q
-from sac_cr_att.replay_buffer import ReplayBuffer
+from plugins.MultiAgentCRattTools.actor import Actor
+from plugins.MultiAgentCRattTools.critic_q import Critic_Q
+from plugins.MultiAgentCRattTools.replay_buffer import ReplayBuffer
 
 
 class SAC:
@@ -84,43 +84,54 @@ class SAC:
         action = torch.FloatTensor(samples["acts"]).to(device)
         reward = torch.FloatTensor(samples["rews"]).to(device)
         done = torch.FloatTensor(samples["done"].reshape(-1, 1)).to(device)
-        weights = samples["weights"].to(device)
-        idx = samples["idx"]
+        weights = samples["weights"].to(device) if "weights" in samples else None
+
+        # Batches with a varying number of agents are padded, padded agents
+        # are excluded from attention and from all losses
+        mask = samples.get("mask")
+        if mask is not None:
+            mask = torch.from_numpy(mask).to(device)
+            valid = mask.float()
+        else:
+            valid = torch.ones_like(reward)
+        n_valid = valid.sum()
 
         b,n = reward.size()
         reward = reward.view(b,n,1)
 
         alpha = self.log_alpha.exp()
         with torch.no_grad():
-            next_state_action, next_state_log_pi = self.actor(next_state)
-            qf_target = self.critic_q_target(next_state, next_state_action)
+            next_state_action, next_state_log_pi = self.actor(next_state, mask)
+            qf_target = self.critic_q_target(next_state, next_state_action, mask)
             qf1_next_target = qf_target[:,:,0]
             qf2_next_target = qf_target[:,:,1]
             min_qf_next_target = torch.min(qf1_next_target, qf2_next_target) - alpha * next_state_log_pi.flatten(start_dim=-2,end_dim=-1)
             next_q_value = reward.flatten(start_dim=-2,end_dim=-1) + self.gamma * (min_qf_next_target)
         
-        qf = self.critic_q(state, action)
+        qf = self.critic_q(state, action, mask)
         qf1_loss = F.mse_loss(qf[:,:,0], next_q_value, reduction='none')
         qf2_loss = F.mse_loss(qf[:,:,1], next_q_value, reduction='none')
         qf_loss = (qf1_loss + qf2_loss)# * weights
 
         self.critic_optim.zero_grad()
-        qf_loss.mean().backward()
+        ((qf_loss * valid).sum() / n_valid).backward()
         self.critic_optim.step()
 
-        td_error = (torch.abs(qf[:,:,0] - next_q_value).detach() + torch.abs(qf[:,:,1] - next_q_value).detach()).sum(dim=1) + 1e-5
-        self.buffer.update_priorities(idx, td_error.cpu().numpy())
+        if "idx" in samples:
+            td_error = ((torch.abs(qf[:,:,0] - next_q_value).detach() + torch.abs(qf[:,:,1] - next_q_value).detach()) * valid).sum(dim=1) + 1e-5
+            self.buffer.update_priorities(samples["idx"], td_error.cpu().numpy())
 
-        pi, log_pi = self.actor(state)
-        min_qf_pi = torch.min(self.critic_q(state, pi)[:,:,0], self.critic_q(state, pi)[:,:,1])
-        policy_loss = ((alpha * log_pi.flatten(-2,-1)) - min_qf_pi).mean()
+        pi, log_pi = self.actor(state, mask)
+        qf_pi = self.critic_q(state, pi, mask)
+        min_qf_pi = torch.min(qf_pi[:,:,0], qf_pi[:,:,1])
+        policy_loss = ((((alpha * log_pi.flatten(-2,-1)) - min_qf_pi) * valid).sum() / n_valid)
         self.actor_optimizer.zero_grad()
         policy_loss.backward()
         self.actor_optimizer.step()
         
         self.soft_update(self.critic_q_target, self.critic_q, self.tau)
 
-        alpha_loss = -(self.log_alpha * (log_pi + self.target_alpha).detach()).mean()
+        alpha_loss = -((self.log_alpha * (log_pi + self.target_alpha).detach()).flatten(-2,-1) * valid).sum() / n_valid
         self.alpha_optimizer.zero_grad()
         alpha_loss.backward()
         self.alpha_optimizer.step()
@@ -37,14 +37,15 @@ class MultiHeadAdditiveActorBasic(Actor):
                  num_blocks: int = 2,
                  log_std_min: float= -20,
                  log_std_max: float=2,
-                 dropout_rate: float = 0.2):
+                 dropout_rate: float = 0.2,
+                 num_neighbours: int = 10):
         super().__init__()
         
         self.log_std_min = log_std_min
         self.log_std_max = log_std_max
 
         # Generate the transformer matrices
-        self.block1 = transformer.MultiHeadAdditiveAttentionBlockBasic(q_dim,kv_dim,num_heads)
+        self.block1 = transformer.MultiHeadAdditiveAttentionBlockBasic(q_dim,kv_dim,num_heads,num_neighbours)
 
         self.layers = nn.ModuleList()
         in_dim = kv_dim * num_heads + q_dim
@@ -68,9 +69,9 @@ class MultiHeadAdditiveActorBasic(Actor):
         mu_layer = nn.Linear(in_dim, out_dim)
         self.mu_layer = init_layer_uniform(mu_layer)
 
-    def forward(self, state):
+    def forward(self, state, mask=None):
 
-        x, q_x, _ = self.block1(state)
+        x, q_x, _ = self.block1(state, mask)
 
         x = torch.cat((x,q_x),dim=2) # add query information also before passing through the FFN
         # Forward pass
@@ -5,7 +5,7 @@ from torch.distributions import Normal
 
 from abc import ABC, abstractmethod
 
-import sac_cr_att.transformer as transformer
+import plugins.MultiAgentCRattTools.transformer as transformer
 
 def init_layer_uniform(layer: nn.Linear, init_w: float = 3e-3) -> nn.Linear:
     layer.weight.data.uniform_(-init_w, init_w)
@@ -29,14 +29,15 @@ class MultiHeadAdditiveCriticQv3Basic(Critic_Q):
                  num_heads: int = 3,
                  num_blocks: int = 2,
                  log_std_min: float= -20,
-                 log_std_max: float=2):
+                 log_std_max: float=2,
+                 num_neighbours: int = 10):
         super().__init__()
         
         self.log_std_min = log_std_min
         self.log_std_max = log_std_max
 
         # Generate the transformer matrices
-        self.block1 = transformer.MultiHeadAdditiveAttentionBlockQBasic(q_dim,kv_dim,num_heads)
+        self.block1 = transformer.MultiHeadAdditiveAttentionBlockQBasic(q_dim,kv_dim,num_heads,num_neighbours)
 
         self.layers = nn.ModuleList()
         in_dim = kv_dim * num_heads + q_dim
@@ -49,9 +50,9 @@ class MultiHeadAdditiveCriticQv3Basic(Critic_Q):
         self.out = nn.Linear(in_dim, 2)
         self.out = init_layer_uniform(self.out)
 
-    def forward(self, state, action):
+    def forward(self, state, action, mask=None):
 
-        x, q_x, _ = self.block1(state,action)
+        x, q_x, _ = self.block1(state,action,mask)
         x = torch.cat((x,q_x),dim=-1) # add query and action information also before passing through the FFN
 
         # Forward pass
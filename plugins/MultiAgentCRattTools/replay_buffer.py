@@ -3,6 +3,8 @@ from collections import deque
 import numpy as np
 import torch
 
+from plugins.CommonTools.replay_buffer import MemmapReplayBuffer
+
 class ReplayBuffer:
 
     def __init__(self, obs_dim: int, action_dim: int, n_agents: int, size: int, batch_size: int = 1024):
@@ -43,14 +45,85 @@ class ReplayBuffer:
     def __len__(self) -> int:
         return self.size
 
+def sample_without_replacement(n: int, k: int) -> np.ndarray:
+    """ Draw k distinct indices from range(n), at a cost that scales with k
+    instead of n (np.random.choice permutes the whole range) """
+    if k > n:
+        raise ValueError('Cannot take a larger sample than population when replace is False')
+    idx = np.unique(np.random.randint(0, n, size=k))
+    while len(idx) < k:
+        idx = np.unique(np.concatenate([idx, np.random.randint(0, n, size=k - len(idx))]))
+    return np.random.permutation(idx)
+
+class SumTree:
+    """ Binary tree in which every node holds the sum of its children.
+
+    Leaf values are set in O(log N), and a batch of cumulative values is
+    mapped to leaf indices with one O(log N) descent for the whole batch.
+    """
+    def __init__(self, size: int):
+        self.capacity = 1
+        while self.capacity < size:
+            self.capacity *= 2
+        self.tree = np.zeros(2 * self.capacity)
+
+    @property
+    def total(self) -> float:
+        return self.tree[1]
+
+    def __getitem__(self, idx):
+        return self.tree[self.capacity + np.asarray(idx)]
+
+    def update(self, idx, values):
+        """ Set the leaves at idx to values, and update their ancestors """
+        if np.ndim(idx) == 0:
+            pos = int(idx) + self.capacity
+            self.tree[pos] = values
+            pos //= 2
+            while pos > 0:
+                self.tree[pos] = self.tree[2 * pos] + self.tree[2 * pos + 1]
+                pos //= 2
+            return
+        if len(idx) == 0:
+            return
+
+        pos = np.asarray(idx) + self.capacity
+        self.tree[pos] = values
+        pos = np.unique(pos // 2)
+        # All leaves are at the same depth, so all paths reach the root together
+        while pos[0] > 0:
+            self.tree[pos] = self.tree[2 * pos] + self.tree[2 * pos + 1]
+            pos = np.unique(pos // 2)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """ Leaf indices at which the cumulative sum reaches each of values """
+        idx = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.capacity.bit_length() - 1):
+            left = 2 * idx
+            go_right = values > self.tree[left]
+            values = np.where(go_right, values - self.tree[left], values)
+            idx = np.where(go_right, left + 1, left)
+        return idx - self.capacity
+
 class PrioritizedReplayBuffer:
+    """ Proportional prioritized replay buffer.
+
+    Scaled priorities (priority ** alpha) are kept in a SumTree, so that
+    store, sample_batch and update_priorities are O(log N) per transition.
+    The prioritized part of every batch is drawn with stratified sampling
+    (one draw per equal segment of the total priority); the remaining
+    uniform_ratio part is drawn uniformly without replacement. New
+    transitions get the largest priority seen so far.
+    """
     def __init__(self, obs_dim: int, action_dim: int, n_agents: int, size: int, batch_size: int = 1024, alpha: float = 0.4, beta: float = 0.4, beta_increment: float = 0.00001, uniform_ratio = 0.3):
         self.obs_buf = np.zeros([size, n_agents, obs_dim], dtype=np.float32)
         self.next_obs_buf = np.zeros([size, n_agents, obs_dim], dtype=np.float32)
         self.rews_buf = np.zeros([size, n_agents], dtype=np.float32)
         self.acts_buf = np.zeros([size, n_agents, action_dim], dtype=np.float32)
         self.done_buf = np.zeros(size, dtype=np.float32)
-        self.priorities = np.zeros(size, dtype=np.float32) + 1e-5  # Small value to avoid zero priorities
+        self.tree = SumTree(size)
+        self.max_priority = 1.0  # Running maximum of all priorities
         self.uniform_ratio = uniform_ratio # percentage of samples that are sampled fully random
         
         self.max_size, self.batch_size = size, batch_size
@@ -60,30 +133,31 @@ class PrioritizedReplayBuffer:
         self.beta_increment = beta_increment
 
     def store(self, obs, act, rew, next_obs, done):
-        max_priority = self.priorities.max() if self.size > 0 else 1.0
         self.obs_buf[self.ptr] = obs
         self.acts_buf[self.ptr] = act
         self.rews_buf[self.ptr] = rew
         self.next_obs_buf[self.ptr] = next_obs
         self.done_buf[self.ptr] = done
-        self.priorities[self.ptr] = max_priority
+        self.tree.update(self.ptr, self.max_priority ** self.alpha)
 
         self.ptr = (self.ptr + 1) % self.max_size
         self.size = min(self.size + 1, self.max_size)
 
     def sample_batch(self):
-        scaled_priorities = self.priorities[:self.size] ** self.alpha
-        probs = scaled_priorities / scaled_priorities.sum()
-
         per_size = int(self.batch_size * (1 - self.uniform_ratio))
         random_size = self.batch_size - per_size
-        
-        idx = np.random.choice(self.size, size=per_size, p=probs, replace=False)
-        uniform_indices = np.random.choice(self.size, size=random_size, replace=False)
+
+        # Stratified proportional sampling: one draw per priority segment
+        total = self.tree.total
+        segment = total / max(per_size, 1)
+        values = (np.arange(per_size) + np.random.uniform(size=per_size)) * segment
+        idx = np.minimum(self.tree.find(values), self.size - 1)
+        uniform_indices = sample_without_replacement(self.size, random_size)
 
         idx = np.concatenate([idx, uniform_indices])
 
-        weights = (self.size * probs[idx]) ** (-self.beta)
+        probs = self.tree[idx] / total
+        weights = (self.size * probs) ** (-self.beta)
         weights /= weights.max()  # Normalize
         self.beta = min(1.0, self.beta + self.beta_increment)  # Increase beta over time
         
@@ -98,7 +172,123 @@ class PrioritizedReplayBuffer:
         )
 
     def update_priorities(self, idx, priorities):
-        self.priorities[idx] = priorities + 1e-5  # Avoid zero priority
+        if len(idx) == 0:
+            return
+        priorities = priorities + 1e-5  # Avoid zero priority
+        self.max_priority = max(self.max_priority, float(np.max(priorities)))
+        self.tree.update(idx, priorities ** self.alpha)
 
     def __len__(self):
         return self.size
+
+class RaggedReplayBuffer:
+    """ Replay buffer for transitions with a varying number of agents.
+
+    The per-agent data of all transitions is packed into contiguous flat
+    buffers of agent_capacity rows, and every transition only stores the
+    offset and count of its rows. The flat buffers are used as a FIFO log:
+    when a new transition does not fit, the oldest transitions are evicted.
+    Observations and next observations of a transition must describe the
+    same agents.
+
+    sample_batch() pads the sampled transitions to the largest agent count
+    in the batch, and returns a (batch, n_agents) boolean mask of the valid
+    agents.
+    """
+    def __init__(self, obs_dim: int, action_dim: int, size: int, agent_capacity: int, batch_size: int = 1024):
+        self.obs_buf = np.zeros([agent_capacity, obs_dim], dtype=np.float32)
+        self.next_obs_buf = np.zeros([agent_capacity, obs_dim], dtype=np.float32)
+        self.rews_buf = np.zeros(agent_capacity, dtype=np.float32)
+        self.acts_buf = np.zeros([agent_capacity, action_dim], dtype=np.float32)
+
+        self.offsets = np.zeros(size, dtype=np.int64)
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.done_buf = np.zeros(size, dtype=np.float32)
+
+        self.max_size, self.batch_size = size, batch_size
+        self.agent_capacity = agent_capacity
+        self.ptr, self.size = 0, 0
+        # Next free row in the flat buffers
+        self.row_ptr = 0
+
+    @property
+    def first(self) -> int:
+        """ Slot of the oldest stored transition """
+        return (self.ptr - self.size) % self.max_size
+
+    def store(
+        self,
+        obs: np.ndarray,
+        act: np.ndarray,
+        rew: np.ndarray,
+        next_obs: np.ndarray,
+        done: bool,
+    ) -> None:
+        """ Store transition """
+        n = len(obs)
+        if n > self.agent_capacity:
+            raise ValueError(f'Transition with {n} agents does not fit in a '
+                             f'buffer with an agent capacity of {self.agent_capacity}')
+
+        # Make room in the transition ring
+        if self.size == self.max_size:
+            self.size -= 1
+
+        # Make room in the flat buffers. When the transition doesn't fit at
+        # the end, the rows that are left there belong to the oldest
+        # transitions, which are evicted before starting over at row zero.
+        start = self.row_ptr
+        if start + n > self.agent_capacity:
+            while self.size > 0 and self.offsets[self.first] >= start:
+                self.size -= 1
+            start = 0
+        end = start + n
+        # Evict the oldest transitions that start in, or overlap with, the
+        # new rows. Transitions without agents have no rows, but must be
+        # evicted as well to get to the newer transitions behind them.
+        while self.size > 0:
+            offset = self.offsets[self.first]
+            if offset >= end or (offset < start and offset + self.counts[self.first] <= start):
+                break
+            self.size -= 1
+
+        self.obs_buf[start:end] = obs
+        self.acts_buf[start:end] = act
+        self.rews_buf[start:end] = rew
+        self.next_obs_buf[start:end] = next_obs
+        self.offsets[self.ptr] = start
+        self.counts[self.ptr] = n
+        self.done_buf[self.ptr] = done
+
+        self.row_ptr = end
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size += 1
+
+    def sample_batch(self) -> Dict[str, np.ndarray]:
+        """ Sample from storage, padded to the largest agent count in the batch """
+        idx = (self.first + np.random.choice(self.size, size=self.batch_size, replace=False)) % self.max_size
+        counts = self.counts[idx]
+        agents = np.arange(counts.max())
+
+        mask = agents < counts[:, np.newaxis]
+        rows = np.where(mask, self.offsets[idx, np.newaxis] + agents, 0)
+        pad = ~mask
+
+        obs = self.obs_buf[rows]
+        next_obs = self.next_obs_buf[rows]
+        acts = self.acts_buf[rows]
+        rews = self.rews_buf[rows]
+        obs[pad] = 0.
+        next_obs[pad] = 0.
+        acts[pad] = 0.
+        rews[pad] = 0.
+
+        return dict(obs = obs,
+            next_obs = next_obs,
+            acts = acts,
+            rews = rews,
+            done = self.done_buf[idx],
+            mask = mask)
+
+    def __len__(self) -> int:
+        return self.size
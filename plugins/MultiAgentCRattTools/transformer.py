@@ -5,7 +5,31 @@ from torch.distributions import Normal
 
 from typing import Tuple
 
-def query_key_from_state(state):
+def nearest_neighbours(positions, k, mask=None):
+    """
+    Indices (batch,n_agents,k) of the k nearest other agents of every agent,
+    sorted from closest to furthest. Only a single (batch,n_agents,n_agents)
+    distance matrix is needed for the selection.
+
+    When a (batch,n_agents) mask of valid agents is passed, padded agents are
+    never selected, and a (batch,n_agents,k) mask of the valid neighbours is
+    returned alongside the indices (None otherwise).
+    """
+    with torch.no_grad():
+        x = positions[..., 0]
+        y = positions[..., 1]
+        dx = x.unsqueeze(1) - x.unsqueeze(2)
+        dist2 = dx * dx
+        dy = y.unsqueeze(1) - y.unsqueeze(2)
+        dist2 += dy * dy
+        dist2.diagonal(dim1=1, dim2=2).fill_(float('inf'))
+        if mask is not None:
+            dist2.masked_fill_(~mask.unsqueeze(1), float('inf'))
+        dist2, neighbours = torch.topk(dist2, k=k, dim=2, largest=False)
+        valid = None if mask is None else torch.isfinite(dist2)
+        return neighbours, valid
+
+def query_key_from_state(state, num_neighbours=10, mask=None):
     # Extract req. info from observation
     positions = state[:,:,3:5].clone()
     velocities = state[:,:,5:7].clone()
@@ -14,9 +38,15 @@ def query_key_from_state(state):
 
     b, t, _ = positions.size()
 
+    # Only take the closest intruders, for not saturating the attention module.
+    # These are selected first, so all relative states below are (batch,n_agents,k)
+    k = min(num_neighbours, t - 1)
+    neighbours, kv_mask = nearest_neighbours(positions, k, mask)
+    batch_idx = torch.arange(b, device=state.device).view(b, 1, 1)
+
     # Determine relative pos & vel from perspective of agent
-    relative_positions = positions.unsqueeze(1) - positions.unsqueeze(2)
-    relative_velocities = velocities.unsqueeze(1) - velocities.unsqueeze(2)
+    relative_positions = positions[batch_idx, neighbours] - positions.unsqueeze(2)
+    relative_velocities = velocities[batch_idx, neighbours] - velocities.unsqueeze(2)
 
     # Create rotation matrix
     rot_x = direction
@@ -26,15 +56,10 @@ def query_key_from_state(state):
     # Apply the rotation
     rel_pos_rotated = torch.matmul(rotation_matrix.unsqueeze(2), relative_positions.unsqueeze(-1)).squeeze(-1)
     rel_vel_rotated = torch.matmul(rotation_matrix.unsqueeze(2), relative_velocities.unsqueeze(-1)).squeeze(-1)
-
-    # Removing Self-References
-    mask = ~torch.eye(t, dtype=bool).unsqueeze(0).repeat(b,1,1)
-    rel_pos_rotated = rel_pos_rotated[mask].reshape(b, t, t-1, 2)
-    rel_vel_rotated = rel_vel_rotated[mask].reshape(b, t, t-1, 2)
     relative_states = torch.cat([rel_pos_rotated, rel_vel_rotated], dim=-1)
 
-    # Calculate absolute distance matrix of size (batch,n_agents,n_agents-1,1)
-    r = torch.sqrt(relative_states[:,:,:,0].clone()**2 + relative_states[:,:,:,1].clone()**2).view(b,t,t-1,1)
+    # Calculate absolute distance matrix of size (batch,n_agents,k,1)
+    r = torch.sqrt(relative_states[:,:,:,0].clone()**2 + relative_states[:,:,:,1].clone()**2).view(b,t,k,1)
 
     # Apply transformation to distance to have a distance closer to zero have a higher value, assymptotically going to zero.
     r_trans = (1/(1+torch.exp(-1+5.*(r-0.2))))
@@ -44,21 +69,12 @@ def query_key_from_state(state):
 
     # Add track_error of the agents to the keys for intent information
     track_error = state[:,:,0:2].clone()
-    track_error_expanded = track_error.unsqueeze(1).expand(-1, t, -1, -1)
-    track_error_selected = track_error_expanded[mask].reshape(b, t, t-1, 2)
-    relative_states = torch.cat([relative_states, track_error_selected], dim=-1)
-
-    #quick hack to only take the 10 closest for not saturating the attention module
-    distance_squeezed = r_trans.squeeze(-1)  
-    k = min(10, distance_squeezed.shape[2]) 
-    topk_values, topk_indices = torch.topk(distance_squeezed, k=k, dim=2)
-    topk_indices_expanded = topk_indices.unsqueeze(-1).expand(-1, -1, -1, 7)
-    relative_states = torch.gather(relative_states, dim=2, index=topk_indices_expanded)
+    relative_states = torch.cat([relative_states, track_error[batch_idx, neighbours]], dim=-1)
 
     q_x = state[:,:,0:3]
     kv_x = relative_states
 
-    return q_x, kv_x
+    return q_x, kv_x, kv_mask
 
 ### ATTENTION MODULES
 
@@ -83,7 +99,7 @@ class RelativeAdditiveAttentionMultiHead(nn.Module):
         self.bias = nn.Parameter(torch.rand(kv_dim).uniform_(-0.1, 0.1))
         self.score_proj = nn.Linear(kv_dim, 1)
     
-    def forward(self, q_x, kv_x):
+    def forward(self, q_x, kv_x, kv_mask=None):
         b, t, n, k = kv_x.size()
         h = self.num_heads
         
@@ -96,7 +112,13 @@ class RelativeAdditiveAttentionMultiHead(nn.Module):
         values = self.tovalues(kv_x)
         values = values.view(b,t,n,h,k)
         
-        w = F.softmax(score, dim=2)
+        if kv_mask is not None:
+            # Padded keys get no weight. A finite fill value is used so that
+            # agents without any valid key don't produce NaN (gradients).
+            score = score.masked_fill(~kv_mask.unsqueeze(-1), torch.finfo(score.dtype).min)
+            w = F.softmax(score, dim=2).masked_fill(~kv_mask.unsqueeze(-1), 0.)
+        else:
+            w = F.softmax(score, dim=2)
 
         w = w.transpose(2,3).view(b,t,h,1,n)
         v = values.transpose(2,3)
@@ -118,7 +140,7 @@ class RelativeAdditiveAttentionMultiHead(nn.Module):
 ## ADDITIVE
 
 class MultiHeadAdditiveAttentionBlockQ(nn.Module):
-    def __init__(self, q_dim, kv_dim, num_heads):
+    def __init__(self, q_dim, kv_dim, num_heads, num_neighbours=10):
         """
         Basic transformer block.
 
@@ -130,6 +152,7 @@ class MultiHeadAdditiveAttentionBlockQ(nn.Module):
         super(MultiHeadAdditiveAttentionBlockQ, self).__init__()
 
         self.att = RelativeAdditiveAttentionMultiHead(q_dim, kv_dim, num_heads)
+        self.num_neighbours = num_neighbours
 
         self.norm1 = nn.LayerNorm(kv_dim * num_heads)
 
@@ -140,7 +163,7 @@ class MultiHeadAdditiveAttentionBlockQ(nn.Module):
         
         self.norm2 = nn.LayerNorm(kv_dim * num_heads)
 
-    def forward(self, state, action):
+    def forward(self, state, action, mask=None):
         """
         Forward pass of trasformer block.
 
@@ -151,11 +174,11 @@ class MultiHeadAdditiveAttentionBlockQ(nn.Module):
             y: output with shape of (b, k)
         """
 
-        q_x, kv_x = query_key_from_state(state)
+        q_x, kv_x, kv_mask = query_key_from_state(state, self.num_neighbours, mask)
         q_x = torch.cat((q_x, action), dim=-1)
 
         # Self-attend
-        y = self.att(q_x,kv_x)
+        y = self.att(q_x,kv_x,kv_mask)
 
         # First residual connection
         # x = q_x + y
@@ -214,7 +237,7 @@ class MultiHeadAdditiveAttentionBlockQ(nn.Module):
         return q_x, kv_x
 
 class MultiHeadAdditiveAttentionBlockQBasic(nn.Module):
-    def __init__(self, q_dim, kv_dim, num_heads):
+    def __init__(self, q_dim, kv_dim, num_heads, num_neighbours=10):
         """
         Basic transformer block.
 
@@ -226,8 +249,9 @@ class MultiHeadAdditiveAttentionBlockQBasic(nn.Module):
         super(MultiHeadAdditiveAttentionBlockQBasic, self).__init__()
 
         self.att = RelativeAdditiveAttentionMultiHead(q_dim, kv_dim, num_heads)
+        self.num_neighbours = num_neighbours
 
-    def forward(self, state, action):
+    def forward(self, state, action, mask=None):
         """
         Forward pass of trasformer block.
 
@@ -238,16 +262,16 @@ class MultiHeadAdditiveAttentionBlockQBasic(nn.Module):
             y: output with shape of (b, k)
         """
 
-        q_x, kv_x = query_key_from_state(state)
+        q_x, kv_x, kv_mask = query_key_from_state(state, self.num_neighbours, mask)
         q_x = torch.cat((q_x, action), dim=-1)
 
         # Self-attend
-        y = self.att(q_x,kv_x)
+        y = self.att(q_x,kv_x,kv_mask)
 
         return y, q_x, kv_x
 
 class MultiHeadAdditiveAttentionBlock(nn.Module):
-    def __init__(self, q_dim, kv_dim, num_heads):
+    def __init__(self, q_dim, kv_dim, num_heads, num_neighbours=10):
         """
         Basic transformer block.
 
@@ -259,6 +283,7 @@ class MultiHeadAdditiveAttentionBlock(nn.Module):
         super(MultiHeadAdditiveAttentionBlock, self).__init__()
 
         self.att = RelativeAdditiveAttentionMultiHead(q_dim, kv_dim, num_heads)
+        self.num_neighbours = num_neighbours
 
         self.norm1 = nn.LayerNorm(kv_dim * num_heads)
 
@@ -269,7 +294,7 @@ class MultiHeadAdditiveAttentionBlock(nn.Module):
         
         self.norm2 = nn.LayerNorm(kv_dim * num_heads)
 
-    def forward(self, state):
+    def forward(self, state, mask=None):
         """
         Forward pass of trasformer block.
 
@@ -280,10 +305,10 @@ class MultiHeadAdditiveAttentionBlock(nn.Module):
             y: output with shape of (b, k)
         """
 
-        q_x, kv_x = query_key_from_state(state)(state)
+        q_x, kv_x, kv_mask = query_key_from_state(state, self.num_neighbours, mask)
 
         # Self-attend
-        y = self.att(q_x,kv_x)
+        y = self.att(q_x,kv_x,kv_mask)
 
         # First residual connection
         # x = q_x + y
@@ -342,7 +367,7 @@ class MultiHeadAdditiveAttentionBlock(nn.Module):
         return q_x, kv_x
 
 class MultiHeadAdditiveAttentionBlockBasic(nn.Module):
-    def __init__(self, q_dim, kv_dim, num_heads):
+    def __init__(self, q_dim, kv_dim, num_heads, num_neighbours=10):
         """
         Basic transformer block.
 
@@ -354,8 +379,9 @@ class MultiHeadAdditiveAttentionBlockBasic(nn.Module):
         super(MultiHeadAdditiveAttentionBlockBasic, self).__init__()
 
         self.att = RelativeAdditiveAttentionMultiHead(q_dim, kv_dim, num_heads)
+        self.num_neighbours = num_neighbours
 
-    def forward(self, state):
+    def forward(self, state, mask=None):
         """
         Forward pass of trasformer block.
 
@@ -366,9 +392,9 @@ class MultiHeadAdditiveAttentionBlockBasic(nn.Module):
             y: output with shape of (b, k)
         """
 
-        q_x, kv_x = query_key_from_state(state)
+        q_x, kv_x, kv_mask = query_key_from_state(state, self.num_neighbours, mask)
 
         # Self-attend
-        y = self.att(q_x,kv_x)
+        y = self.att(q_x,kv_x,kv_mask)
 
         return y, q_x, kv_x
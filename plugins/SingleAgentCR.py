@@ -2,6 +2,8 @@ from bluesky import core, stack, traf, tools, settings
 from stable_baselines3 import SAC
 import numpy as np
 import plugins.SingleAgentCRTools as SACR
+from bluesky.tools.aero import kts
+import plugins.CommonTools.functions as fn
 
 # TODO make this such that you can select the algorithm in settings
 settings.set_variable_defaults(SingleAgentCR_alg='SB3-SAC')
@@ -27,12 +29,14 @@ class SingleAgentConflictResolution(core.Entity):
 
     @core.timed_function(name='SingleAgentConflictResolution', dt=SACR.constants.TIMESTEP)
     def update(self):
-        for id in traf.id:
-            idx = traf.id2idx(id)
+        actions = []
+        for idx in range(traf.ntraf):
             obs = self._get_obs(idx)
             clipped_obs = {key: np.clip(arr, -1.2, 1.2) for key, arr in obs.items()}
             action, _ = self.model.predict(clipped_obs, deterministic=True)
-            self._set_action(action,idx)
+            actions.append(action)
+        if actions:
+            self._set_action(np.array(actions), np.arange(traf.ntraf))
     
     def create(self, n=1):
         super().create(n)
@@ -118,11 +122,9 @@ class SingleAgentConflictResolution(core.Entity):
         return observation
     
     def _set_action(self, action, idx):
-        dh = action[0] * SACR.constants.D_HEADING
-        dv = action[1] * SACR.constants.D_VELOCITY
-        heading_new = SACR.functions.bound_angle_positive_negative_180(traf.hdg[idx] + dh)
+        dh = action[:,0] * SACR.constants.D_HEADING
+        dv = action[:,1] * SACR.constants.D_VELOCITY
+        heading_new = fn.bound_angle_positive_negative_180(traf.hdg[idx] + dh)
         speed_new = (traf.cas[idx] + dv) * SACR.constants.MpS2Kt
 
-        id = traf.id[idx]
-        stack.stack(f"HDG {id} {heading_new}")
-        stack.stack(f"SPD {id} {speed_new}")
\ No newline at end of file
+        traf.ap.set_targets(idx, hdg=heading_new, casmach=speed_new * kts)
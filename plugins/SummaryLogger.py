@@ -32,7 +32,7 @@ class SummaryLogger(core.Entity):
         self.noise_logger = noise_logger.NoiseLogger()
         self.fuel_logger = fuel_logger.FuelLogger()
 
-        # for intrusions, look at traf.cd.lospairs_all & traf.cd.lospairs_unique
+        # for intrusions, look at traf.cd.nlos_tot & traf.cd.nlos_cur
 
         columns = ["ACID", "total_noise", "total_fuel", "flight_time"]
         self.data = pd.DataFrame(columns=columns)
@@ -68,8 +68,8 @@ class SummaryLogger(core.Entity):
 
         self.data = merged_df[['ACID', 'total_noise', 'total_fuel', 'flight_time']].sort_values('ACID').reset_index(drop=True)
 
-        self.total_intrusions = len(traf.cd.lospairs_all)
-        self.total_conflicts = len(traf.cd.confpairs_all)
+        self.total_intrusions = traf.cd.nlos_tot
+        self.total_conflicts = traf.cd.nconf_tot
 
     @core.timed_function(dt=SAVE_INTERVAL)
     def save(self):
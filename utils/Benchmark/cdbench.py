@@ -0,0 +1,384 @@
+''' Headless benchmark of conflict detection and resolution in BlueSky.
+
+    Sweeps the number of aircraft and the traffic density over the synthetic
+    conflict geometries (SPHERE, FUNNEL, MATRIX, WALL), uniform random
+    traffic, and TrafficGenerator demand levels. For every case and every
+    combination of CD and CR method, the conflict detection, conflict
+    resolution, resume navigation, performance and autopilot updates are
+    timed separately, and the results are written as JSON and/or CSV with
+    percentiles and peak memory.
+
+    A previous JSON result can be given as baseline. The benchmark then
+    compares every timed part of every case with the baseline, and exits
+    with status 1 when one of them has become slower (or uses more memory)
+    than the baseline by more than the tolerance.
+
+    Every case runs in a separate process. Run from a BlueSky working
+    directory, for instance the root of the repository:
+
+        python utils/Benchmark/cdbench.py --cases sphere:50,100 uniform:500@2,500@8 \\
+            trafgen:600 --cdmethod STATEBASED GRIDSTATEBASED --json base.json
+
+        python utils/Benchmark/cdbench.py --cases sphere:50,100 uniform:500@2,500@8 \\
+            trafgen:600 --cdmethod STATEBASED GRIDSTATEBASED --baseline base.json
+
+    Case syntax is generator:arg,arg,... with one case per argument:
+        sphere:N, funnel:SIZE, matrix:SIZE  arguments of the SYN commands
+        wall                                 the SYN WALL geometry
+        uniform:N@D                          N aircraft at D aircraft per 10000 NM^2
+        trafgen:LEVEL                        TrafficGenerator at LEVEL aircraft per hour
+'''
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not reported
+    resource = None
+
+
+# Timed parts: name, traffic attribute, method
+PARTS = [('detect', 'cd', 'detect'),
+         ('resolve', 'cr', 'resolve'),
+         ('resumenav', 'cr', 'resumenav'),
+         ('perf', 'perf', 'update'),
+         ('ap', 'ap', 'update')]
+
+# Statistics per timed part [ms], in output order
+STATS = ['mean', 'p50', 'p90', 'p99', 'max', 'total']
+
+# Synthetic geometries and their SYN subcommand
+SYNTHETIC = {'sphere': 'SPHERE', 'funnel': 'FUNNEL', 'matrix': 'MATRIX', 'wall': 'WALL'}
+
+NM = 1852.0
+FT = 0.3048
+
+
+def parsecases(specs):
+    ''' Parse the case specifications of the command line. '''
+    cases = []
+    for spec in specs:
+        generator, _, args = spec.partition(':')
+        generator = generator.lower()
+        if generator not in SYNTHETIC and generator not in ('uniform', 'trafgen'):
+            raise ValueError(f'Unknown generator {generator}')
+        for arg in (args.split(',') if args else ['']):
+            if generator == 'uniform':
+                n, _, density = arg.partition('@')
+                cases.append(dict(generator=generator, param=arg, n=int(n),
+                                  density=float(density or 1.0)))
+            elif generator == 'wall' or generator == 'trafgen':
+                cases.append(dict(generator=generator, param=arg,
+                                  n=float(arg) if arg else None))
+            else:
+                cases.append(dict(generator=generator, param=arg, n=int(arg)))
+    return cases
+
+
+def casekey(result):
+    ''' Key that identifies a case in the results and the baseline. '''
+    return result['generator'], result['param'], result['cdmethod'], result['reso']
+
+
+def statistics(samples):
+    ''' Summary statistics in milliseconds of a list of durations in seconds. '''
+    if not samples:
+        return dict(ncalls=0, **{stat: None for stat in STATS})
+    ms = np.array(samples) * 1000.0
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return dict(ncalls=len(ms), mean=float(np.mean(ms)), p50=float(p50), p90=float(p90),
+                p99=float(p99), max=float(np.max(ms)), total=float(np.sum(ms)))
+
+
+def fmtms(value):
+    ''' Format a timing statistic, which is None for parts without calls. '''
+    return f'{"n/a":>8}' if value is None else f'{value:8.3f}'
+
+
+def maxrss():
+    ''' Peak resident memory of this process [MiB]. '''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def timeit(obj, name, samples):
+    ''' Replace method name of entity obj with a version that appends its
+        duration to samples. Replaceable entities are proxied, and the
+        proxy keeps its own copy of the bound methods of the implementation,
+        so both are replaced. '''
+    from bluesky.core.entity import getproxied, isproxied
+    impl = getproxied(obj)
+    fun = getattr(impl, name)
+
+    def timed(*args, **kwargs):
+        t0 = time.perf_counter()
+        result = fun(*args, **kwargs)
+        samples.append(time.perf_counter() - t0)
+        return result
+
+    setattr(impl, name, timed)
+    if isproxied(obj):
+        obj.__dict__[name] = timed
+
+
+def createuniform(n, density, seed):
+    ''' Create n aircraft at random positions, headings, speeds and flight
+        levels in a square around EHAM, with density aircraft per 10000 NM^2. '''
+    import bluesky as bs
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(n / density * 1e4) * NM
+    lat0, lon0 = 52.3, 4.76
+    dlat = np.degrees(side / 6371000.0) / 2
+    dlon = dlat / np.cos(np.radians(lat0))
+    bs.traf.cre([f'AC{i:05d}' for i in range(n)], 'A320',
+                lat0 + rng.uniform(-dlat, dlat, n), lon0 + rng.uniform(-dlon, dlon, n),
+                rng.uniform(0.0, 360.0, n), rng.choice([200., 240., 280.], n) * 100 * FT,
+                rng.uniform(120.0, 160.0, n))
+
+
+def runcase(case):
+    ''' Set up and time a single case. Runs in its own process. '''
+    # BlueSky and the plugins are imported from the working directory
+    sys.path.insert(0, os.getcwd())
+    import bluesky as bs
+    bs.init(mode='sim', detached=True,
+            workdir=Path(case['workdir']) if case['workdir'] else None)
+    from bluesky import stack
+
+    def process(*cmds):
+        for cmd in cmds:
+            stack.stack(cmd)
+        bs.sim.step()
+
+    generator = case['generator']
+    if generator in SYNTHETIC:
+        process('PLUGIN LOAD SYNTHETIC')
+        process(f'SYN {SYNTHETIC[generator]} {case["param"]}'.strip())
+    elif generator == 'uniform':
+        createuniform(case['n'], case['density'], case['seed'])
+    else:
+        bs.settings.TrafficDemandLevel = case['n']
+        process('PLUGIN LOAD TRAFFICGENERATOR')
+    process(f'CDMETHOD {case["cdmethod"]}', f'RESO {case["reso"]}', *case['commands'])
+    bs.sim.op()
+
+    # Warm up, so that the timed period starts with traffic in conflict
+    while bs.sim.simt < case['warmup']:
+        bs.sim.step()
+    ntrafstart = bs.traf.ntraf
+    rsssetup = maxrss()
+
+    samples = {name: [] for name, _, _ in PARTS}
+    samples['step'] = []
+    for name, parent, method in PARTS:
+        timeit(getattr(bs.traf, parent), method, samples[name])
+
+    if case['tracemalloc']:
+        tracemalloc.start()
+    tend = bs.sim.simt + case['duration']
+    nconf = []
+    while bs.sim.simt < tend:
+        t0 = time.perf_counter()
+        bs.sim.step()
+        samples['step'].append(time.perf_counter() - t0)
+        nconf.append(len(bs.traf.cd.confpairs))
+    tracepeak = None
+    if case['tracemalloc']:
+        tracepeak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    return dict(ntraf_start=ntrafstart, ntraf_end=bs.traf.ntraf,
+                nconf_mean=float(np.mean(nconf)) if nconf else 0.0,
+                nconf_max=int(np.max(nconf)) if nconf else 0,
+                nsteps=len(samples['step']),
+                timing={name: statistics(s) for name, s in samples.items()},
+                rss_setup_mib=rsssetup, maxrss_mib=maxrss(),
+                tracemalloc_peak_mib=tracepeak)
+
+
+def runsubprocess(case, verbose):
+    ''' Run a case in a separate process, and return its result. '''
+    fd, fname = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--case',
+                               json.dumps(case), '--result', fname],
+                              capture_output=not verbose, text=True)
+        if proc.returncode != 0:
+            error = (proc.stderr or '').strip().splitlines()[-1:] or ['unknown error']
+            return dict(error=error[0])
+        with open(fname) as f:
+            return json.load(f)
+    finally:
+        os.remove(fname)
+
+
+def compare(results, baseline, metric, tolerance, minms):
+    ''' Compare results with a baseline. Returns a list of comparison rows
+        (case key, part, baseline value, new value, ratio, regressed). '''
+    base = {casekey(b): b for b in baseline['results'] if 'error' not in b}
+    rows = []
+    for result in results:
+        old = base.get(casekey(result))
+        if old is None:
+            continue
+        if 'error' in result:
+            # A case that fails now but didn't in the baseline
+            rows.append((casekey(result), 'error', None, None, None, True))
+            continue
+        for part, stats in result['timing'].items():
+            oldstats = old['timing'].get(part)
+            if not oldstats or stats[metric] is None or oldstats[metric] is None:
+                continue
+            new, ref = stats[metric], oldstats[metric]
+            ratio = new / ref if ref > 0.0 else float('inf')
+            regressed = ratio > 1.0 + tolerance and new - ref > minms
+            rows.append((casekey(result), part, ref, new, ratio, regressed))
+        if result['maxrss_mib'] and old.get('maxrss_mib'):
+            new, ref = result['maxrss_mib'], old['maxrss_mib']
+            rows.append((casekey(result), 'maxrss', ref, new, new / ref,
+                         new / ref > 1.0 + tolerance))
+    return rows
+
+
+def writecsv(fname, results):
+    ''' Write one row per case and timed part. '''
+    with open(fname, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['generator', 'param', 'cdmethod', 'reso', 'ntraf_start', 'ntraf_end',
+                         'nconf_mean', 'part', 'ncalls'] + [f'{s}_ms' for s in STATS] +
+                        ['rss_setup_mib', 'maxrss_mib', 'error'])
+        for r in results:
+            case = [r['generator'], r['param'], r['cdmethod'], r['reso']]
+            if 'error' in r:
+                writer.writerow(case + [''] * (5 + len(STATS) + 2) + [r['error']])
+                continue
+            for part, stats in r['timing'].items():
+                writer.writerow(case + [r['ntraf_start'], r['ntraf_end'], r['nconf_mean'],
+                                        part, stats['ncalls']] +
+                                [stats[s] for s in STATS] +
+                                [r['rss_setup_mib'], r['maxrss_mib'], ''])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Headless benchmark of BlueSky conflict detection and resolution.',
+        formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('--cases', nargs='+', default=['sphere:20,50', 'uniform:200@2,200@8'],
+                        help='Cases to run, as generator:arg,arg,...')
+    parser.add_argument('--cdmethod', nargs='+', default=['STATEBASED'],
+                        help='Conflict detection methods')
+    parser.add_argument('--reso', nargs='+', default=['MVP'],
+                        help='Conflict resolution methods (OFF for none)')
+    parser.add_argument('--command', nargs='*', default=[],
+                        help='Extra stack commands to run after setting up each case')
+    parser.add_argument('--warmup', type=float, default=10.0,
+                        help='Simulated time before timing starts [s]')
+    parser.add_argument('--duration', type=float, default=60.0,
+                        help='Simulated time that is timed [s]')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Run every case this many times, and keep the fastest run')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for uniform traffic')
+    parser.add_argument('--workdir', default=None, help='BlueSky working directory')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='Also measure the peak of traced allocations (slow)')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--csv', help='Write results to this CSV file')
+    parser.add_argument('--baseline', help='JSON result to compare with')
+    parser.add_argument('--metric', default='p50', choices=STATS,
+                        help='Statistic to compare with the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative increase compared to the baseline')
+    parser.add_argument('--minms', type=float, default=0.05,
+                        help='Timing differences below this are never a regression [ms]')
+    parser.add_argument('--verbose', action='store_true', help='Show BlueSky output')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Worker process for a single case
+        case = json.loads(args.case)
+        with contextlib.redirect_stdout(sys.stdout if case['verbose'] else io.StringIO()):
+            result = runcase(case)
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = []
+    for case in parsecases(args.cases):
+        for cdmethod in args.cdmethod:
+            for reso in args.reso:
+                case.update(cdmethod=cdmethod.upper(), reso=reso.upper(), warmup=args.warmup,
+                            duration=args.duration, seed=args.seed, workdir=args.workdir,
+                            commands=args.command, tracemalloc=args.tracemalloc,
+                            verbose=args.verbose)
+                name = f'{case["generator"]}:{case["param"]} {case["cdmethod"]} {case["reso"]}'
+                print(f'{name:48}', end='', flush=True)
+                # Keep the run with the lowest total step time, as other
+                # processes on the machine can only make a run slower
+                runs = [runsubprocess(case, args.verbose) for _ in range(max(1, args.repeat))]
+                valid = [run for run in runs if 'error' not in run]
+                result = dict(case)
+                result.update(min(valid, key=lambda run: run['timing']['step']['total'] or 0.0)
+                              if valid else runs[0])
+                results.append(result)
+                if 'error' in result:
+                    print(f'failed: {result["error"]}')
+                    continue
+                timing = result['timing']
+                print(f'{result["ntraf_start"]:6d} ac  step {fmtms(timing["step"]["mean"])} ms  ' +
+                      f'detect {fmtms(timing["detect"]["p50"])} ms  ' +
+                      (f'maxrss {result["maxrss_mib"]:.0f} MiB' if result['maxrss_mib'] else ''))
+
+    meta = dict(date=datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                numpy=np.__version__, platform=platform.platform(), cpu_count=os.cpu_count(),
+                argv=sys.argv[1:])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(meta=meta, results=results), f, indent=1)
+    if args.csv:
+        writecsv(args.csv, results)
+
+    if baseline is None:
+        return 0
+
+    rows = compare(results, baseline, args.metric, args.tolerance, args.minms)
+    print(f'\nComparison of {args.metric} with baseline {args.baseline} '
+          f'({baseline["meta"]["date"]}), tolerance {args.tolerance:.0%}:')
+    for key, part, ref, new, ratio, regressed in rows:
+        if part == 'error':
+            print(f'{" ".join(key):48}failed  REGRESSION')
+            continue
+        print(f'{" ".join(key):48}{part:10}{ref:12.3f}{new:12.3f}{ratio:8.2f}' +
+              ('  REGRESSION' if regressed else ''))
+    nregressed = sum(row[-1] for row in rows)
+    print(f'{nregressed} regressions in {len(rows)} comparisons')
+    return 1 if nregressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())